@@ -0,0 +1,277 @@
+# BUILTIN
+import argparse
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+# CUSTOM
+from lazy import lazy_import
+from settings import config
+# Imported on first use, archives are optional (see lazy.py)
+tarfile = lazy_import('tarfile')
+zipfile = lazy_import('zipfile')
+
+FORMATS = ('tar', 'zip')
+BLOCK_SIZE = 512  # Tar's
+# Characters of a source URL which can't be part of an archive's name
+UNSAFE_NAME_RE = re.compile(r'[^\w.-]+')
+
+
+def get_padded_size(size):
+    """
+    Size of a tar member's data, rounded up to whole blocks.
+    """
+    return -(-size // BLOCK_SIZE) * BLOCK_SIZE
+
+
+def is_member(path):
+    """
+    Check if a path points into an archive (the archive being the "folder" of the member).
+    """
+    folder = os.path.dirname(path)
+    return folder.endswith(tuple(f'.{format_}' for format_ in FORMATS)) and os.path.isfile(folder)
+
+
+def read_index(archive_path):
+    """
+    Get the index of an archive, as {member name: entry}.
+    Entries hold the offset and size of the member's data, so it can be read directly.
+    """
+    index = {}
+    index_path = f'{archive_path}.index'
+    if os.path.exists(index_path):
+        with open(index_path, encoding='utf-8') as index_file:
+            for line in index_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Cut off by a crash, the member gets downloaded again
+                    continue
+                index[entry['name']] = entry
+    return index
+
+
+def read_member(archive_path, name, index=None):
+    """
+    Read a member of an archive by seeking to its data, without scanning the archive.
+    """
+    if index is None:
+        index = read_index(archive_path)
+    entry = index[name]
+    with open(archive_path, 'rb') as archive_file:
+        archive_file.seek(entry['offset'])
+        return archive_file.read(entry['size'])
+
+
+class Archive:
+    """
+    A tar or zip file which files get appended to one by one, plus its index
+    (<archive>.index, a JSON line per member with the offset and size of its data).
+    Members are stored uncompressed (images and videos are compressed already),
+    so the index allows reading any of them with a single seek. The index is written
+    as members are added, it stays usable even if the archive never got closed.
+    A member only gets its index line once its data is on the disk, according to
+    config.fsync_policy (see storage.FsyncQueue): right away with 'file', for groups of
+    config.fsync_batch_size members and on closing with 'batch'. Members without an
+    index line don't count as downloaded and get downloaded again.
+    """
+    __slots__ = ('path', 'format', 'file', 'zip_file', 'index_file', 'end', 'pending')
+
+    def __init__(self, path, format_):
+        self.path = path
+        self.format = format_
+        # Empty if it was just reserved, see ArchiveStore.get_archive_name
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'w+b' if is_new else 'r+b')
+        self.index_file = open(f'{path}.index', 'a', encoding='utf-8')
+        self.pending = []  # Index lines of members waiting for their data to be synced
+
+        self.zip_file = None
+        self.end = 0  # Where the next tar member goes, over the end-of-archive blocks
+        if format_ == 'zip':
+            self.zip_file = zipfile.ZipFile(self.file, mode='w' if is_new else 'a')
+        else:
+            for entry in read_index(path).values():
+                self.end = max(self.end, entry['offset'] + get_padded_size(entry['size']))
+
+    def add(self, name, data, url=None):
+        """
+        Append a file's content as a member, return the offset of its data.
+        """
+        if self.format == 'zip':
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            self.zip_file.writestr(info, data)
+            # The local header gets rewritten in place, the data ends where the file is now
+            offset = self.file.tell() - len(data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = time.time()
+            info.mode = 0o644
+            header = info.tobuf(format=tarfile.PAX_FORMAT, encoding='utf-8')
+
+            self.file.seek(self.end)
+            self.file.write(header)
+            offset = self.end + len(header)
+            self.file.write(data)
+            self.file.write(b'\0' * (get_padded_size(len(data)) - len(data)))
+            self.end = offset + get_padded_size(len(data))
+
+        self.pending.append(json.dumps({'name': name, 'offset': offset, 'size': len(data),
+                                        'url': url}) + '\n')
+        if config.fsync_policy != 'batch' or len(self.pending) >= config.fsync_batch_size:
+            self.write_index()
+        return offset
+
+    def write_index(self):
+        """
+        Write the index lines of the pending members, after making sure their data
+        is on the disk (unless fsync_policy leaves that to the operating system).
+        """
+        if not self.pending:
+            return
+        self.file.flush()
+        if config.fsync_policy is not None:
+            os.fsync(self.file.fileno())
+        self.index_file.writelines(self.pending)
+        self.index_file.flush()
+        self.pending = []
+
+    def close(self):
+        """
+        Finish the archive so other programs can read it (zip's central directory,
+        tar's end-of-archive blocks). Appending to it later is fine.
+        """
+        if self.zip_file is not None:
+            self.zip_file.close()
+        else:
+            self.file.seek(self.end)
+            self.file.write(b'\0' * (2 * BLOCK_SIZE))
+            self.file.truncate()
+        self.write_index()
+        self.file.close()
+        self.index_file.close()
+
+
+class ArchiveStore:
+    """
+    Put downloaded files into archives in the download folder instead of
+    single files, which saves inodes and makes scanning and backing up the folder fast.
+    Depending on config.archive_group, there's one archive per batch or one per
+    entered URL (source). Archives are closed at the end of every batch, the
+    archives of sources get appended to whenever the source comes up again.
+    """
+    __slots__ = ('dl_folder', 'format', 'archives', 'names', 'batch_name', 'paths', 'lock')
+
+    def __init__(self, dl_folder, format_=None):
+        self.dl_folder = dl_folder
+        self.format = format_ or config.archive_format
+        self.archives = {}  # Name -> open Archive
+        self.names = None  # Names of all archived files, read on first use
+        self.batch_name = None
+        self.paths = {}  # URL -> path of its member (archive/name), for the batch
+        self.lock = threading.Lock()
+
+    def load_names(self):
+        """
+        Collect the names of the files in all archives of the download folder.
+        Must hold the lock.
+        """
+        self.names = set()
+        if not os.path.isdir(self.dl_folder):
+            return
+        for file_name in os.listdir(self.dl_folder):
+            if file_name.endswith(f'.{self.format}.index'):
+                self.names.update(read_index(os.path.join(self.dl_folder, file_name[:-6])))
+
+    def __contains__(self, name):
+        with self.lock:
+            if self.names is None:
+                self.load_names()
+            return name in self.names
+
+    def get_archive_name(self, source):
+        """
+        Get the name of the archive a file of the given source goes into.
+        """
+        if config.archive_group == 'source' and source is not None:
+            return UNSAFE_NAME_RE.sub('_', source.split('://')[-1]).strip('_')[:150]
+
+        if self.batch_name is None:
+            os.makedirs(self.dl_folder, exist_ok=True)
+            name = f'batch-{time.strftime("%Y%m%d-%H%M%S")}'
+            # Batches (of other scrapers or workers) may start within the same second,
+            # the name is taken by creating the file
+            for counter in itertools.count(1):
+                batch_name = name if counter == 1 else f'{name}-{counter}'
+                try:
+                    open(os.path.join(self.dl_folder, f'{batch_name}.{self.format}'), 'xb').close()
+                except FileExistsError:
+                    continue
+                self.batch_name = batch_name
+                break
+        return self.batch_name
+
+    def add(self, source, name, data, url=None):
+        """
+        Append a downloaded file to its archive, return the path of the member.
+        """
+        with self.lock:
+            archive_name = f'{self.get_archive_name(source)}.{self.format}'
+            archive = self.archives.get(archive_name)
+            if archive is None:
+                os.makedirs(self.dl_folder, exist_ok=True)
+                archive = Archive(os.path.join(self.dl_folder, archive_name), self.format)
+                self.archives[archive_name] = archive
+
+            archive.add(name, data, url)
+            if self.names is not None:
+                self.names.add(name)
+            path = os.path.join(archive.path, name)
+            self.paths[url] = path
+            return path
+
+    def close(self):
+        """
+        Close the archives of the batch, the next batch starts a new one.
+        """
+        with self.lock:
+            for archive in self.archives.values():
+                archive.close()
+            self.archives = {}
+            self.batch_name = None
+            self.paths = {}
+
+
+def main():
+    """
+    List the files of an archive or extract one of them, using its index, e.g.
+        python archive.py downloads/batch-20190601-120000.tar
+        python archive.py downloads/batch-20190601-120000.tar abc.jpg > abc.jpg
+    """
+    parser = argparse.ArgumentParser(description='Read archives of downloaded files')
+    parser.add_argument('archive')
+    parser.add_argument('name', nargs='?', help='file to write to stdout')
+    args = parser.parse_args()
+
+    index = read_index(args.archive)
+    if not index:
+        parser.error(f'No index for {args.archive}')
+
+    if args.name is None:
+        for entry in index.values():
+            print(f'{entry["size"]:>12}  {entry["name"]}  {entry["url"] or ""}')
+        print(f'{len(index)} file(s)')
+        return
+
+    if args.name not in index:
+        parser.error(f'{args.name} is not in {args.archive}')
+    sys.stdout.buffer.write(read_member(args.archive, args.name, index))
+
+
+if __name__ == '__main__':
+    main()
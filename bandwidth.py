@@ -0,0 +1,155 @@
+# BUILTIN
+import datetime
+import threading
+import time
+from urllib.parse import urlsplit
+# CUSTOM
+from settings import config
+
+
+class TokenBucket:
+    """
+    Allow on average rate bytes per second, with bursts of up to a second's worth.
+    A rate of None means unlimited.
+    """
+    __slots__ = ('rate', 'tokens', 'updated', 'lock')
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.tokens = rate or 0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.refill()
+            self.rate = rate
+            if rate is not None:
+                self.tokens = min(self.tokens, rate)
+
+    def refill(self):
+        """
+        Add the tokens accumulated since the last call. Must hold the lock.
+        """
+        now = time.monotonic()
+        if self.rate is not None:
+            self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.rate)
+        self.updated = now
+
+    def get_delay(self, amount):
+        """
+        Take the tokens for amount bytes and return the seconds to wait before using them.
+        Chunks larger than the bucket go into debt, which later callers have to wait out too.
+        """
+        with self.lock:
+            if self.rate is None:
+                return 0
+            self.refill()
+            self.tokens -= amount
+            return max(-self.tokens / self.rate, 0)
+
+
+class Shaper:
+    """
+    Cap the download speed globally and per host, using a token bucket each.
+    The caps follow the time windows in the config (e.g. throttled during the day,
+    full speed at night) unless they are overridden at runtime.
+    """
+    __slots__ = ('global_bucket', 'host_buckets', 'override', 'checked', 'limits', 'lock')
+
+    def __init__(self):
+        self.global_bucket = TokenBucket()
+        self.host_buckets = {}
+        self.override = None  # (limit, host_limit) set at runtime, None to follow the config
+        self.checked = 0  # When the time windows were last checked (monotonic)
+        self.limits = (None, None)
+        self.lock = threading.Lock()
+        self.update_limits(force=True)
+
+    @staticmethod
+    def parse_time(text):
+        hours, minutes = text.split(':')
+        return datetime.time(int(hours), int(minutes))
+
+    def get_scheduled_limits(self, now=None):
+        """
+        Get the (limit, host_limit) of the time window the given time falls into,
+        or the default limits outside of all windows.
+        """
+        now = (now or datetime.datetime.now()).time()
+        for start, end, limit, host_limit in config.bandwidth_windows:
+            start, end = self.parse_time(start), self.parse_time(end)
+            if start <= end:
+                is_inside = start <= now < end
+            else:
+                # Wraps around midnight, e.g. 22:00 - 06:00
+                is_inside = now >= start or now < end
+            if is_inside:
+                return limit, host_limit
+        return config.bandwidth_limit, config.bandwidth_host_limit
+
+    def set_limits(self, limit, host_limit):
+        """
+        Override the limits (bytes per second, None for unlimited) until reset_limits.
+        Takes effect for running downloads as well.
+        """
+        with self.lock:
+            self.override = (limit, host_limit)
+        self.update_limits(force=True)
+
+    def reset_limits(self):
+        """
+        Follow the time windows of the config again.
+        """
+        with self.lock:
+            self.override = None
+        self.update_limits(force=True)
+
+    def update_limits(self, force=False):
+        """
+        Apply the current limits to all buckets, checking the time windows once a second.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.checked < 1:
+                return
+            self.checked = now
+
+            limits = self.override or self.get_scheduled_limits()
+            if limits == self.limits and not force:
+                return
+            self.limits = limits
+
+            limit, host_limit = limits
+            self.global_bucket.set_rate(limit)
+            for bucket in self.host_buckets.values():
+                bucket.set_rate(host_limit)
+
+    def get_host_bucket(self, host):
+        with self.lock:
+            if host not in self.host_buckets:
+                self.host_buckets[host] = TokenBucket(self.limits[1])
+            return self.host_buckets[host]
+
+    def throttle(self, url, amount):
+        """
+        Account for amount bytes received from url and sleep as long as needed
+        to stay below the global and the host's limit.
+        """
+        self.update_limits()
+        host_bucket = self.get_host_bucket(urlsplit(url).hostname)
+        delay = max(self.global_bucket.get_delay(amount), host_bucket.get_delay(amount))
+        if delay > 0:
+            time.sleep(delay)
+
+    def as_dict(self):
+        limit, host_limit = self.limits
+        return {
+            'limit': limit,
+            'host_limit': host_limit,
+            'overridden': self.override is not None,
+        }
+
+
+# Shared by all downloads of the process, so the limits hold across threads
+shaper = Shaper()
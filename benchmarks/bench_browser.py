@@ -0,0 +1,95 @@
+"""
+Compare the lean browser profile against a full one.
+Starts Chrome once per profile, visits every URL a few times and reports
+the median navigation time (until the page is ready to be read)
+and Chrome's memory use (RSS of all its processes, Linux only) afterwards.
+
+    python benchmarks/bench_browser.py [--runs N] [--headless] [--page-load-strategy S]
+                                       [PROFILE:URL ...]
+
+PROFILE is one of the site profiles in profiles.py, e.g. json:https://www.reddit.com/r/pics/.json
+--headless and --page-load-strategy override the driver_* settings for the lean profile,
+to see whether changing their defaults pays off.
+The full profile shows a window, on a server run this under xvfb-run.
+"""
+# BUILTIN
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# CUSTOM
+from driver import Driver, get_memory  # noqa: E402
+from service import ConsoleLog  # noqa: E402
+from settings import config  # noqa: E402
+
+DEFAULT_PAGES = [
+    ('instagram', 'https://www.instagram.com/p/BxKRx5CHn5i/'),
+    ('imgur', 'https://imgur.com/gallery/5tJJkY3'),
+    ('json', 'https://www.reddit.com/r/pics/top/.json'),
+    ('twitter', 'https://twitter.com/NASA/status/1134859868346347520'),
+]
+
+
+def measure(lean, pages, runs):
+    """
+    Visit the pages with one browser profile.
+    Return the median navigation time (ms) per URL and the memory (MiB) afterwards.
+    """
+    driver = Driver(ConsoleLog(), lean=lean)
+    driver.start_driver()
+    try:
+        times = {}
+        for profile, url in pages:
+            samples = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                driver.navigate(url, profile=profile)
+                samples.append((time.perf_counter() - start) * 1000)
+                driver.navigate('about:blank')
+            times[url] = statistics.median(samples)
+
+        # Visit every page once more and leave the last one open, as when scraping
+        for profile, url in pages:
+            driver.navigate(url, profile=profile)
+        memory = get_memory(driver.webdriver.service.process.pid)
+    finally:
+        driver.quit_driver()
+    return times, memory
+
+
+def parse_pages(values):
+    pages = []
+    for value in values:
+        profile, _, url = value.partition(':')
+        pages.append((profile, url))
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Lean vs. full browser profile')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--headless', action='store_true')
+    parser.add_argument('--page-load-strategy', choices=('normal', 'eager', 'none'))
+    parser.add_argument('pages', nargs='*', metavar='PROFILE:URL')
+    args = parser.parse_args()
+    pages = parse_pages(args.pages) or DEFAULT_PAGES
+    if args.headless:
+        config.driver_headless = True
+    if args.page_load_strategy is not None:
+        config.driver_page_load_strategy = args.page_load_strategy
+
+    full_times, full_memory = measure(False, pages, args.runs)
+    lean_times, lean_memory = measure(True, pages, args.runs)
+
+    print(f'{"URL":<60} {"full (ms)":>10} {"lean (ms)":>10}')
+    for _, url in pages:
+        print(f'{url[:60]:<60} {full_times[url]:>10.0f} {lean_times[url]:>10.0f}')
+    print(f'{"Total":<60} {sum(full_times.values()):>10.0f} {sum(lean_times.values()):>10.0f}')
+    print(f'Chrome memory: {full_memory:.0f} MiB full, {lean_memory:.0f} MiB lean')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Exercise the proxy pool against local stand-ins, without touching the network.
+Starts a local origin server and forwarding proxies which are fast, slow and
+broken (nothing listening), sends requests to several hosts through the pool
+and reports how the requests got spread and which proxies got drained.
+
+    python benchmarks/bench_proxies.py [--requests N] [--assignment sticky|round_robin]
+
+The origin limits each client IP to --ip-rate requests per second (answering 429 beyond
+that), like a CDN would. Direct requests all come from 127.0.0.1, the proxies get
+their own IPs by connecting from 127.0.0.2, 127.0.0.3, ... (Linux only).
+"""
+# BUILTIN
+import argparse
+import collections
+import os
+import socket
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# CUSTOM
+import proxies  # noqa: E402
+from settings import config  # noqa: E402
+
+
+class OriginHandler(BaseHTTPRequestHandler):
+    """
+    Answer every request with a small body, rate limited per client IP.
+    """
+    ip_rate = 200
+    seen = collections.defaultdict(collections.deque)
+    lock = threading.Lock()
+
+    def do_GET(self):
+        now = time.monotonic()
+        with self.lock:
+            times = self.seen[self.client_address[0]]
+            while times and times[0] < now - 1:
+                times.popleft()
+            limited = len(times) >= self.ip_rate
+            if not limited:
+                times.append(now)
+
+        body = b'x' * 1024
+        self.send_response(429 if limited else 200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format_, *args):
+        pass
+
+
+def get_proxy_handler(source_ip, delay):
+    """
+    Build a forwarding proxy handler connecting from source_ip, after waiting delay seconds.
+    """
+    class ProxyHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            time.sleep(delay)
+            # Proxied requests carry the whole URL as their path
+            host, port = self.path.split('/')[2].split(':')
+            connection = socket.create_connection((host, int(port)), source_address=(source_ip, 0))
+            try:
+                connection.sendall(f'GET {self.path} HTTP/1.0\r\nHost: {host}\r\n\r\n'.encode())
+                response = b''
+                while True:
+                    data = connection.recv(65536)
+                    if not data:
+                        break
+                    response += data
+            finally:
+                connection.close()
+            self.wfile.write(response)
+
+        def log_message(self, format_, *args):
+            pass
+
+    return ProxyHandler
+
+
+def start_server(address, handler):
+    server = ThreadingHTTPServer(address, handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run(urls, pool, amount):
+    """
+    Request the URLs in turn, return the elapsed seconds and the status counts.
+    """
+    statuses = collections.Counter()
+    start = time.perf_counter()
+    for index in range(amount):
+        url = urls[index % len(urls)]
+        try:
+            if pool is None:
+                res = urllib.request.urlopen(url)
+                statuses[res.status] += 1
+            else:
+                statuses[pool.request('GET', url, timeout=5).status_code] += 1
+        except urllib.error.HTTPError as e:
+            statuses[e.code] += 1
+        except Exception as e:
+            statuses[type(e).__name__] += 1
+    return time.perf_counter() - start, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Proxy pool against local stand-ins')
+    parser.add_argument('--requests', type=int, default=600)
+    parser.add_argument('--assignment', default='sticky', choices=('sticky', 'round_robin'))
+    parser.add_argument('--ip-rate', type=int, default=200,
+                        help='requests per second the origin allows per client IP')
+    args = parser.parse_args()
+
+    config.proxy_assignment = args.assignment
+    config.proxy_drain_time = 60
+    OriginHandler.ip_rate = args.ip_rate
+
+    origin = start_server(('0.0.0.0', 0), OriginHandler)
+    port = origin.server_address[1]
+    # Several hosts, all pointing at the origin
+    urls = [f'http://127.0.0.{host}:{port}/file' for host in range(10, 16)]
+
+    stand_ins = {
+        'fast-1': ('127.0.0.2', 0.005),
+        'fast-2': ('127.0.0.3', 0.005),
+        'fast-3': ('127.0.0.4', 0.005),
+        'slow': ('127.0.0.5', 0.3),
+    }
+    proxy_urls = {}
+    for name, (source_ip, delay) in stand_ins.items():
+        server = start_server(('127.0.0.1', 0), get_proxy_handler(source_ip, delay))
+        proxy_urls[name] = f'http://127.0.0.1:{server.server_address[1]}'
+    # Nothing listens there, every connection gets refused
+    proxy_urls['broken'] = f'http://127.0.0.1:{get_free_port()}'
+
+    elapsed, statuses = run(urls, None, args.requests)
+    print(f'Direct:     {elapsed:6.2f}s  {dict(statuses)}')
+
+    pool = proxies.ProxyPool(proxy_urls.values())
+    elapsed, statuses = run(urls, pool, args.requests)
+    print(f'Proxy pool: {elapsed:6.2f}s  {dict(statuses)}  ({args.assignment})')
+
+    names = {url: name for name, url in proxy_urls.items()}
+    for proxy in pool.as_dict()['proxies']:
+        latency = proxy['latency']
+        print(f'  {names[proxy["url"]]:<8} latency {latency * 1000 if latency else 0:6.1f} ms,'
+              f' {proxy["hosts"]} host(s), drained for {proxy["drained_for"]:4.0f}s')
+
+
+if __name__ == '__main__':
+    main()
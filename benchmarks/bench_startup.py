@@ -0,0 +1,81 @@
+"""
+Startup regression check.
+Fails (exit code 1) if importing the GUI or showing its window takes longer
+than the budget in startup_budget.json, or if one of the lazily imported
+third-party modules gets imported at startup again.
+
+    python benchmarks/bench_startup.py [--no-window] [--runs N]
+"""
+# BUILTIN
+import json
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# CUSTOM
+import startup  # noqa: E402
+
+BUDGET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_budget.json')
+
+
+def median_timings(runs, with_window):
+    """
+    Run the measurements multiple times and keep the median of every value,
+    startup times are noisy.
+    """
+    reports = [startup.report(with_window=with_window) for _ in range(runs)]
+
+    timings = {'imports': {}}
+    for name in reports[0]['imports']:
+        timings['imports'][name] = statistics.median(
+            report['imports'].get(name, 0) for report in reports
+        )
+    if with_window:
+        timings['window'] = {
+            key: statistics.median(report['window'][key] for report in reports)
+            for key in reports[0]['window']
+        }
+    return timings
+
+
+def check(timings, budget):
+    """
+    Get a list of messages describing every exceeded budget.
+    """
+    failures = []
+    for name, limit in budget['imports'].items():
+        if timings['imports'].get(name, 0) > limit:
+            failures.append(f'Importing {name} took {timings["imports"][name]:.1f} ms'
+                            f' (budget: {limit} ms)')
+
+    for name in budget['not_imported']:
+        if name in timings['imports']:
+            failures.append(f'{name} gets imported at startup')
+
+    if 'window' in timings and timings['window']['first_window'] > budget['first_window']:
+        failures.append(f'First window took {timings["window"]["first_window"]:.1f} ms'
+                        f' (budget: {budget["first_window"]} ms)')
+    return failures
+
+
+def main():
+    with_window = '--no-window' not in sys.argv
+    runs = int(sys.argv[sys.argv.index('--runs') + 1]) if '--runs' in sys.argv else 5
+
+    with open(BUDGET_PATH) as budget_file:
+        budget = json.load(budget_file)
+
+    timings = median_timings(runs, with_window)
+    startup.print_report(timings)
+
+    failures = check(timings, budget)
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    if failures:
+        sys.exit(1)
+    print('OK: Startup is within budget')
+
+
+if __name__ == '__main__':
+    main()
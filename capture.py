@@ -0,0 +1,85 @@
+# BUILTIN
+import base64
+import json
+import time
+# CUSTOM
+from lazy import lazy_import
+# PIP (imported on first use, see lazy.py)
+exceptions = lazy_import('selenium.common.exceptions')
+
+
+class NetworkCapture:
+    """
+    Get the JSON responses a page requested (or the page itself, for JSON documents)
+    from Chrome's performance log, instead of serializing and parsing the whole DOM.
+    Needs performance logging to be enabled in the capabilities, see Driver.get_capabilities.
+    """
+    __slots__ = ('webdriver', 'responses', 'finished')
+
+    json_types = ('application/json', 'text/json', 'text/javascript', 'application/javascript')
+
+    def __init__(self, webdriver):
+        self.webdriver = webdriver
+        self.responses = {}  # Request ID -> (URL, MIME type, status)
+        self.finished = set()  # Request IDs whose body arrived completely
+
+    def clear(self):
+        """
+        Forget the responses of the previous page, to be called before navigating.
+        """
+        # Reading the log empties it
+        self.webdriver.get_log('performance')
+        self.responses = {}
+        self.finished = set()
+
+    def collect(self):
+        """
+        Read the network events logged since the last call.
+        """
+        for entry in self.webdriver.get_log('performance'):
+            message = json.loads(entry['message'])['message']
+            params = message.get('params', {})
+
+            if message['method'] == 'Network.responseReceived':
+                response = params['response']
+                self.responses[params['requestId']] = (
+                    response['url'], response.get('mimeType', ''), response.get('status'),
+                )
+            elif message['method'] == 'Network.loadingFinished':
+                self.finished.add(params['requestId'])
+
+    def get_body(self, request_id):
+        body = self.webdriver.execute_cdp_cmd('Network.getResponseBody', {'requestId': request_id})
+        if body.get('base64Encoded'):
+            return base64.b64decode(body['body']).decode('utf-8')
+        return body['body']
+
+    def get_json(self, url_re, accept=None, timeout=0):
+        """
+        Get the parsed body of the first finished JSON response whose URL matches url_re
+        (and which accept, if given, returns True for).
+        Wait up to timeout seconds for one to arrive, return None if there is none.
+        """
+        deadline = time.monotonic() + timeout
+        checked = set()
+
+        while True:
+            self.collect()
+            for request_id, (url, mime_type, status) in self.responses.items():
+                if request_id in checked or request_id not in self.finished:
+                    continue
+                if status != 200 or not url_re.match(url) or mime_type not in self.json_types:
+                    continue
+                checked.add(request_id)
+
+                try:
+                    data = json.loads(self.get_body(request_id))
+                except (ValueError, exceptions.WebDriverException):
+                    # Body not retained by Chrome anymore, or not JSON after all
+                    continue
+                if accept is None or accept(data):
+                    return data
+
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.05)
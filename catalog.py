@@ -0,0 +1,171 @@
+# BUILTIN
+import argparse
+import calendar
+import datetime
+import os
+import sqlite3
+import threading
+import time
+# CUSTOM
+from settings import config
+
+COLUMNS = (
+    'url', 'path', 'source', 'site', 'owner', 'community', 'shortcode',
+    'type', 'album_index', 'posted_at', 'downloaded_at',
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    path TEXT,
+    source TEXT,
+    site TEXT,
+    owner TEXT COLLATE NOCASE,
+    community TEXT COLLATE NOCASE,
+    shortcode TEXT,
+    type TEXT,
+    album_index INTEGER,
+    posted_at INTEGER,
+    downloaded_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_owner ON files (site, owner, posted_at);
+CREATE INDEX IF NOT EXISTS files_community ON files (site, community, posted_at);
+CREATE INDEX IF NOT EXISTS files_type ON files (site, type, posted_at);
+CREATE INDEX IF NOT EXISTS files_posted_at ON files (posted_at);
+CREATE INDEX IF NOT EXISTS files_shortcode ON files (shortcode);
+CREATE INDEX IF NOT EXISTS files_url ON files (url);
+"""
+
+
+def parse_timestamp(text, text_format='%Y-%m-%d %H:%M:%S'):
+    """
+    Turn a UTC date (and time) string into a Unix timestamp.
+    """
+    return calendar.timegm(datetime.datetime.strptime(text, text_format).timetuple())
+
+
+class Catalog:
+    """
+    SQLite catalog of the downloaded files and the metadata the extractors found
+    (owner, shortcode, post time, album index, ...), so the archive can be searched
+    without walking the download folder.
+    Rows are collected and written in batches of config.catalog_batch_size.
+    """
+    __slots__ = ('path', 'connection', 'pending', 'lock')
+
+    def __init__(self, path):
+        self.path = path
+        # Downloads finish in several threads, all access goes through the lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        # Readers (e.g. queries from another process) don't block the writes of a batch
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def add(self, **row):
+        """
+        Queue a downloaded file to be written with the next batch.
+        """
+        row.setdefault('downloaded_at', int(time.time()))
+        with self.lock:
+            self.pending.append(tuple(row.get(column) for column in COLUMNS))
+            is_full = len(self.pending) >= config.catalog_batch_size
+        if is_full:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all queued rows in one transaction.
+        """
+        with self.lock:
+            if not self.pending:
+                return
+            pending, self.pending = self.pending, []
+            with self.connection:
+                self.connection.executemany(
+                    f'INSERT INTO files ({", ".join(COLUMNS)})'
+                    f' VALUES ({", ".join("?" for _ in COLUMNS)})',
+                    pending,
+                )
+
+    def query(self, site=None, owner=None, community=None, type_=None, shortcode=None,
+              since=None, until=None, limit=None):
+        """
+        Get the files matching all given criteria, newest posts first.
+        since and until are Unix timestamps (of the post, not of the download).
+        Every lookup by site and owner/community/type, by shortcode or by post time
+        is served by an index.
+        """
+        criteria = {
+            'site = ?': site,
+            'owner = ?': owner,
+            'community = ?': community,
+            'type = ?': type_,
+            'shortcode = ?': shortcode,
+            'posted_at >= ?': since,
+            'posted_at < ?': until,
+        }
+        conditions = [condition for condition, value in criteria.items() if value is not None]
+        params = [value for value in criteria.values() if value is not None]
+
+        sql = 'SELECT * FROM files'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY posted_at DESC'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        self.flush()
+        with self.lock:
+            return [dict(row) for row in self.connection.execute(sql, params)]
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.connection.close()
+
+
+def main():
+    """
+    Search the catalog from the command line, e.g.
+        python catalog.py --site instagram --owner nasa
+        python catalog.py --site reddit --type video --since 2019-05-01 --until 2019-06-01
+    """
+    parser = argparse.ArgumentParser(description='Search the catalog of downloaded files')
+    parser.add_argument('--site', help='instagram, reddit, imgur, ...')
+    parser.add_argument('--owner', help='user who posted the file')
+    parser.add_argument('--community', help='subreddit the file was posted in')
+    parser.add_argument('--type', dest='type_', help='image, video, ...')
+    parser.add_argument('--shortcode', help='ID of the post')
+    parser.add_argument('--since', help='posted at or after this day (YYYY-MM-DD, UTC)')
+    parser.add_argument('--until', help='posted before this day (YYYY-MM-DD, UTC)')
+    parser.add_argument('--limit', type=int)
+    args = vars(parser.parse_args())
+
+    for key in ('since', 'until'):
+        if args[key] is not None:
+            args[key] = parse_timestamp(args[key], '%Y-%m-%d')
+
+    if not os.path.exists(config.catalog_path):
+        parser.error(f'No catalog at {config.catalog_path} yet')
+
+    catalog = Catalog(config.catalog_path)
+    start = time.perf_counter()
+    rows = catalog.query(**args)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    for row in rows:
+        posted_at = row['posted_at']
+        if posted_at is not None:
+            posted_at = datetime.datetime.utcfromtimestamp(posted_at).strftime('%Y-%m-%d %H:%M')
+        print(f'{posted_at or "-":<16}  {row["site"] or "-":<9}  {row["owner"] or "-":<20}'
+              f'  {row["path"] or row["url"]}')
+    print(f'{len(rows)} file(s) in {elapsed:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,165 @@
-# PIP
-from selenium import webdriver
-
-
 chromedriver_path = '/absolute/path/to/chromedriver'
 
-chromedriver_options = webdriver.ChromeOptions()
-chromedriver_options.add_argument('window-size=1200x600')
+# Turned into ChromeOptions by the driver, so Selenium isn't imported along with the config
+chromedriver_arguments = ['window-size=1200x600']
 
 desired_capabilities = {'loggingPrefs': {'browser': 'INFO'}}
 
+# Lean browser profile: the extractors only read embedded JSON and meta tags,
+# so pages are loaded without images, media and ads (see profiles.py)
+driver_headless = False  # Compare with benchmarks/bench_browser.py --headless first
+# 'none' or 'eager' to not wait for the load event, each site's readiness condition
+# (see profiles.py) is waited for instead. Compare with bench_browser.py first
+driver_page_load_strategy = 'normal'
+driver_block_media = True
+driver_block_third_party = True
+driver_blocked_hosts = []  # More URL patterns to block, e.g. '*ads.example.com*'
+page_ready_timeout = 15  # Seconds
+
+# Chrome slows down over long sessions, restart it (keeping cookies and logins)
+# after this many page loads, or once its processes use more than this many MiB
+# (checked every driver_memory_check_interval page loads, Linux only). None to never
+driver_recycle_navigations = 1000
+driver_recycle_memory = 1500
+driver_memory_check_interval = 20
+
+# Take the JSON data of pages (Instagram GraphQL, Imgur albums, Reddit posts)
+# from Chrome's network log instead of parsing the page source
+capture_network = True
+
 headers = {'User-Agent': ('Mozilla/5.0 (Windows NT 6.1; Win64; x64; rv:69.0)'
                           ' Gecko/20100101 Firefox/69.0')}
 
+# v.redd.it videos are fetched from their DASH manifest and merged using ffmpeg
+ffmpeg_path = 'ffmpeg'
+dash_workers = 8  # Concurrent segment requests per rendition
+dash_chunk_size = 1024 * 1024  # Byte range size for single-file renditions
+dash_timeout = 30
+
+# Files at least this large (in bytes) get downloaded over multiple connections
+segmented_threshold = 16 * 1024 * 1024
+segmented_connections = 4
+segmented_timeout = 30
+
+# Writing files to the disk
+download_chunk_size = 256 * 1024  # Bytes read from the connection at once
+write_buffer_size = 1024 * 1024  # Bytes collected before writing to the disk
+min_free_space = 512 * 1024 * 1024  # Files which would leave less free space are skipped
+# 'file' to fsync every file and its folder, 'batch' to fsync and rename groups of files at once
+# (far fewer seeks for many small files on spinning or network storage), None to leave it to the OS
+fsync_policy = 'batch'
+fsync_batch_size = 50
+
+# Put downloaded files into archives instead of files of their own, which saves inodes
+# and speeds up scanning and backing up the folder: 'tar' or 'zip', None for single files.
+# Read them with any archive tool or python archive.py (using the archive's index)
+archive_format = None
+archive_group = 'batch'  # 'batch' for an archive per batch, 'source' for one per entered URL
+archive_max_size = 8 * 1024 * 1024  # Larger files (and videos) still get files of their own
+
+# Download links right away while further URLs are still being processed
+# (can be toggled in the GUI as well)
+stream_downloads = False
+
+# Downloads are ordered by priority and estimated size (smallest first)
+# and run on separate lanes for small and large files
+scheduler_large_size = 8 * 1024 * 1024  # Files at least this large (in bytes) use the large lane
+scheduler_small_workers = 2
+scheduler_large_workers = 1
+scheduler_probe_workers = 8  # Concurrent HEAD requests to estimate the sizes
+
+# Signed links (Instagram's CDN and others) expire, see signed.py. Those about to expire
+# get downloaded first, expired ones get resolved again from the post they were found in
+expiry_urgent_time = 30 * 60  # Seconds before their expiry links get downloaded first
+expiry_margin = 60  # Seconds before their expiry links count as expired already
+
+# Download speed limits in bytes per second, None for unlimited.
+# Applied to all downloads together and to each host on its own
+bandwidth_limit = None
+bandwidth_host_limit = None
+# Different limits for certain times of the day, as (start, end, limit, host_limit).
+# Windows may wrap around midnight, the first matching one counts,
+# outside of all windows the limits above apply. E.g. throttled during the day:
+# bandwidth_windows = [('08:00', '20:00', 2 * 1024 * 1024, 512 * 1024)]
+bandwidth_windows = []
+
+# Proxies to spread the requests over, so per-IP limits of CDNs apply to each one
+# e.g. ['http://10.0.0.2:3128', 'socks5://10.0.0.3:1080'], empty to connect directly.
+# SOCKS proxies need PySocks (pip install requests[socks]),
+# Chrome can't use proxies that need a login
+proxies = []
+# 'sticky' to send all requests to a host through the same proxy,
+# 'round_robin' to take the next proxy for every request
+proxy_assignment = 'sticky'
+proxy_max_failures = 3  # Failures in a row until a proxy gets drained
+proxy_slow_factor = 3  # Drain proxies this many times slower than the median proxy
+proxy_drain_time = 60  # Seconds a drained proxy gets no requests, doubled each time in a row
+proxy_webdriver = True  # Start the webdrivers with a proxy of the pool as well
+
+# Links added during a session are remembered in a Bloom filter to spot duplicates
+# It grows past the capacity as needed, while keeping the false positive rate
+# (new links wrongly reported as "already added") below tracking_error_rate
+tracking_capacity = 100000
+tracking_error_rate = 0.0001
+
+# Detect near-duplicate images (same picture, different size or encoding)
+# using perceptual hashes, needs Pillow
+dedup_images = True
+dedup_radius = 4  # Max. amount of differing bits (of 64) to count as duplicate
+# 'flag' to only log them (to .duplicates in the download folder). 'link' replaces the worse
+# of two duplicates with a hard link to the better one, which DELETES its picture for good,
+# also for crops, edits or photos of a series which merely look alike. Opt in knowingly
+dedup_action = 'flag'
+dedup_workers = 2
+
+# SQLite catalog of the downloaded files and their posts' metadata (owner, post time, ...),
+# search it with python catalog.py --help. None to disable
+catalog_path = 'catalog.sqlite3'
+catalog_batch_size = 100  # Rows written per transaction
+
+# Record a timeline of every URL's resolution and downloads in Chrome's trace event format,
+# open it in chrome://tracing or ui.perfetto.dev. {pid} and {time} get filled in,
+# e.g. 'traces/trace-{time}-{pid}.json'. None to disable
+trace_path = None
+
+# Report times in which the window doesn't respond, with the stacks of all threads,
+# see stalls.py. None to disable
+watchdog_report_path = 'stalls.log'
+watchdog_interval = 0.1  # Seconds between heartbeats of the event loop
+watchdog_threshold = 0.5  # Seconds a heartbeat may be late before it counts as a stall
+watchdog_sample_interval = 0.1  # Seconds between stack samples during a stall
+
+# Timeout of the HEAD requests used to find the best rendition of an image
+variant_timeout = 10
+
+# Service mode (python main.py --serve), see service.py for the API
+service_host = '127.0.0.1'
+service_port = 8642
+service_pool_size = 2  # Webdrivers shared between jobs, also the amount of jobs run at once
+# Instagram login for the pooled webdrivers, leave as None to skip private posts
+service_ig_username = None
+service_ig_password = None
+
+# Incremental sync of watched sources (python main.py --watch reddit:pics --sync)
+watchlist_path = 'watchlist.json'
+sync_interval = 24 * 60 * 60  # Seconds between syncs
+sync_max_pages = 20  # Stop paging after this many pages, even if the mark wasn't reached
+sync_initial_posts = 50  # Posts to archive when syncing a source for the first time
+sync_ig_pinned_posts = 3  # Old pinned posts at the top of a profile don't end the sync
+ig_timeline_query_hash = '003056d32c2554def87228bc3fd9668a'
+
+# Bulk import of export files (python main.py --import saved.json, or the GUI's import button)
+import_batch_size = 100  # Accepted URLs to resolve before downloading their files
+import_queue_size = 1000  # URLs read ahead of the dispatcher, reading waits once it's full
+import_delay = 0.5  # Seconds between URLs, to not spam APIs
+
+# Worker mode (python main.py --worker), see worker.py
+# Put the queue on a volume shared by all workers' hosts, with working file locks
+queue_path = 'queue.sqlite3'
+queue_visibility_timeout = 300  # Seconds until a job of an unresponsive worker gets leased again
+queue_max_attempts = 3  # Failed jobs are retried until they were attempted this often
+queue_poll_interval = 5  # Seconds between lookups while the queue is empty
+
 
 tumblr_ascii_logo = (
     '<!--'
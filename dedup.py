@@ -0,0 +1,275 @@
+# BUILTIN
+import importlib.util
+import io
+import os
+import threading
+# Only the package, the process pool (and multiprocessing) get imported on first use
+import concurrent.futures
+# CUSTOM
+import archive
+from settings import config
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+
+def dhash(source, hash_size=8):
+    """
+    Compute the difference hash of an image (a path, or the file's content as bytes):
+    shrink it to (hash_size+1) x hash_size greyscale pixels
+    and set a bit for every pixel brighter than its right neighbour.
+    Similar looking images get hashes with a small Hamming distance,
+    regardless of their size or encoding.
+    Return None if the file is not a readable image.
+    """
+    from PIL import Image
+
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    try:
+        with Image.open(source) as image:
+            image = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+            pixels = list(image.getdata())
+    except (OSError, ValueError):
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def get_quality(path):
+    """
+    Get the (pixel count, byte size) of an image file, None if it can't be read.
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+        return width * height, os.path.getsize(path)
+    except (OSError, ValueError):
+        return None
+
+
+def compare_quality(first, second):
+    """
+    Tell which of two near-duplicate image files is the better one:
+    1 for the first, -1 for the second, 0 if they are alike
+    and None if it's unclear (one is larger, the other one has more pixels).
+    """
+    first, second = get_quality(first), get_quality(second)
+    if first is None or second is None:
+        return None
+    if first == second:
+        return 0
+    if first[0] >= second[0] and first[1] >= second[1]:
+        return 1
+    if first[0] <= second[0] and first[1] <= second[1]:
+        return -1
+    return None
+
+
+def hamming(first, second):
+    return bin(first ^ second).count('1')
+
+
+class BKTree:
+    """
+    Metric tree for finding all hashes within a Hamming distance of another one.
+    Only the subtrees whose edge distance can still lie within the radius get visited,
+    which for small radii is a small fraction of the tree.
+    """
+    __slots__ = ('root', 'count')
+
+    def __init__(self):
+        self.root = None  # [hash, path, {distance: child node}]
+        self.count = 0
+
+    def add(self, hash_, path):
+        self.count += 1
+        if self.root is None:
+            self.root = [hash_, path, {}]
+            return
+
+        node = self.root
+        while True:
+            distance = hamming(hash_, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_, path, {}]
+                return
+            node = child
+
+    def search(self, hash_, radius):
+        """
+        Get (distance, path) tuples of all entries within the radius, closest first.
+        """
+        if self.root is None:
+            return []
+
+        matches = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(hash_, node[0])
+            if distance <= radius:
+                matches.append((distance, node[1]))
+
+            # Triangle inequality: only children at these edge distances can match
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+
+        return sorted(matches)
+
+    def __len__(self):
+        return self.count
+
+
+class ImageIndex:
+    """
+    Perceptual hash index of all images in the download folder.
+    New images get hashed in a process pool as they arrive and are compared against
+    everything downloaded before; near-duplicates get flagged or the worse of
+    the two files gets replaced with a hard link to the better one (more pixels and
+    bytes), depending on config.dedup_action.
+    The hashes are kept in an index file so they survive restarts.
+    Shared by several scrapers in service mode, everything it holds is guarded by its lock.
+    """
+    __slots__ = ('log_text', 'dl_folder', 'index_path', 'tree', 'lock', 'executor', 'pending')
+
+    def __init__(self, log_text, dl_folder):
+        self.log_text = log_text
+        self.dl_folder = dl_folder
+        self.index_path = os.path.join(dl_folder, '.phash_index')
+        self.tree = BKTree()
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pending = []
+        self.load()
+
+    @staticmethod
+    def is_available():
+        """
+        Check if Pillow, which is needed to decode the images, is installed.
+        """
+        return importlib.util.find_spec('PIL') is not None
+
+    def load(self):
+        """
+        Read the hashes of earlier sessions, skipping files which got deleted since.
+        """
+        if not os.path.exists(self.index_path):
+            return
+
+        with open(self.index_path, encoding='utf-8') as index_file:
+            for line in index_file:
+                hash_, _, file_name = line.rstrip('\n').partition(' ')
+                path = os.path.join(self.dl_folder, file_name)
+                if file_name and (os.path.exists(path) or archive.is_member(path)):
+                    self.tree.add(int(hash_, 16), file_name)
+
+    def submit(self, file_dst, data=None):
+        """
+        Queue a downloaded file to be hashed and checked for duplicates.
+        Files in archives (see archive.py) get hashed from their content, given as data.
+        """
+        if not file_dst.lower().endswith(IMAGE_EXTENSIONS):
+            return
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=config.dedup_workers
+                )
+            # Streaming downloads never wait(), so drop what's done already
+            self.pending = [checked for checked in self.pending if not checked.done()]
+            future = self.executor.submit(dhash, file_dst if data is None else data)
+            # Waiters of the hash get woken up before its callbacks run, so wait() needs its own
+            checked = concurrent.futures.Future()
+            self.pending.append(checked)
+
+        def check(future):
+            try:
+                self.check(file_dst, future)
+            finally:
+                checked.set_result(None)
+
+        # Outside of the lock, the callback runs right away if the hash is done already
+        future.add_done_callback(check)
+
+    def check(self, file_dst, future):
+        """
+        Compare a freshly hashed file against the index, then add it.
+        """
+        try:
+            hash_ = future.result()
+        except Exception as e:
+            self.log_text.newline(f'Could not hash {os.path.basename(file_dst)}: {e!r}')
+            return
+        if hash_ is None:
+            return
+
+        file_name = os.path.relpath(file_dst, self.dl_folder)
+        with self.lock:
+            matches = [(distance, match) for distance, match
+                       in self.tree.search(hash_, config.dedup_radius)
+                       if match != file_name]
+            if not matches:
+                self.tree.add(hash_, file_name)
+                with open(self.index_path, 'a', encoding='utf-8') as index_file:
+                    index_file.write(f'{hash_:016x} {file_name}\n')
+                return
+
+        distance, original = matches[0]
+        self.handle_duplicate(file_dst, os.path.join(self.dl_folder, original), distance)
+
+    def handle_duplicate(self, file_dst, original_dst, distance):
+        """
+        Flag a near-duplicate, or replace the worse of the two files with a hard link
+        to the better one. Pairs where that is unclear only get flagged.
+        """
+        message = (f'{os.path.basename(file_dst)} looks like {os.path.basename(original_dst)}'
+                   f' (distance {distance})')
+
+        # Members of archives can neither be replaced nor linked to
+        is_archived = archive.is_member(file_dst) or archive.is_member(original_dst)
+        if config.dedup_action == 'link' and not is_archived:
+            comparison = compare_quality(file_dst, original_dst)
+            if comparison is None:
+                self.log_text.newline(f'{message} - Unclear which one is better')
+            else:
+                # The new file may well be the better rendition
+                better, worse = ((file_dst, original_dst) if comparison > 0
+                                 else (original_dst, file_dst))
+                # Link next to the file first so it's never lost if linking fails
+                link_dst = f'{worse}.link'
+                try:
+                    os.link(better, link_dst)
+                    os.replace(link_dst, worse)
+                    self.log_text.newline(f'{message} - Replaced {os.path.basename(worse)}'
+                                          ' with a hard link')
+                    return
+                except OSError as e:
+                    self.log_text.newline(f'Could not hard link duplicate ({e})')
+
+        with open(os.path.join(self.dl_folder, '.duplicates'), 'a', encoding='utf-8') as dup_file:
+            dup_file.write(f'{os.path.relpath(file_dst, self.dl_folder)}'
+                           f' {os.path.relpath(original_dst, self.dl_folder)} {distance}\n')
+        self.log_text.newline(f'{message} - Flagged as duplicate')
+
+    def wait(self):
+        """
+        Block until all queued files are checked.
+        """
+        with self.lock:
+            pending = list(self.pending)
+        for checked in pending:
+            checked.result()
+        with self.lock:
+            # Files of other scrapers may have been queued meanwhile
+            self.pending = [checked for checked in self.pending if not checked.done()]
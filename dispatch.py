@@ -0,0 +1,362 @@
+# BUILTIN
+import json
+import re
+import threading
+import time
+# CUSTOM
+import proxies
+from lazy import lazy_import
+from settings import config
+from tracing import tracer
+# PIP (imported on first use, see lazy.py)
+bs4 = lazy_import('bs4')
+
+
+class Dispatcher:
+    """
+    Match URLs against the supported sites and run the fitting extraction method.
+    Not bound to the GUI, the widgets it reports to can be any objects
+    providing the same methods (see service.py).
+    """
+    __slots__ = (
+        'scraper', 'driver', 'log_text', 'url_check_label', 'url_tracking_text',
+        'on_login_required', 'lock',
+        'ig_url_re', 'ig_profile_url_re', 'general_img_re', 'imgur_re', 'youtube_re', 'yt_re',
+        'reddit_re', 'reddit_fallback_re', 'gfycat_re', 'tumblr_re', 'twitter_re',
+        'url_split_re', 'ig_graphql_re', 'imgur_album_json_re', 'reddit_json_re',
+        'exprs',
+    )
+
+    def __init__(self, scraper, driver, log_text, url_check_label, url_tracking_text):
+        self.scraper = scraper
+        self.driver = driver
+        self.log_text = log_text  # tk.Widget of the Application class
+        self.url_check_label = url_check_label  # tk.Widget of the Application class
+        self.url_tracking_text = url_tracking_text  # tk.Widget of the Application class
+
+        # Called with the URL of a private Instagram post if we are not logged in
+        # Skip those posts if nobody is there to log in
+        self.on_login_required = None
+
+        # Links get resolved again from download threads (see resolve_again),
+        # only one thread at a time may use the webdriver
+        self.lock = threading.RLock()
+        self.scraper.resolve_again = self.resolve_again
+
+        # Lots of regexes to check the validity of wanted URLs
+        # Make sure only IG posts are specified, not user's pages
+        self.ig_url_re = re.compile(r'^https://www\.instagram\.com/p/.+/')
+        self.ig_profile_url_re = re.compile(r'^https://www\.instagram\.com/(\w+|\d+)/$')
+        self.general_img_re = re.compile(r'^https?://.+\..+\..+\.(?:jpg|png|gif)')
+        self.imgur_re = re.compile(r'^https?://imgur\.com/(?:.)+$(?<!(png|gif|jpg))')
+        self.youtube_re = re.compile('https://(?:www\.)?youtube\.com/watch\?v=.+')
+        self.yt_re = re.compile(r'https://youtu\.be/.+')
+        self.reddit_re = re.compile(r'https?://(?:www|old)\.reddit\.com/(?:r|u|user)/(\w+)/.+')
+        self.reddit_fallback_re = re.compile(r'https://v\.redd\.it/.+\?source=fallback')
+        self.gfycat_re = re.compile(r'https://gfycat\.com/\w+$(?<!-)')
+        self.tumblr_re = re.compile(r'https://(.+)\.tumblr\.com/post/(\d+)(?:/.+)?')
+        self.twitter_re = re.compile(r'https://twitter.com/.+/status/(\d+)')
+        # Split URLs which got pasted without whitespace in between
+        self.url_split_re = re.compile(r'https?://.+?(?=https?://|$)')
+
+        # JSON responses to take from the network log instead of parsing the page source
+        self.ig_graphql_re = re.compile(r'^https://www\.instagram\.com/graphql/query/')
+        self.imgur_album_json_re = re.compile(r'^https://imgur\.com/ajaxalbums/getimages/')
+        self.reddit_json_re = re.compile(r'^https?://(?:www|old)\.reddit\.com/.+\.json')
+
+        # Map URLs to the methods needed to extract the images in them
+        # All of these methods take a single argument, the URL/text
+        self.exprs = {
+            self.ig_url_re: self.process_ig_url,
+            self.ig_profile_url_re: self.process_ig_profile_url,
+            self.general_img_re: self.process_general_url,
+            self.imgur_re: self.process_imgur_url,
+            self.youtube_re: self.process_yt_url,
+            self.yt_re: self.process_yt_url,
+            self.reddit_re: self.process_reddit_url,
+            self.reddit_fallback_re: self.process_general_url,
+            self.gfycat_re: self.process_gfycat_url,
+            self.tumblr_re: self.process_tumblr_url,
+            self.twitter_re: self.process_twitter_url,
+        }
+
+    def check_url(self, text=None):
+        """
+        Check the text to see if it fits one of the specified URL regexes.
+        Then process the URL as needed.
+        """
+        if not text:
+            return False
+
+        with self.lock, tracer.span('check_url', url=text):
+            text = self.normalize_url(text)
+            if not self.is_url_supported(text):
+                self.url_check_label.configure(text='ERR: URL not accepted', fg='red')
+                return False
+
+            if self.is_url_added(text):
+                self.url_check_label.configure(text='WARN: URL already added.', fg='brown')
+                return False
+
+            # In case a URL gets ctrl+v'd into the entry multiple times
+            if any(self.is_url_added(url) for url in self.url_split_re.findall(text)):
+                self.url_check_label.configure(text='WARN: URL already added.', fg='brown')
+                return False
+
+            self.url_check_label.configure(text='OK: URL accepted', fg='black')
+            self.process_url(text)
+
+            # Signify that the method completed
+            return True
+
+    def normalize_url(self, url):
+        """
+        Bring a URL into the form it gets tracked in.
+        """
+        # We only need to track Reddit URLs in JSON format,
+        # without the tracking parameters of shared links
+        if self.reddit_re.match(url):
+            url = url.split('#')[0].split('?')[0]
+            if not url.endswith('.json'):
+                url += '.json'
+        return url
+
+    def is_url_supported(self, url):
+        return any(regex.match(url) for regex in self.exprs.keys())
+
+    def is_url_added(self, url):
+        """
+        Check if a URL was added before, either in this batch or earlier in the session.
+        """
+        # Resolving a source again goes through everything it led to once more
+        if self.scraper.captured is not None:
+            return False
+        return url in self.scraper.tracking or url in self.scraper.display_links
+
+    def process_url(self, url):
+        """
+        Get the corresponding extraction method of a URL by matching a regex,
+        then execute the method and update the tracking label.
+        """
+        # The webdriver gets started in the background while the window shows up
+        self.driver.wait_until_started()
+
+        # Attribute the extracted links to the URL the user entered,
+        # not to URLs found along the way (e.g. the link of a Reddit post)
+        is_source = self.scraper.current_source is None
+        if is_source:
+            self.scraper.current_source = url
+            # Shown as resolving right away, its status is looked up whenever it's in view
+            self.url_tracking_text.add_row(url)
+
+        try:
+            for regex in self.exprs.keys():
+                # Guaranteed to happen for at least one regex
+                if regex.match(url):
+                    extraction_method = self.exprs[regex]
+                    with tracer.span(extraction_method.__name__, url=url,
+                                     source=self.scraper.current_source):
+                        extraction_method(url)
+                    break
+        finally:
+            if is_source:
+                self.scraper.current_source = None
+
+        if self.scraper.captured is None:
+            self.scraper.display_links.append(url)
+
+        self.log_text.newline('URL processing complete')
+        self.log_text.newline('.')
+
+    def resolve_again(self, source):
+        """
+        Extract the links of an entered URL once more, without adding them to the batch,
+        to get fresh versions of signed links which expired (see Scraper.renew_link).
+        Return them as (link, type, album index) tuples.
+        """
+        with self.lock, tracer.span('resolve_again', url=source, source=source):
+            self.log_text.newline(f'Resolving {source} again')
+            self.scraper.captured = []
+            # Keeps it from being tracked as a new source
+            self.scraper.current_source = source
+            try:
+                self.process_url(source)
+                return self.scraper.captured
+            finally:
+                self.scraper.captured = None
+                self.scraper.current_source = None
+
+    def get_page_soup(self):
+        """
+        Parse the source code of the page the webdriver is currently on.
+        """
+        with tracer.span('parse'):
+            return bs4.BeautifulSoup(self.driver.webdriver.page_source, features='html.parser')
+
+    def process_general_url(self, url):
+        """
+        Append a link directly pointing to an image to the lists
+        as no further actions are needed.
+        """
+        type_ = 'image'
+        if url.startswith('https://v.redd.it/'):
+            type_ = 'video'
+
+        self.scraper.append_link(url, type_=type_)
+
+    def process_ig_url(self, url):
+        """
+        Prepare data and handle extraction of images of Instagram posts.
+        """
+        self.driver.navigate(url, profile='instagram')
+        self.log_text.newline(f'Got URL - {url}')
+
+        # Same shape as the data of private posts, see Scraper.get_ig_user
+        graphql = self.driver.get_json(
+            self.ig_graphql_re, accept=lambda data: 'shortcode_media' in data.get('data', {})
+        )
+        if graphql is not None:
+            data = {'graphql': graphql['data']}
+        else:
+            soup = self.get_page_soup()
+            data = self.scraper.get_ig_data(soup)
+        self.log_text.newline('Extracted JSON data')
+
+        if self.scraper.is_private(data) and self.driver.is_logged_in is False:
+            # Nobody waits for a login while links are resolved again
+            if self.on_login_required is None or self.scraper.captured is not None:
+                self.log_text.newline('Private profile but not logged in - Skipping!')
+                return
+
+            self.log_text.newline('Login initiated')
+            self.on_login_required(url)
+            return
+
+        # Logging for IG links is done inside of this function already
+        self.scraper.extract_ig_images(data)
+        self.scraper.tracking.add(url)
+
+    def process_ig_profile_url(self, url):
+        """
+        Extract an Instagram user's profile name and get their
+        avatar's URL from instadp.com.
+        """
+        profile_name = self.ig_profile_url_re.match(url).group(1)
+        instadp_url = f'https://www.instadp.com/fullsize/{profile_name}'
+        self.driver.navigate(instadp_url, profile='instadp')
+        self.log_text.newline(f'Got URL - {url}')
+
+        soup = self.get_page_soup()
+        self.scraper.extract_ig_avatar(soup, owner=profile_name)
+
+    def process_imgur_url(self, url):
+        """
+        Prepare data needed for extracting images from an Imgur link
+        and then actually extract them.
+        """
+        self.driver.navigate(url, profile='imgur')
+        self.log_text.newline(f'Got URL - {url}')
+
+        # Large albums get their images from an extra request
+        album = self.driver.get_json(self.imgur_album_json_re,
+                                     accept=lambda data: 'images' in data.get('data', {}))
+        if album is not None:
+            self.scraper.extract_imgur_data({'album_images': album['data']})
+            return
+
+        soup = self.get_page_soup()
+        self.scraper.extract_imgur_images(soup)
+
+    def process_yt_url(self, url):
+        """
+        Simply call the scraper's method to keep the method class uniform here.
+        """
+        self.scraper.extract_yt_thumbnail(url)
+
+    def process_reddit_url(self, url):
+        """
+        Get the JSON data of a Reddit post and extract the video link.
+        NOTE: Video and audio are separated on Reddit, they get merged
+        from the DASH manifest when downloading (see reddit_dash.py).
+        """
+        self.driver.navigate(url, profile='json')
+        self.log_text.newline(f'Got URL - {url}')
+
+        # The page is the JSON document itself
+        data = self.driver.get_json(self.reddit_json_re)
+        if data is None:
+            soup = self.get_page_soup()
+            data_str = soup.find_all('pre')[0].text
+            data = json.loads(data_str)
+
+        post_url = self.scraper.extract_reddit_link(data)
+        # Need to process the URL which a Reddit post points to
+        # ... if it's not a self-post
+        if url.replace('/.json', '/') == post_url:
+            self.log_text.newline('Reddit post is a self-post, aborting')
+            return
+
+        # The files get extracted from wherever the post links to, but belong to the post
+        self.scraper.current_meta = self.scraper.get_reddit_meta(data)
+        try:
+            self.check_url(text=post_url)
+        finally:
+            self.scraper.current_meta = None
+
+    def process_gfycat_url(self, url):
+        """
+        Check to see if the entered Gfycat URL is valid.
+        """
+        # Usually I would insist on doing everything with Selenium
+        # But it's so fucking slow with Gfycat (~5s to .get the URL)
+        # that it's better to use requests -.-
+        # With that being said, the commented out Selenium code does work
+
+        # self.driver.webdriver.get(url)
+        # self.log_text.newline(f'Got URL - {url}')
+        #
+        # logs = self.driver.webdriver.get_log('browser')
+        # messages = [log['message'] for log in logs]
+        # request_failed = ('Failed to load resource:'
+        #                   ' the server responded with a status of 404')
+        #
+        # if any(request_failed in message for message in messages):
+        #     self.log_text.newline('Invalid response 404 for Gfycat URL')
+        #     return
+
+        res = proxies.get(url)
+        self.log_text.newline(f'Got URL - {url}')
+        if res.status_code != 200:
+            self.log_text.newline(f'Unexpected response code'
+                                  f' ({res.status_code}) for Gfycat URL')
+            return
+
+        self.scraper.extract_gfycat_video(url)
+
+    def process_tumblr_url(self, url):
+        """
+        Complete extra navigation step if necessary.
+        Prep BeautifulSoup to be used in extraction.
+        """
+        self.driver.navigate(url, profile='tumblr')
+        self.driver.log_text.newline(f'Got URL - {url}')
+        self.driver.confirm_tumblr_gdpr()
+
+        # Wait for page to reload
+        while True:
+            soup = self.get_page_soup()
+            if config.tumblr_ascii_logo not in str(soup):
+                break
+            time.sleep(0.2)
+
+        self.scraper.extract_tumblr_links(soup)
+
+    def process_twitter_url(self, url):
+        """
+        Navigate to the Twitter URL and prep BeautifulSoup object.
+        """
+        self.driver.navigate(url, profile='twitter')
+        self.driver.log_text.newline(f'Got URL - {url}')
+
+        soup = self.get_page_soup()
+        self.scraper.extract_twitter_images(soup)
@@ -1,45 +1,311 @@
 # BUILTIN
+import os
+import queue
+import threading
 import time
-# PIP
-from selenium import webdriver
+from contextlib import contextmanager
 # CUSTOM
-import config
+import proxies
+from capture import NetworkCapture
+from lazy import lazy_import
+from profiles import PROFILES
+from settings import config
+from tracing import tracer
+# PIP (imported on first use, see lazy.py)
+exceptions = lazy_import('selenium.common.exceptions')
+webdriver = lazy_import('selenium.webdriver')
+
+# What Network.setCookies takes of the cookies Network.getAllCookies returns
+COOKIE_KEYS = ('name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'sameSite', 'expires')
+# Tries to start the new Chrome when recycling, a few seconds apart
+RESTART_ATTEMPTS = 3
+RESTART_DELAY = 2  # Seconds
 
 
 class NoDriverPresent(Exception):
     pass
 
 
+def get_process_tree(pid):
+    """
+    Get the PIDs of a process and all its descendants, using /proc.
+    """
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                # The name (2nd field) may contain spaces, but is wrapped in parentheses
+                ppid = int(stat.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    tree = [pid]
+    for parent in tree:
+        tree.extend(children.get(parent, []))
+    return tree
+
+
+def get_memory(pid):
+    """
+    Get the summed resident memory (in MiB) of a process tree,
+    None where there is no /proc (anything but Linux).
+    """
+    if not os.path.isdir('/proc'):
+        return None
+
+    total = 0
+    for child in get_process_tree(pid):
+        try:
+            with open(f'/proc/{child}/status') as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total / 1024
+
+
 class Driver:
 
-    __slots__ = ('log_text', 'webdriver', 'is_logged_in')
+    __slots__ = (
+        'log_text', 'webdriver', 'is_logged_in', 'started', 'lean', 'blocked_urls', 'capture',
+        'proxy', 'navigations',
+    )
 
-    def __init__(self, log_text):
+    def __init__(self, log_text, lean=True):
         self.log_text = log_text
         self.webdriver = None
         self.is_logged_in = False
+        # Set once start_driver is done, so the driver can be started in the background
+        self.started = threading.Event()
+        # Blocking what the extractors don't need, optionally headless and not waiting for
+        # the load event (see profiles.py and the driver_* settings in the config)
+        self.lean = lean
+        self.blocked_urls = None  # Currently blocked URL patterns
+        self.capture = None  # Reads JSON responses from the network log, see capture.py
+        self.proxy = None  # Proxy of the pool (see proxies.py) Chrome was started with
+        self.navigations = 0  # Since Chrome was started, see recycle_if_needed
 
     def start_driver(self):
         """
         Start a driver to be used for navigating and scraping pages.
         """
-        if self.webdriver is None:
+        if self.webdriver is not None:
+            self.log_text.newline("Webdriver already present, can't start")
+            return
+
+        try:
             self.webdriver = webdriver.Chrome(
                 executable_path=config.chromedriver_path,
-                chrome_options=config.chromedriver_options,
-                desired_capabilities=config.desired_capabilities
+                chrome_options=self.get_options(),
+                desired_capabilities=self.get_capabilities()
             )
+            self.blocked_urls = None
+            self.navigations = 0
+            if config.capture_network is True:
+                self.webdriver.execute_cdp_cmd('Network.enable', {})
+                self.capture = NetworkCapture(self.webdriver)
             self.log_text.newline('Started webdriver')
-        else:
-            self.log_text.newline("Webdriver already present, can't start")
+        finally:
+            # Don't keep anyone waiting forever if Chrome failed to start
+            self.started.set()
+
+    def get_options(self):
+        """
+        Build the ChromeOptions from the arguments in the config.
+        Done here instead of in the config to not import Selenium along with it.
+        """
+        options = webdriver.ChromeOptions()
+        for argument in config.chromedriver_arguments:
+            options.add_argument(argument)
+
+        # Chrome takes one proxy for all its traffic, chosen whenever it gets started
+        self.proxy = None
+        if config.proxy_webdriver is True:
+            self.proxy = proxies.pool.choose()
+        if self.proxy is not None:
+            options.add_argument(f'proxy-server={self.proxy.url}')
+
+        if self.lean is True:
+            if config.driver_headless is True:
+                options.add_argument('headless')
+            options.add_argument('mute-audio')
+            options.add_argument('disable-extensions')
+            if config.driver_block_media is True:
+                # Images are never rendered, their URLs are still in the DOM
+                options.add_experimental_option(
+                    'prefs', {'profile.managed_default_content_settings.images': 2}
+                )
+        return options
+
+    def get_capabilities(self):
+        """
+        Get the desired capabilities from the config, with the page load strategy
+        of the lean profile. With 'eager' or 'none' the driver doesn't wait for the
+        load event, each page waits for its own readiness condition instead.
+        """
+        capabilities = dict(config.desired_capabilities)
+        if self.lean is True:
+            capabilities['pageLoadStrategy'] = config.driver_page_load_strategy
+
+        if config.capture_network is True:
+            # Older chromedrivers read loggingPrefs, newer ones goog:loggingPrefs
+            for key in ('loggingPrefs', 'goog:loggingPrefs'):
+                capabilities[key] = dict(capabilities.get(key, {}), performance='ALL')
+        return capabilities
+
+    def navigate(self, url, profile='default'):
+        """
+        Go to a URL using a site profile (see profiles.py),
+        returning once the page satisfies the profile's readiness condition.
+        """
+        profile = PROFILES[profile]
+        # E.g. a restart by recycle failed
+        if self.webdriver is None:
+            raise NoDriverPresent('No webdriver started')
+        self.recycle_if_needed()
+
+        blocked_urls = profile.get_blocked_urls() if self.lean is True else []
+        if blocked_urls != self.blocked_urls:
+            self.webdriver.execute_cdp_cmd('Network.enable', {})
+            self.webdriver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': blocked_urls})
+            self.blocked_urls = blocked_urls
+
+        # Without waiting for the load event, get() may return before the old page is gone
+        # Mark the old page so its state isn't mistaken for that of the new one
+        self.webdriver.execute_script('window.__isStalePage = true;')
+        if self.capture is not None:
+            self.capture.clear()
+        try:
+            with tracer.span('webdriver.get', url=url):
+                self.webdriver.get(url)
+        except exceptions.WebDriverException:
+            # Navigation times aren't comparable to those of requests, only count failures
+            if self.proxy is not None:
+                proxies.pool.report(self.proxy, failed=True)
+            raise
+        self.navigations += 1
+        with tracer.span('wait_until_ready', url=url):
+            self.wait_until_ready(profile.ready)
+
+    def recycle_if_needed(self):
+        """
+        Restart Chrome once it loaded config.driver_recycle_navigations pages or its
+        processes use more than config.driver_recycle_memory MiB, as it slows down
+        over a long session. Called before a page gets loaded, so no page is being read.
+        """
+        reason = None
+        limit = config.driver_recycle_navigations
+        if limit is not None and self.navigations >= limit:
+            reason = f'{self.navigations} pages loaded'
+
+        limit = config.driver_recycle_memory
+        interval = config.driver_memory_check_interval
+        if reason is None and limit is not None and self.navigations \
+                and self.navigations % interval == 0:
+            memory = get_memory(self.webdriver.service.process.pid)
+            if memory is not None and memory > limit:
+                reason = f'using {memory:.0f} MiB'
+
+        if reason is not None:
+            self.recycle(reason)
+
+    def recycle(self, reason):
+        """
+        Replace Chrome with a fresh instance, keeping the cookies of all sites
+        (and with them logins). Also picks a new proxy from the pool.
+        """
+        try:
+            cookies = self.webdriver.execute_cdp_cmd('Network.getAllCookies', {})['cookies']
+        except exceptions.WebDriverException:
+            # Chrome is beyond saving, start over without the cookies
+            cookies = []
+        self.log_text.newline(f'Restarting webdriver ({reason})')
+
+        with tracer.span('recycle', reason=reason):
+            try:
+                self.quit_driver()
+            except exceptions.WebDriverException:
+                pass
+            self.restart_driver()
+
+        params = []
+        for cookie in cookies:
+            param = {key: cookie[key] for key in COOKIE_KEYS if key in cookie}
+            if cookie.get('session'):
+                param.pop('expires', None)
+            params.append(param)
+        try:
+            self.webdriver.execute_cdp_cmd('Network.setCookies', {'cookies': params})
+        except exceptions.WebDriverException as e:
+            # The new Chrome works, only without the logins
+            self.log_text.newline(f'Could not carry the cookies over ({e.msg})'
+                                  ' - Pages needing a login may not load')
+
+    def restart_driver(self):
+        """
+        Start Chrome again after it was quit, trying RESTART_ATTEMPTS times.
+        Raise NoDriverPresent if it won't start, instead of carrying on without one.
+        """
+        for attempt in range(1, RESTART_ATTEMPTS + 1):
+            try:
+                self.start_driver()
+                return
+            except (exceptions.WebDriverException, OSError) as e:
+                self.log_text.newline(f'Could not restart webdriver ({e!r}),'
+                                      f' attempt {attempt} / {RESTART_ATTEMPTS}')
+                if attempt < RESTART_ATTEMPTS:
+                    time.sleep(RESTART_DELAY)
+        raise NoDriverPresent(f'Webdriver could not be restarted after {RESTART_ATTEMPTS} tries')
+
+    def get_json(self, url_re, accept=None, timeout=0):
+        """
+        Get a JSON response of the current page from the network log,
+        see NetworkCapture.get_json. Return None if capturing is disabled.
+        """
+        if self.capture is None:
+            return None
+        with tracer.span('get_json', pattern=url_re.pattern) as args:
+            data = self.capture.get_json(url_re, accept=accept, timeout=timeout)
+            args['found'] = data is not None
+        return data
+
+    def wait_until_ready(self, condition):
+        """
+        Poll a JavaScript condition on the current page until it's true.
+        Carry on after config.page_ready_timeout, the extractor reports what's missing.
+        """
+        script = f'return !window.__isStalePage && Boolean({condition});'
+        deadline = time.monotonic() + config.page_ready_timeout
+
+        while not self.webdriver.execute_script(script):
+            if time.monotonic() > deadline:
+                self.log_text.newline(f'Page did not get ready within'
+                                      f' {config.page_ready_timeout}s - Reading it anyway')
+                return
+            time.sleep(0.05)
+
+    def wait_until_started(self):
+        """
+        Block until the driver (possibly started in another thread) is ready.
+        """
+        self.started.wait()
 
     def quit_driver(self):
         """
         Quit the current driver, if needed.
         """
         if self.webdriver is not None:
-            self.webdriver.quit()
-            self.webdriver = None
+            try:
+                self.webdriver.quit()
+            finally:
+                # A crashed Chrome may not quit cleanly, it's gone either way
+                self.webdriver = None
+                self.capture = None
+                self.started.clear()
             self.log_text.newline('Quit webdriver')
         else:
             self.log_text.newline("No webdriver started, can't quit")
@@ -52,7 +318,7 @@ class Driver:
         login_url = 'https://www.instagram.com/accounts/login/'
         two_fa_url = 'https://www.instagram.com/accounts/login/two_factor'
 
-        self.webdriver.get(login_url)
+        self.navigate(login_url, profile='login')
         self.log_text.newline('Got to IG login URL')
         time.sleep(0.5)
 
@@ -134,3 +400,52 @@ class Driver:
 
         confirm_button[0].click()
         self.log_text.newline('Clicked accept button for Tumblr GDPR')
+
+
+class DriverPool:
+    """
+    A set of already started (and logged in) drivers
+    to be shared between multiple jobs running at once.
+    """
+    __slots__ = ('log_text', 'drivers', 'idle')
+
+    def __init__(self, log_text, size):
+        self.log_text = log_text
+        self.drivers = [Driver(log_text) for _ in range(size)]
+        self.idle = queue.Queue()
+
+    def start(self, username=None, password=None):
+        """
+        Start all drivers up front so no job has to wait for Chrome to launch.
+        Log in to Instagram if credentials are given (2FA is not supported here).
+        """
+        for driver in self.drivers:
+            driver.start_driver()
+
+            if username and password:
+                credentials_valid, two_fa_needed = driver.main_login(username, password)
+                driver.is_logged_in = credentials_valid is True and two_fa_needed is False
+                if driver.is_logged_in is False:
+                    self.log_text.newline('Could not log in pooled webdriver'
+                                          ' - Private posts will be skipped')
+
+            self.idle.put(driver)
+
+    def stop(self):
+        """
+        Quit all drivers.
+        """
+        for driver in self.drivers:
+            if driver.webdriver is not None:
+                driver.quit_driver()
+
+    @contextmanager
+    def acquire(self):
+        """
+        Borrow a driver for the duration of a with-block, waiting for one to become idle.
+        """
+        driver = self.idle.get()
+        try:
+            yield driver
+        finally:
+            self.idle.put(driver)
@@ -1,18 +1,19 @@
 # BUILTIN
 import inspect
-import json
-import re
+import queue
 import threading
 import time
 import tkinter as tk
+from tkinter import filedialog
+from tkinter import font as tkfont
 from tkinter import ttk
-# PIP
-import requests
-from bs4 import BeautifulSoup
 # CUSTOM
-import config
+import storage
+from dispatch import Dispatcher
 from driver import Driver
 from scraping import Scraper
+from settings import config
+from stalls import Watchdog
 
 LIGHT_GREY = "#e1e1ff"  # (225, 225, 255)
 ALT_GREY = '#dcdcdc'  # (220, 220, 220)
@@ -32,30 +33,34 @@ class Application:
 
     __slots__ = (
         'root',
-        'left_frame', 'url_label', 'url_entry', 'check_button', 'url_check_label', 'start_dl_button',
+        'left_frame', 'url_label', 'url_entry', 'check_button', 'import_button', 'url_check_label',
+        'start_dl_button',
+        'stream_var', 'stream_check', 'pause_button', 'cancel_button',
         'mid_frame', 'url_tracking_label', 'url_tracking_text',
         'right_frame', 'log_text',
         'bottom_frame', 'download_tracking_label', 'download_tracking_bar',
-        'scraper', 'driver', 'login',
-        'ig_url_re', 'ig_profile_url_re', 'general_img_re', 'imgur_re', 'youtube_re', 'yt_re',
-        'reddit_re', 'reddit_fallback_re', 'gfycat_re', 'tumblr_re', 'twitter_re',
-        'exprs',
+        'scraper', 'driver', 'login', 'dispatcher', 'watchdog', 'streaming_poll',
     )
 
-    def __init__(self, root):
+    def __init__(self, root, start_driver=True):
         self.root = root
 
         self.left_frame = tk.Frame()
         self.url_label = tk.Label()
         self.url_entry = tk.Entry()
         self.check_button = tk.Button()
+        self.import_button = tk.Button()
         self.url_check_label = tk.Label()
         self.start_dl_button = tk.Button()
+        self.stream_var = None
+        self.stream_check = tk.Checkbutton()
+        self.pause_button = tk.Button()
+        self.cancel_button = tk.Button()
         self.setup_left_frame()
 
         self.mid_frame = tk.Frame()
         self.url_tracking_label = tk.Label()
-        self.url_tracking_text = ScrollText()
+        self.url_tracking_text = TrackingList()
         self.setup_mid_frame()
 
         self.right_frame = tk.Frame()
@@ -70,38 +75,29 @@ class Application:
         # Initialise classes here so we can pass the logging widget
         self.scraper = Scraper(self.log_text, self.download_tracking_label)
         self.driver = Driver(self.log_text)
-        self.driver.start_driver()  # Start webdriver to be used for scraping
+        # Start webdriver to be used for scraping, without keeping the window from showing up
+        if start_driver is True:
+            self.root.after_idle(
+                lambda: threading.Thread(target=self.driver.start_driver, daemon=True).start()
+            )
         self.login = None
 
-        # Lots of regexes to check the validity of wanted URLs
-        # Make sure only IG posts are specified, not user's pages
-        self.ig_url_re = re.compile(r'^https://www\.instagram\.com/p/.+/')
-        self.ig_profile_url_re = re.compile(r'^https://www\.instagram\.com/(\w+|\d+)/$')
-        self.general_img_re = re.compile(r'^https?://.+\..+\..+\.(?:jpg|png|gif)')
-        self.imgur_re = re.compile(r'^https?://imgur\.com/(?:.)+$(?<!(png|gif|jpg))')
-        self.youtube_re = re.compile('https://(?:www\.)?youtube\.com/watch\?v=.+')
-        self.yt_re = re.compile(r'https://youtu\.be/.+')
-        self.reddit_re = re.compile(r'https?://(?:www|old)\.reddit\.com/(?:r|u|user)/(\w+)/.+')
-        self.reddit_fallback_re = re.compile(r'https://v\.redd\.it/.+\?source=fallback')
-        self.gfycat_re = re.compile(r'https://gfycat\.com/\w+$(?<!-)')
-        self.tumblr_re = re.compile(r'https://(.+)\.tumblr\.com/post/(\d+)(?:/.+)?')
-        self.twitter_re = re.compile(r'https://twitter.com/.+/status/(\d+)')
-
-        # Map URLs to the methods needed to extract the images in them
-        # All of these methods take a single argument, the URL/text
-        self.exprs = {
-            self.ig_url_re: self.process_ig_url,
-            self.ig_profile_url_re: self.process_ig_profile_url,
-            self.general_img_re: self.process_general_url,
-            self.imgur_re: self.process_imgur_url,
-            self.youtube_re: self.process_yt_url,
-            self.yt_re: self.process_yt_url,
-            self.reddit_re: self.process_reddit_url,
-            self.reddit_fallback_re: self.process_general_url,
-            self.gfycat_re: self.process_gfycat_url,
-            self.tumblr_re: self.process_tumblr_url,
-            self.twitter_re: self.process_twitter_url,
-        }
+        self.dispatcher = Dispatcher(self.scraper, self.driver, self.log_text,
+                                     self.url_check_label, self.url_tracking_text)
+        self.dispatcher.on_login_required = self.login_required
+
+        self.url_tracking_text.describe = self.scraper.get_source_progress
+        self.poll_url_tracking()
+
+        self.streaming_poll = None  # ID of the pending poll_streaming call
+        if self.scraper.streaming is True:
+            self.start_dl_button.configure(state='disabled')
+            self.poll_streaming()
+
+        self.watchdog = None
+        if config.watchdog_report_path is not None:
+            self.watchdog = Watchdog(self.root, self.log_text)
+            self.watchdog.start()
 
     def setup_left_frame(self):
         """
@@ -149,6 +145,18 @@ class Application:
                                lambda e: threading.Thread(target=self.process_input).start())
         self.check_button.place(relx=0.5, rely=0.5, anchor='center')
 
+        self.import_button = tk.Button(
+            self.left_frame,
+            text='Import file',
+            bg='black',
+            fg='white',
+            activebackground=DARK_GREY,
+            font=('Arial', 10),
+            cursor='hand2',
+            command=self.import_file,
+        )
+        self.import_button.place(relx=0.8, rely=0.5, anchor='center')
+
         self.url_check_label = tk.Label(
             self.left_frame,
             bg=MID_GREY,
@@ -165,10 +173,47 @@ class Application:
             font=('Arial', 12),
             cursor='hand2'
         )
-        self.start_dl_button.bind('<ButtonRelease-1>',
-                                  lambda e: threading.Thread(target=self.download_files).start())
+        # Returns right away, the progress gets polled from the main loop
+        self.start_dl_button.bind('<ButtonRelease-1>', lambda e: self.download_files())
         self.start_dl_button.place(relx=0.5, rely=0.7, anchor='center')
 
+        self.stream_var = tk.BooleanVar(value=config.stream_downloads)
+        self.stream_check = tk.Checkbutton(
+            self.left_frame,
+            text='Download right away',
+            variable=self.stream_var,
+            command=self.toggle_streaming,
+            bg=MID_GREY,
+            activebackground=MID_GREY,
+            font=('Arial', 10),
+            cursor='hand2'
+        )
+        self.stream_check.place(relx=0.5, rely=0.8, anchor='center')
+
+        self.pause_button = tk.Button(
+            self.left_frame,
+            text='Pause',
+            bg='black',
+            fg='white',
+            activebackground=DARK_GREY,
+            font=('Arial', 10),
+            cursor='hand2',
+            command=self.toggle_pause,
+        )
+        self.pause_button.place(relx=0.35, rely=0.9, anchor='center')
+
+        self.cancel_button = tk.Button(
+            self.left_frame,
+            text='Cancel',
+            bg='black',
+            fg='white',
+            activebackground=DARK_GREY,
+            font=('Arial', 10),
+            cursor='hand2',
+            command=self.cancel_downloads,
+        )
+        self.cancel_button.place(relx=0.65, rely=0.9, anchor='center')
+
     def setup_mid_frame(self):
         """
         Set up the middle frame of the application's window.
@@ -198,13 +243,15 @@ class Application:
         # Retroactively scale the mid_frame's first row to make space for the tracking label
         self.mid_frame.rowconfigure(0, weight=1, minsize=self.url_tracking_label.winfo_reqheight())
 
-        self.url_tracking_text = ScrollText(
+        self.url_tracking_text = TrackingList(
             self.mid_frame,
             bg=MID_GREY,
             font=('Arial', 10),
             borderwidth=0,
         )
-        self.url_tracking_text.grid(row=1, column=0, sticky='ew')
+        self.url_tracking_text.grid(row=1, column=0, sticky='nsew')
+        # Right-click an entered URL to download its files before or after all others
+        self.url_tracking_text.text.bind('<Button-3>', self.show_priority_menu)
 
     def setup_right_frame(self):
         """
@@ -275,6 +322,7 @@ class Application:
         """
         self.url_entry.configure(state='disabled')
         self.check_button.configure(state='disabled')
+        self.import_button.configure(state='disabled')
         self.start_dl_button.configure(state='disabled')
 
     def enable_input_widgets(self):
@@ -283,7 +331,10 @@ class Application:
         """
         self.url_entry.configure(state='normal')
         self.check_button.configure(state='normal')
-        self.start_dl_button.configure(state='normal')
+        self.import_button.configure(state='normal')
+        # Nothing to start when links get downloaded right away
+        if self.scraper.streaming is False:
+            self.start_dl_button.configure(state='normal')
 
     def process_input(self):
         """
@@ -313,254 +364,221 @@ class Application:
         if is_input_accepted is True:
             self.url_entry.delete(0, tk.END)
 
-    def check_url(self, text=None):
+    def import_file(self):
         """
-        Check the text to see if it fits one of the specified URL regexes.
-        Then process the URL as needed.
+        Ask for an export file (saved posts, bookmarks, a list of URLs) and import it
+        in the background, downloading its files in batches, see importer.py.
         """
-        if not text:
-            return False
-
-        # We only need to track Reddit URLs in JSON format
-        if self.reddit_re.match(text) and not text.endswith('.json'):
-            text += '.json'
-
-        if not any(regex.match(text) for regex in self.exprs.keys()):
-            self.url_check_label.configure(text='ERR: URL not accepted', fg='red')
-            return False
-
-        if text in self.scraper.tracking_links + self.scraper.display_links:
-            self.url_check_label.configure(text='WARN: URL already added.', fg='brown')
-            return False
-
-        # In case a URL gets ctrl+v'd into the entry multiple times
-        if any(link in text for link in self.scraper.tracking_links + self.scraper.display_links):
-            self.url_check_label.configure(text='WARN: URL already added.', fg='brown')
-            return False
-
-        self.url_check_label.configure(text='OK: URL accepted', fg='black')
-        self.process_url(text)
+        path = filedialog.askopenfilename(
+            title='Import URLs',
+            filetypes=[('All files', '*'), ('JSON', '*.json'), ('Bookmarks', '*.html *.htm'),
+                       ('Text', '*.txt')],
+        )
+        if not path:
+            return
 
-        # Signify that the method completed
-        return True
+        self.disable_input_widgets()
+        threading.Thread(target=self.run_import, args=(path,), daemon=True).start()
+
+    def run_import(self, path):
+        # Imported here, the GUI can start without it
+        from importer import Importer
+
+        importer = Importer(self.dispatcher, self.log_text, self.download_import_batch)
+        try:
+            importer.run(path)
+            self.log_text.newline(f'Import complete - {importer.counts["accepted"]} URLs')
+        except (OSError, ValueError) as e:
+            # ValueError for broken files, see importer.iter_json_tokens
+            self.log_text.newline(f'Import failed: {e}')
+        finally:
+            self.enable_input_widgets()
+
+    def download_import_batch(self):
+        self.scraper.download_files()
+        self.reset_tracking_widgets()
 
-    def process_url(self, url):
+    def check_url(self, text=None):
         """
-        Get the corresponding extraction method of a URL by matching a regex,
-        then execute the method and update the tracking label.
+        Check and process a URL, see Dispatcher.check_url.
         """
-        for regex in self.exprs.keys():
-            # Guaranteed to happen for at least one regex
-            if regex.match(url):
-                extraction_method = self.exprs[regex]
-                extraction_method(url)
-                break
-
-        self.scraper.display_links.append(url)
-        self.url_tracking_text.display_these_lines(self.scraper.display_links)
-
-        self.log_text.newline('URL processing complete')
-        self.log_text.newline('.')
+        return self.dispatcher.check_url(text=text)
 
-    def process_general_url(self, url):
+    def login_required(self, url):
         """
-        Append a link directly pointing to an image to the lists
-        as no further actions are needed.
+        Hide the main window and ask for Instagram credentials,
+        then process the private Instagram post again.
         """
-        type_ = 'image'
-        if url.startswith('https://v.redd.it/'):
-            type_ = 'video'
+        def show_root(_):
+            """
+            Needed for the pos arg getting passed with tkinter bindings.
+            """
+            self.root.deiconify()
+            self.dispatcher.process_ig_url(url)
+            # Not unbinding here would lead to an infinite loop
+            # of calling the above function again and again
+            self.login.unbind('<Destroy>')
 
-        self.scraper.append_link(url, type_=type_)
+        self.create_login_window()
+        self.root.withdraw()
+        self.login.bind('<Destroy>', show_root)
 
-    def process_ig_url(self, url):
+    def download_files(self):
         """
-        Prepare data and handle extraction of images of Instagram posts.
+        Wrapper to call the scraper's download method,
+        to avoid arg weirdness with tkinter widget bindings.
         """
-        self.driver.webdriver.get(url)
-        self.log_text.newline(f'Got URL - {url}')
-        soup = BeautifulSoup(self.driver.webdriver.page_source, features='html.parser')
-        data = self.scraper.get_ig_data(soup)
-        self.log_text.newline('Extracted JSON data')
+        # Bindings fire even while the button is disabled
+        is_disabled = str(self.start_dl_button.cget('state')) == 'disabled'
+        if not self.scraper.download_links or is_disabled:
+            return
 
-        if self.scraper.is_private(data) and self.driver.is_logged_in is False:
-            def show_root(_):
-                """
-                Needed for the pos arg getting passed with tkinter bindings.
-                """
-                self.root.deiconify()
-                # self.process_url(url)
-                self.process_ig_url(url)
-                # Not unbinding here would lead to an infinite loop
-                # of calling the above function again and again
-                self.login.unbind('<Destroy>')
+        # Disable some widgets to not mess with running downloads
+        self.disable_input_widgets()
 
-            self.log_text.newline('Login initiated')
-            self.create_login_window()
-            self.root.withdraw()
-            self.login.bind('<Destroy>', show_root)
+        download_thread = threading.Thread(target=self.scraper.download_files)
+        download_thread.start()
+        self.download_tracking_bar['maximum'] = len(self.scraper.download_links)
+        self.update_widgets(download_thread)
+
+    def update_widgets(self, download_thread):
+        """
+        Update the download tracking widgets while downloading, then reset them
+        and enable the input widgets again once the downloads are finished.
+        Runs in tkinter's main loop until then, instead of blocking it.
+        """
+        if download_thread.is_alive():
+            finished_dls = self.scraper.finished_downloads
+            self.download_tracking_bar['value'] = finished_dls
+            self.download_tracking_label.configure(
+                text=f'Downloaded {finished_dls}'
+                     f' / {len(self.scraper.download_links)} files'
+            )
+            self.root.after(250, self.update_widgets, download_thread)
             return
 
-        # Logging for IG links is done inside of this function already
-        self.scraper.extract_ig_images(data)
-        self.scraper.tracking_links.append(url)
+        self.reset_tracking_widgets()
+        self.enable_input_widgets()
 
-    def process_ig_profile_url(self, url):
+    def reset_tracking_widgets(self):
         """
-        Extract an Instagram user's profile name and get their
-        avatar's URL from instadp.com.
+        Start a new batch, resetting the download tracking widgets.
         """
-        profile_name = self.ig_profile_url_re.match(url).group(1)
-        instadp_url = f'https://www.instadp.com/fullsize/{profile_name}'
-        self.driver.webdriver.get(instadp_url)
-        self.log_text.newline(f'Got URL - {url}')
+        self.scraper.reset_batch()
+        self.download_tracking_bar['value'] = 0
+
+        self.download_tracking_label.configure(
+            text='Downloaded 0 / 0 files'
+        )
+        self.url_tracking_text.clear_text()
 
-        soup = BeautifulSoup(self.driver.webdriver.page_source, features='html.parser')
-        self.scraper.extract_ig_avatar(soup)
+        self.log_text.newline('Reset tracking widgets')
+        self.log_text.newline('.')
 
-    def process_imgur_url(self, url):
+    def toggle_streaming(self):
         """
-        Prepare data needed for extracting images from an Imgur link
-        and then actually extract them.
+        Switch between downloading links right away and waiting for the download button.
         """
-        self.driver.webdriver.get(url)
-        self.log_text.newline(f'Got URL - {url}')
+        self.scraper.streaming = self.stream_var.get()
 
-        soup = BeautifulSoup(self.driver.webdriver.page_source, features='html.parser')
-        self.scraper.extract_imgur_images(soup)
+        if self.scraper.streaming is True:
+            self.start_dl_button.configure(state='disabled')
+            self.log_text.newline('Links will be downloaded right away')
+            # Download what got collected so far as well (unless it's still queued from before)
+            if self.scraper.scheduler.unfinished == 0:
+                for index, url in enumerate(self.scraper.download_links):
+                    if index >= self.scraper.finished_downloads:
+                        self.scraper.stream_link(index, url)
+            self.poll_streaming()
+        else:
+            self.stop_polling_streaming()
+            self.start_dl_button.configure(state='normal')
+            self.log_text.newline('Links will be downloaded after pressing the button')
 
-    def process_yt_url(self, url):
+    def toggle_pause(self):
         """
-        Simply call the scraper's method to keep the method class uniform here.
+        Pause or resume all downloads, partial files are continued when resuming.
         """
-        self.scraper.extract_yt_thumbnail(url)
+        if self.scraper.scheduler.paused is False:
+            self.scraper.scheduler.pause()
+            self.pause_button.configure(text='Resume')
+            self.log_text.newline('Paused downloads')
+        else:
+            self.scraper.scheduler.resume()
+            self.pause_button.configure(text='Pause')
+            self.log_text.newline('Resumed downloads')
 
-    def process_reddit_url(self, url):
+    def cancel_downloads(self):
         """
-        Get the JSON data of a Reddit post and extract the video link.
-        NOTE: Video and audio are separated on Reddit, so the audio will be missing.
+        Cancel all remaining downloads of the batch and delete their partial files.
         """
-        self.driver.webdriver.get(url)
-        self.log_text.newline(f'Got URL - {url}')
-
-        soup = BeautifulSoup(self.driver.webdriver.page_source, features='html.parser')
-        data_str = soup.find_all('pre')[0].text
-        data = json.loads(data_str)
-
-        post_url = self.scraper.extract_reddit_link(data)
-        # Need to process the URL which a Reddit post points to
-        # ... if it's not a self-post
-        if url.replace('/.json', '/') == post_url:
-            self.log_text.newline('Reddit post is a self-post, aborting')
-            return
-        self.check_url(text=post_url)
-
-    def process_gfycat_url(self, url):
-        """
-        Check to see if the entered Gfycat URL is valid.
-        """
-        # Usually I would insist on doing everything with Selenium
-        # But it's so fucking slow with Gfycat (~5s to .get the URL)
-        # that it's better to use requests -.-
-        # With that being said, the commented out Selenium code does work
-
-        # self.driver.webdriver.get(url)
-        # self.log_text.newline(f'Got URL - {url}')
-        #
-        # logs = self.driver.webdriver.get_log('browser')
-        # messages = [log['message'] for log in logs]
-        # request_failed = ('Failed to load resource:'
-        #                   ' the server responded with a status of 404')
-        #
-        # if any(request_failed in message for message in messages):
-        #     self.log_text.newline('Invalid response 404 for Gfycat URL')
-        #     return
-
-        res = requests.get(url)
-        self.log_text.newline(f'Got URL - {url}')
-        if res.status_code != 200:
-            self.log_text.newline(f'Unexpected response code'
-                                  f' ({res.status_code}) for Gfycat URL')
-            return
+        self.scraper.scheduler.cancel()
+        self.pause_button.configure(text='Pause')
+        self.log_text.newline('Cancelled downloads')
 
-        self.scraper.extract_gfycat_video(url)
-
-    def process_tumblr_url(self, url):
+    def poll_streaming(self):
         """
-        Complete extra navigation step if necessary.
-        Prep BeautifulSoup to be used in extraction.
+        Show the progress of the streamed downloads as one queue
+        and start a new batch once all of them are done.
+        Runs in tkinter's main loop for as long as streaming is enabled.
         """
-        self.driver.webdriver.get(url)
-        self.driver.log_text.newline(f'Got URL - {url}')
-        self.driver.confirm_tumblr_gdpr()
+        # Toggling streaming on again must not start a second loop
+        self.stop_polling_streaming()
+        if self.scraper.streaming is False:
+            return
 
-        # Wait for page to reload
-        while True:
-            soup = BeautifulSoup(self.driver.webdriver.page_source, features='html.parser')
-            if config.tumblr_ascii_logo not in str(soup):
-                break
-            time.sleep(0.2)
+        total = len(self.scraper.download_links)
+        finished_dls = min(self.scraper.finished_downloads, total)
 
-        self.scraper.extract_tumblr_links(soup)
+        self.download_tracking_bar['maximum'] = max(total, 1)
+        self.download_tracking_bar['value'] = finished_dls
+        self.download_tracking_label.configure(
+            text=f'Downloaded {finished_dls} / {total} files'
+        )
 
-    def process_twitter_url(self, url):
-        """
-        Navigate to the Twitter URL and prep BeautifulSoup object.
-        """
-        self.driver.webdriver.get(url)
-        self.driver.log_text.newline(f'Got URL - {url}')
+        # Links might still get appended while input is being processed
+        is_processing = str(self.url_entry.cget('state')) == 'disabled'
+        if total and finished_dls == total and not is_processing:
+            self.reset_tracking_widgets()
 
-        soup = BeautifulSoup(self.driver.webdriver.page_source, features='html.parser')
-        self.scraper.extract_twitter_images(soup)
+        self.streaming_poll = self.root.after(250, self.poll_streaming)
 
-    def download_files(self):
+    def stop_polling_streaming(self):
+        if self.streaming_poll is not None:
+            self.root.after_cancel(self.streaming_poll)
+            self.streaming_poll = None
+
+    def poll_url_tracking(self):
         """
-        Wrapper to call the scraper's download method,
-        to avoid arg weirdness with tkinter widget bindings.
+        Redraw the status of the URLs in view, runs in tkinter's main loop.
         """
-        if not self.scraper.download_links:
-            return
-
-        # Disable some widgets to not mess with running downloads
-        self.disable_input_widgets()
-
-        threading.Thread(target=self.scraper.download_files).start()
-        # Intentionally block here to re-enable widgets only after this returns
-        self.update_widgets()
-
-        self.enable_input_widgets()
+        self.url_tracking_text.refresh()
+        self.root.after(250, self.poll_url_tracking)
 
-    def update_widgets(self):
+    def show_priority_menu(self, event):
         """
-        Update the download tracking widgets while downloading
-        and reset them when the downloads are finished.
+        Show a menu to change the download priority of the clicked URL.
         """
-        self.download_tracking_bar['maximum'] = len(self.scraper.download_links)
-        last_download = self.scraper.last_download
-        finished_dls = 0
-
-        while finished_dls < len(self.scraper.download_links):
-            if self.scraper.last_download != last_download:
-                last_download = self.scraper.last_download
-                finished_dls += 1
-
-                self.download_tracking_bar['value'] += 1
-                self.download_tracking_label.configure(
-                    text=f'Downloaded {finished_dls}'
-                         f' / {len(self.scraper.download_links)} files'
-                )
-
-        self.scraper.download_links = []
-        self.scraper.display_links = []
-        self.download_tracking_bar['value'] = 0
-
-        self.download_tracking_label.configure(
-            text='Downloaded 0 / 0 files'
-        )
-        self.url_tracking_text.clear_text()
+        source = self.url_tracking_text.get_row_at(event.y)
+        if source is None:
+            return
 
-        self.log_text.newline('Reset tracking widgets')
-        self.log_text.newline('.')
+        menu = tk.Menu(self.root, tearoff=0)
+        menu.add_command(label='Download first',
+                         command=lambda: self.scraper.bump_source(source))
+        menu.add_command(label='Download last',
+                         command=lambda: self.scraper.demote_source(source))
+        menu.add_separator()
+        menu.add_command(label='Pause',
+                         command=lambda: self.scraper.pause_source(source))
+        menu.add_command(label='Resume',
+                         command=lambda: self.scraper.resume_source(source))
+        menu.add_command(label='Cancel',
+                         command=lambda: self.scraper.cancel_source(source))
+        try:
+            menu.tk_popup(event.x_root, event.y_root)
+        finally:
+            menu.grab_release()
 
     def create_login_window(self):
         """
@@ -742,23 +760,49 @@ class ScrollText(tk.Text):
     """
     Subclass tk.Text so we can get a text widget
     and create methods that make it easier to use.
+    Lines logged from other threads (downloads, duplicate checks, ...) are handed
+    to the Tk thread through a queue, Tk must only be used from the thread it runs in.
     """
-    __slots__ = ()
+    __slots__ = ('thread', 'lines')
 
     def __init__(self, *args, **kwargs):
         tk.Text.__init__(self, *args, **kwargs)
         self.configure(state='disabled')
+        self.thread = threading.current_thread()
+        self.lines = queue.Queue()
+        self.after(50, self.poll_lines)
 
     def newline(self, string):
         """
         Append a string to the already present text.
         """
-        content = self.get(1.0, tk.END)
-        to_insert = f'{content.strip()}\n{string.strip()}'
+        if not string.strip():
+            return
 
+        if threading.current_thread() is not self.thread:
+            self.lines.put(string)
+            return
+        # Keep the order of the lines logged meanwhile
+        self.write_queued()
+        self.write(string)
+
+    def poll_lines(self):
+        self.write_queued()
+        self.after(50, self.poll_lines)
+
+    def write_queued(self):
+        while True:
+            try:
+                self.write(self.lines.get_nowait())
+            except queue.Empty:
+                return
+
+    def write(self, string):
         self.configure(state='normal')
-        self.delete(1.0, tk.END)
-        self.insert(tk.INSERT, f'{to_insert.strip()}')
+        # Only append, instead of replacing the whole (ever growing) log every time
+        if self.compare('end-1c', '!=', '1.0'):
+            self.insert(tk.END, '\n')
+        self.insert(tk.END, string.strip())
         self.yview(tk.END)
         self.configure(state='disabled')
 
@@ -770,20 +814,122 @@ class ScrollText(tk.Text):
         self.delete(1.0, tk.END)
         self.configure(state='disabled')
 
-    def display_these_lines(self, lines):
+
+class TrackingList(tk.Frame):
+    """
+    List of the entered URLs with the status and the received bytes of their files.
+    Rows are only kept as URLs and looked up through describe when they come into view,
+    so only the visible rows get rendered and adding or updating a row costs the same
+    no matter how long the list is.
+    """
+    __slots__ = ('rows', 'first', 'follow', 'shown', 'describe', 'line_height',
+                 'text', 'scrollbar')
+
+    def __init__(self, master=None, describe=None, **kwargs):
+        tk.Frame.__init__(self, master, bg=kwargs.get('bg'))
+        self.rows = []  # Entered URLs, in order
+        self.first = 0  # Index of the topmost row in view
+        self.follow = True  # Keep the newest rows in view until scrolled away from them
+        self.shown = []  # Lines currently rendered, to only replace those that changed
+        self.describe = describe  # URL -> (status, bytes)
+
+        self.text = tk.Text(self, wrap='none', state='disabled', **kwargs)
+        self.line_height = tkfont.Font(font=self.text.cget('font')).metrics('linespace')
+        self.scrollbar = tk.Scrollbar(self, command=self.on_scrollbar)
+        self.text.grid(row=0, column=0, sticky='nsew')
+        self.scrollbar.grid(row=0, column=1, sticky='ns')
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(0, weight=1)
+
+        # The text only ever holds the visible rows, scroll through the rows instead
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.text.bind(sequence, self.on_wheel)
+        self.text.bind('<Configure>', lambda _: self.refresh())
+
+    def add_row(self, url):
         """
-        Clear all text and display the given lines.
+        Append a URL, it shows up with the next refresh.
         """
-        self.configure(state='normal')
-        self.delete(1.0, tk.END)
+        self.rows.append(url)
 
-        if isinstance(lines, list):
-            self.insert(tk.INSERT, '\n'.join([f' {index+1} - {line}'
-                                              for index, line in enumerate(lines)]))
-        elif isinstance(lines, str):
-            self.insert(tk.INSERT, lines)
+    def clear_text(self):
+        """
+        Remove all rows.
+        """
+        self.rows = []
+        self.first = 0
+        self.follow = True
+        self.refresh()
+
+    def get_row_at(self, y):
+        """
+        Get the URL of the row at a y coordinate of the widget, or None.
+        """
+        line = int(self.text.index(f'@0,{y}').split('.')[0]) - 1
+        if not 0 <= line < len(self.shown):
+            return None
+        return self.rows[self.first + line]
+
+    def get_visible_amount(self):
+        # Not laid out yet, go by the configured height
+        height = self.text.winfo_height()
+        if height <= 1:
+            return int(self.text.cget('height'))
+        return max(1, height // self.line_height)
+
+    def scroll_to(self, first):
+        visible = self.get_visible_amount()
+        last_first = max(0, len(self.rows) - visible)
+        self.first = min(max(0, first), last_first)
+        self.follow = self.first == last_first
+        self.refresh()
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == 'moveto':
+            self.scroll_to(int(float(amount) * len(self.rows)))
+        elif unit == 'pages':
+            self.scroll_to(self.first + int(amount) * self.get_visible_amount())
         else:
-            raise TypeError(f'Expected str or list, got {type(lines)} instead.')
-
-        self.yview(tk.END)
-        self.configure(state='disabled')
+            self.scroll_to(self.first + int(amount))
+
+    def on_wheel(self, event):
+        # Button-4/5 on X11, MouseWheel with a delta on Windows and macOS
+        is_up = event.num == 4 or event.delta > 0
+        self.scroll_to(self.first + (-3 if is_up else 3))
+        return 'break'
+
+    def format_row(self, index):
+        url = self.rows[index]
+        if self.describe is None:
+            return f' {index+1} - {url}'
+        status, size = self.describe(url)
+        return f' {index+1} - {status}, {storage.format_size(size)} - {url}'
+
+    def refresh(self):
+        """
+        Render the rows in view, replacing only the lines whose text changed.
+        """
+        visible = self.get_visible_amount()
+        if self.follow:
+            self.first = max(0, len(self.rows) - visible)
+        lines = [self.format_row(index)
+                 for index in range(self.first, min(len(self.rows), self.first + visible))]
+
+        if lines != self.shown:
+            self.text.configure(state='normal')
+            for line_number, line in enumerate(lines, start=1):
+                if line_number > len(self.shown):
+                    self.text.insert('end-1c', f'\n{line}' if line_number > 1 else line)
+                elif self.shown[line_number - 1] != line:
+                    self.text.delete(f'{line_number}.0', f'{line_number}.end')
+                    self.text.insert(f'{line_number}.0', line)
+            if len(lines) < len(self.shown):
+                self.text.delete(f'{len(lines)}.end' if lines else '1.0', tk.END)
+            self.text.configure(state='disabled')
+            self.shown = lines
+
+        if self.rows:
+            self.scrollbar.set(self.first / len(self.rows),
+                               (self.first + len(lines)) / len(self.rows))
+        else:
+            self.scrollbar.set(0, 1)
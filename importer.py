@@ -0,0 +1,313 @@
+# BUILTIN
+import html
+import json
+import os
+import queue
+import re
+import threading
+import time
+from html.parser import HTMLParser
+# CUSTOM
+from dispatch import Dispatcher
+from driver import Driver
+from scraping import Scraper
+from service import ConsoleLog
+from settings import config
+from tracking import LinkTracker
+
+FORMATS = ('text', 'json', 'bookmarks')
+
+# Characters read at once, exports are never loaded as a whole
+CHUNK_SIZE = 1024 * 1024
+# Longer words of text files are dropped instead of being held across chunks
+MAX_URL_LENGTH = 64 * 1024
+# Punctuation of the sentence around a URL in text
+URL_TRAILING = '.,;:!?)]}'
+
+TEXT_URL_RE = re.compile(r'https?://[^\s"\'<>]+')
+# Whitespace followed by the unfinished rest of a chunk
+LAST_SPACE_RE = re.compile(r'\s\S*\Z')
+
+# Strings, punctuation and the other scalars (numbers, true, false, null) of JSON
+JSON_TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*"|[{}\[\]:,]|[^\s{}\[\]:,"]+')
+# Strings longer than this are taken as a broken file instead of being buffered on and on
+MAX_JSON_STRING = 16 * 1024 * 1024
+# Fields holding the URL of an entry: Reddit's listings (saved posts and comments),
+# browser bookmark backups and most other exports
+JSON_URL_KEYS = ('url', 'url_overridden_by_dest', 'permalink', 'link_permalink', 'href', 'uri')
+# Parts of Reddit's posts with URLs of previews, thumbnails and awards, not of entries
+JSON_SKIPPED_KEYS = (
+    'preview', 'media', 'secure_media', 'media_metadata', 'gallery_data',
+    'all_awardings', 'awarders', 'resized_icons', 'resized_static_icons',
+    'crosspost_parent_list', 'sr_detail', 'link_flair_richtext', 'author_flair_richtext',
+)
+
+
+def get_format(path):
+    """
+    Guess the format of an export by its file extension.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.json':
+        return 'json'
+    if extension in ('.html', '.htm'):
+        return 'bookmarks'
+    return 'text'
+
+
+def read_chunks(path):
+    with open(path, encoding='utf-8', errors='replace') as export_file:
+        while True:
+            chunk = export_file.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def read_text(path):
+    """
+    Find the URLs in a text file (one per line, or anywhere in the text).
+    """
+    tail = ''
+    for chunk in read_chunks(path):
+        text = tail + chunk
+        # The last word might continue in the next chunk
+        last_space = LAST_SPACE_RE.search(text)
+        cut = last_space.start() + 1 if last_space else 0
+        for match in TEXT_URL_RE.finditer(text, 0, cut):
+            yield match.group().rstrip(URL_TRAILING)
+        tail = text[cut:]
+        if len(tail) > MAX_URL_LENGTH:
+            tail = ''
+
+    for match in TEXT_URL_RE.finditer(tail):
+        yield match.group().rstrip(URL_TRAILING)
+
+
+def iter_json_tokens(path):
+    """
+    Split a JSON file into its tokens, a chunk at a time.
+    Several documents after another (e.g. JSON lines) are fine as well.
+    """
+    tail = ''
+    for chunk in read_chunks(path):
+        text = tail + chunk
+        position = 0
+        for match in JSON_TOKEN_RE.finditer(text):
+            # Skipped over a quote, the string isn't complete yet
+            if text[position:match.start()].strip():
+                break
+            # Numbers and literals might continue in the next chunk
+            if match.end() == len(text) and not match.group().startswith('"'):
+                break
+            yield match.group()
+            position = match.end()
+        tail = text[position:]
+        if len(tail) > MAX_JSON_STRING:
+            raise ValueError(f'Unterminated string in {path}')
+
+    if tail.strip():
+        yield from JSON_TOKEN_RE.findall(tail)
+
+
+def read_json(path):
+    """
+    Find the URLs in a JSON export (e.g. Reddit's saved posts) with an incremental parser,
+    never holding more than a chunk of the file: the values of the URL fields
+    (JSON_URL_KEYS) at any depth, outside of the parts listed in JSON_SKIPPED_KEYS,
+    and the items of plain lists of URLs.
+    """
+    # Per open object or list: [is_object, is_skipped, key of the current value]
+    stack = []
+    is_key = False  # The next string of the object is a key
+
+    for token in iter_json_tokens(path):
+        if token in ('{', '['):
+            parent = stack[-1] if stack else None
+            is_skipped = parent is not None and (parent[1] or parent[2] in JSON_SKIPPED_KEYS)
+            stack.append([token == '{', is_skipped, None])
+            is_key = token == '{'
+        elif token in ('}', ']'):
+            if stack:
+                stack.pop()
+            is_key = False
+        elif token == ',':
+            is_key = bool(stack) and stack[-1][0]
+        elif token == ':':
+            is_key = False
+        elif not stack:
+            continue
+        elif is_key:
+            stack[-1][2] = json.loads(token) if '\\' in token else token[1:-1]
+        elif token.startswith('"') and not stack[-1][1]:
+            is_object, _, key = stack[-1]
+            if is_object and key not in JSON_URL_KEYS:
+                continue
+            try:
+                # Undo JSON's escapes, then the HTML entities Reddit puts in its URLs
+                url = html.unescape(json.loads(token))
+            except ValueError:
+                continue
+            if key in ('permalink', 'link_permalink') and url.startswith('/'):
+                url = f'https://www.reddit.com{url}'
+            if url.startswith(('http://', 'https://')):
+                yield url
+
+
+class LinkParser(HTMLParser):
+    """
+    Collect the targets of all links of an HTML document fed to it piece by piece.
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            href = dict(attrs).get('href')
+            if href:
+                self.links.append(href)
+
+
+def read_bookmarks(path):
+    """
+    Find the URLs in a bookmark export (the Netscape bookmark HTML all browsers write).
+    """
+    parser = LinkParser()
+    for chunk in read_chunks(path):
+        parser.feed(chunk)
+        links, parser.links = parser.links, []
+        yield from links
+    parser.close()
+    yield from parser.links
+
+
+READERS = {
+    'text': read_text,
+    'json': read_json,
+    'bookmarks': read_bookmarks,
+}
+
+
+class Importer:
+    """
+    Feed the URLs of (possibly huge) export files to the dispatcher.
+    The file is read in a separate thread, keeping only the supported URLs which
+    weren't seen before. They're handed over through a queue of config.import_queue_size
+    URLs, so reading waits whenever resolving falls behind.
+    After every config.import_batch_size accepted URLs, on_batch is called
+    to download the batch and make room for the next one.
+    """
+    __slots__ = ('dispatcher', 'log_text', 'on_batch', 'seen', 'stopped', 'counts')
+
+    def __init__(self, dispatcher, log_text, on_batch):
+        self.dispatcher = dispatcher
+        self.log_text = log_text
+        self.on_batch = on_batch
+        # Dumps may hold more URLs than fit into memory as a set
+        self.seen = LinkTracker(config.tracking_capacity, config.tracking_error_rate)
+        self.stopped = threading.Event()
+        self.counts = {'read': 0, 'duplicates': 0, 'accepted': 0}
+
+    def read(self, path, format_, urls, errors):
+        """
+        Put the new supported URLs of a file into the urls queue, then None.
+        """
+        try:
+            for url in READERS[format_](path):
+                self.counts['read'] += 1
+                url = self.dispatcher.normalize_url(url.strip())
+                if not self.dispatcher.is_url_supported(url):
+                    continue
+                if url in self.seen:
+                    self.counts['duplicates'] += 1
+                    continue
+                self.seen.add(url)
+
+                while not self.stopped.is_set():
+                    try:
+                        urls.put(url, timeout=1)
+                        break
+                    except queue.Full:
+                        pass
+                if self.stopped.is_set():
+                    return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            urls.put(None)
+
+    def run(self, path, format_=None):
+        """
+        Import a file, format_ being one of FORMATS (guessed from the extension if None).
+        """
+        format_ = format_ or get_format(path)
+        self.log_text.newline(f'Importing {path} ({format_})')
+        self.stopped.clear()
+
+        urls = queue.Queue(maxsize=config.import_queue_size)
+        errors = []
+        reader = threading.Thread(target=self.read, args=(path, format_, urls, errors),
+                                  daemon=True)
+        reader.start()
+
+        batch = 0
+        try:
+            while True:
+                url = urls.get()
+                if url is None:
+                    break
+                if self.dispatcher.check_url(text=url):
+                    self.counts['accepted'] += 1
+                    batch += 1
+                    # Sleep to not spam APIs
+                    time.sleep(config.import_delay)
+                if batch >= config.import_batch_size:
+                    self.finish_batch()
+                    batch = 0
+        finally:
+            self.stopped.set()
+            # Make room for the reader to see it's stopped
+            while reader.is_alive():
+                try:
+                    urls.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+        if batch:
+            self.finish_batch()
+        if errors:
+            raise errors[0]
+
+    def finish_batch(self):
+        self.log_text.newline(f'Imported {self.counts["accepted"]} URLs so far'
+                              f' ({self.counts["read"]} read,'
+                              f' {self.counts["duplicates"]} duplicates) - Downloading')
+        self.on_batch()
+
+
+def run(paths, format_=None):
+    """
+    Import export files without the GUI, downloading every batch right away.
+    """
+    log_text = ConsoleLog()
+    driver = Driver(log_text)
+    driver.start_driver()
+    scraper = Scraper(log_text, log_text)
+    dispatcher = Dispatcher(scraper, driver, log_text, log_text, log_text)
+
+    def download_batch():
+        scraper.download_files()
+        scraper.reset_batch()
+
+    importer = Importer(dispatcher, log_text, download_batch)
+    try:
+        for path in paths:
+            importer.run(path, format_)
+        log_text.newline(f'Import complete - {importer.counts["accepted"]} URLs')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scraper.close()
+        driver.quit_driver()
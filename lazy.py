@@ -0,0 +1,41 @@
+# BUILTIN
+import importlib
+import importlib.util
+import sys
+import threading
+import types
+
+# importlib.util.LazyLoader is not thread-safe before Python 3.12.3,
+# and downloads run in several threads which may touch a module first at the same time
+_import_lock = threading.Lock()
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module which imports the real one on first attribute access.
+    The module is bound to it after that, so only the first access takes the lock.
+    """
+
+    def __getattr__(self, attribute):
+        module = self.__dict__.get('__lazy_module__')
+        if module is None:
+            with _import_lock:
+                module = self.__dict__.get('__lazy_module__')
+                if module is None:
+                    module = importlib.import_module(self.__name__)
+                    self.__dict__['__lazy_module__'] = module
+        return getattr(module, attribute)
+
+
+def lazy_import(name):
+    """
+    Import a module only once one of its attributes is accessed for the first time.
+    Used for the heavy third-party modules so the window shows up
+    without waiting for modules the current session might never need.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    if importlib.util.find_spec(name) is None:
+        raise ImportError(f'No module named {name!r}', name=name)
+    return LazyModule(name)
@@ -1,16 +1,53 @@
 # BUILTIN
-import tkinter as tk
+import time
+STARTED = time.perf_counter()  # As early as possible, to measure the startup
+import argparse  # noqa: E402
+import json  # noqa: E402
+import tkinter as tk  # noqa: E402
 # CUSTOM
-from gui import Application
+import storage  # noqa: E402
+from gui import Application  # noqa: E402
 
 
-def main():
+def parse_args():
+    """
+    Parse the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description='IG Downloader')
+    parser.add_argument('--serve', action='store_true',
+                        help='run as a local service with a JSON API instead of the GUI')
+    parser.add_argument('--host', help='address to serve the API on')
+    parser.add_argument('--port', type=int, help='port to serve the API on')
+    parser.add_argument('--drivers', type=int, help='amount of webdrivers to share between jobs')
+    parser.add_argument('--sync', action='store_true',
+                        help='regularly download new posts of the watched profiles and subreddits')
+    parser.add_argument('--once', action='store_true',
+                        help='only sync once (or work until the queue is empty), then exit')
+    parser.add_argument('--watch', metavar='KIND:NAME', action='append', default=[],
+                        help='add a source to the watch list, e.g. reddit:pics or instagram:nasa')
+    parser.add_argument('--worker', action='store_true',
+                        help='download the URLs of a queue shared with other workers')
+    parser.add_argument('--enqueue', metavar='URL', action='append', default=[],
+                        help='add a URL to the queue of the workers')
+    parser.add_argument('--queue', metavar='PATH', help='path of the queue (default: queue_path)')
+    parser.add_argument('--import', dest='import_files', metavar='FILE', action='append',
+                        default=[], help='download the URLs of an export file, e.g. Reddit\'s'
+                                         ' saved posts (JSON), bookmarks (HTML) or a list')
+    parser.add_argument('--import-format', choices=('text', 'json', 'bookmarks'),
+                        help='format of the import files (default: by file extension)')
+    parser.add_argument('--startup-report', action='store_true',
+                        help='print the time until the window shows up (as JSON) and exit,'
+                             ' see startup.py')
+    return parser.parse_args()
+
+
+def main(startup_report=False):
     """
     Instantiate the GUI class and start the main loop.
     """
     # Scraper and Driver are initialized inside of Application's __init__
     root = tk.Tk()
-    app = Application(root)
+    app = Application(root, start_driver=not startup_report)
 
     screen_width = root.winfo_screenwidth()
     screen_height = root.winfo_screenheight()
@@ -23,8 +60,43 @@ def main():
     root.configure(background=app.border_color)
     root.resizable(width=False, height=False)
 
+    if startup_report is True:
+        root.update()
+        print(json.dumps({'first_window': (time.perf_counter() - STARTED) * 1000}))
+        root.destroy()
+        return
+
     root.mainloop()
+    # The files of the last group, if streamed downloads never ended a batch
+    storage.fsync_queue.flush()
 
 
 if __name__ == '__main__':
-    main()
+    args = parse_args()
+    if args.watch or args.sync:
+        from settings import config
+        import sync
+        watch_list = sync.WatchList(config.watchlist_path)
+        for source in args.watch:
+            kind, _, name = source.partition(':')
+            if watch_list.add(kind, name):
+                print(f'Now watching {kind} {name}')
+        if args.sync:
+            sync.run(once=args.once)
+    elif args.import_files:
+        import importer
+        importer.run(args.import_files, args.import_format)
+    elif args.enqueue or args.worker:
+        from settings import config
+        import worker
+        queue = worker.JobQueue(args.queue or config.queue_path)
+        for url in args.enqueue:
+            if queue.put(url):
+                print(f'Queued {url}')
+        if args.worker:
+            worker.Worker(queue).run(once=args.once)
+    elif args.serve:
+        import service
+        service.serve(host=args.host, port=args.port, pool_size=args.drivers)
+    else:
+        main(startup_report=args.startup_report)
@@ -0,0 +1,67 @@
+# CUSTOM
+from settings import config
+
+# The extractors only read embedded JSON and meta tags, the DOM being parsed is enough
+DOM_READY = "document.readyState !== 'loading'"
+
+# Resources none of the extractors need, blocked by URL pattern
+MEDIA_PATTERNS = [
+    '*.jpg', '*.jpeg', '*.png', '*.gif', '*.webp', '*.svg', '*.ico',
+    '*.mp4', '*.webm', '*.m4s', '*.mp3',
+    '*.woff', '*.woff2', '*.ttf', '*.otf',
+]
+# Ads, analytics and tracking, never needed to read a page
+THIRD_PARTY_PATTERNS = [
+    '*doubleclick.net*', '*googlesyndication.com*', '*googleadservices.com*',
+    '*google-analytics.com*', '*googletagmanager.com*', '*googletagservices.com*',
+    '*connect.facebook.net*', '*scorecardresearch.com*', '*quantserve.com*',
+    '*amazon-adsystem.com*', '*adnxs.com*', '*criteo.com*', '*criteo.net*',
+    '*taboola.com*', '*outbrain.com*', '*moatads.com*', '*hotjar.com*',
+]
+
+
+class SiteProfile:
+    """
+    How the webdriver loads the pages of a site:
+    the condition (a JavaScript expression) which has to be true before the page
+    can be read, and which requests to block while loading it.
+    """
+    __slots__ = ('name', 'ready', 'block_media', 'block_third_party')
+
+    def __init__(self, name, ready=DOM_READY, block_media=True, block_third_party=True):
+        self.name = name
+        self.ready = ready
+        self.block_media = block_media
+        self.block_third_party = block_third_party
+
+    def get_blocked_urls(self):
+        """
+        Get the URL patterns to block while loading pages of this site.
+        """
+        patterns = []
+        if self.block_media and config.driver_block_media:
+            patterns += MEDIA_PATTERNS
+        if self.block_third_party and config.driver_block_third_party:
+            patterns += THIRD_PARTY_PATTERNS + list(config.driver_blocked_hosts)
+        return patterns
+
+
+PROFILES = {profile.name: profile for profile in (
+    SiteProfile('default'),
+    # Post data is in one of these inline scripts, see Scraper.get_ig_data
+    SiteProfile('instagram', ready=(
+        f'{DOM_READY} && Array.from(document.scripts).some(script =>'
+        " script.text.startsWith('window._sharedData')"
+        " || script.text.startsWith('window.__additionalDataLoaded'))"
+    )),
+    # Only the src of the avatar is read, the image itself is not needed
+    SiteProfile('instadp', ready="document.querySelector('img.picture') !== null"),
+    SiteProfile('imgur'),
+    # JSON documents (Reddit posts, Instagram's GraphQL API) are shown inside of a <pre>
+    SiteProfile('json', ready=f"{DOM_READY} && document.querySelector('pre') !== null"),
+    SiteProfile('tumblr'),
+    SiteProfile('twitter'),
+    # The login form is built by scripts and interacted with, load everything
+    SiteProfile('login', ready="document.readyState === 'complete'",
+                block_media=False, block_third_party=False),
+)}
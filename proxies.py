@@ -0,0 +1,190 @@
+# BUILTIN
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+# CUSTOM
+from lazy import lazy_import
+from settings import config
+# PIP (imported on first use, see lazy.py)
+requests = lazy_import('requests')
+
+# Latencies are smoothed over roughly the last few requests
+LATENCY_WEIGHT = 0.3
+# A proxy's latency only counts towards the comparison once it has this many samples
+MIN_SAMPLES = 3
+# Proxies answering faster than this are never too slow, whatever the others do
+MIN_SLOW_LATENCY = 0.25
+# Responses meaning the proxy itself is the problem (auth, or its IP got throttled)
+FAILURE_STATUSES = (407, 429)
+
+
+class Proxy:
+    """
+    An HTTP or SOCKS proxy and how well it did so far.
+    """
+    __slots__ = ('url', 'latency', 'samples', 'failures', 'drains', 'drained_until', 'hosts')
+
+    def __init__(self, url):
+        self.url = url
+        self.latency = None  # Smoothed seconds until the response headers arrived
+        self.samples = 0
+        self.failures = 0  # In a row
+        self.drains = 0  # In a row, each one lasts twice as long as the one before
+        self.drained_until = 0
+        self.hosts = set()  # Hosts assigned to the proxy (sticky assignment)
+
+    def is_drained(self, now):
+        return self.drained_until > now
+
+    def as_dict(self, now):
+        return {
+            'url': self.url,
+            'latency': self.latency,
+            'failures': self.failures,
+            'drained_for': max(self.drained_until - now, 0),
+            'hosts': len(self.hosts),
+        }
+
+
+class ProxyPool:
+    """
+    Spread the outgoing requests over the proxies in config.proxies, so per-IP limits
+    of CDNs apply to each proxy instead of to all traffic together.
+    Hosts are either pinned to one proxy ('sticky', keeping cookies and connections
+    on one IP) or every request takes the next proxy ('round_robin').
+    Proxies failing config.proxy_max_failures times in a row, or which are
+    config.proxy_slow_factor times slower than the median proxy, get drained:
+    they get no requests for config.proxy_drain_time seconds (doubling every time
+    in a row), after which they get another chance.
+    Without proxies configured, all requests go out directly.
+    """
+    __slots__ = ('proxies', 'assignments', 'counter', 'lock')
+
+    def __init__(self, urls=None):
+        if urls is None:
+            urls = config.proxies
+        self.proxies = [Proxy(url) for url in urls]
+        self.assignments = {}  # Host -> Proxy
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def choose(self, url=None):
+        """
+        Get the proxy to request a URL through, None to connect directly.
+        Without a URL (e.g. for a webdriver) the healthy proxies take turns.
+        """
+        with self.lock:
+            if not self.proxies:
+                return None
+
+            now = time.monotonic()
+            healthy = [proxy for proxy in self.proxies if not proxy.is_drained(now)]
+            if not healthy:
+                # Rather use the proxy which is back soonest than the direct connection
+                return min(self.proxies, key=lambda proxy: proxy.drained_until)
+
+            if url is None or config.proxy_assignment == 'round_robin':
+                self.counter += 1
+                return healthy[self.counter % len(healthy)]
+
+            host = urlsplit(url).hostname
+            proxy = self.assignments.get(host)
+            if proxy is None or proxy.is_drained(now):
+                if proxy is not None:
+                    proxy.hosts.discard(host)
+                proxy = min(healthy, key=self.get_load)
+                proxy.hosts.add(host)
+                self.assignments[host] = proxy
+            return proxy
+
+    @staticmethod
+    def get_load(proxy):
+        """
+        Sort key of the proxies, fewest hosts first, then the fastest.
+        """
+        return len(proxy.hosts), proxy.latency or 0
+
+    def report(self, proxy, latency=None, failed=False):
+        """
+        Record how a request through a proxy went.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if failed:
+                proxy.failures += 1
+                if proxy.failures >= config.proxy_max_failures:
+                    self.drain(proxy, now)
+                return
+
+            proxy.failures = 0
+            if proxy.latency is None:
+                proxy.latency = latency
+            else:
+                proxy.latency += LATENCY_WEIGHT * (latency - proxy.latency)
+            proxy.samples += 1
+
+            if proxy.samples >= MIN_SAMPLES:
+                # Compared against the others only, with few proxies its own latency
+                # would pull the median up and hide how slow it is
+                latencies = [other.latency for other in self.proxies
+                             if other is not proxy and other.samples >= MIN_SAMPLES
+                             and not other.is_drained(now)]
+                if latencies and proxy.latency > max(
+                        config.proxy_slow_factor * statistics.median(latencies), MIN_SLOW_LATENCY):
+                    self.drain(proxy, now)
+                else:
+                    proxy.drains = 0
+
+    def drain(self, proxy, now):
+        """
+        Take a proxy out of rotation for a while. Must hold the lock.
+        """
+        proxy.drains += 1
+        proxy.drained_until = now + config.proxy_drain_time * 2 ** min(proxy.drains - 1, 6)
+        # Judged afresh once it's back
+        proxy.failures = 0
+        proxy.latency = None
+        proxy.samples = 0
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request (see requests.request) through the proxy chosen for its URL
+        and score the proxy by the result.
+        """
+        proxy = self.choose(url)
+        if proxy is None:
+            return requests.request(method, url, **kwargs)
+
+        kwargs['proxies'] = {'http': proxy.url, 'https': proxy.url}
+        start = time.monotonic()
+        try:
+            res = requests.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            self.report(proxy, failed=True)
+            raise
+        self.report(proxy, time.monotonic() - start,
+                    failed=res.status_code in FAILURE_STATUSES)
+        return res
+
+    def as_dict(self):
+        now = time.monotonic()
+        with self.lock:
+            return {
+                'assignment': config.proxy_assignment,
+                'proxies': [proxy.as_dict(now) for proxy in self.proxies],
+            }
+
+
+# Shared by all requests of the process, so the scores and assignments are too
+pool = ProxyPool()
+
+
+def get(url, **kwargs):
+    return pool.request('GET', url, **kwargs)
+
+
+def head(url, **kwargs):
+    # Like requests.head
+    kwargs.setdefault('allow_redirects', False)
+    return pool.request('HEAD', url, **kwargs)
@@ -0,0 +1,314 @@
+# BUILTIN
+import os
+import re
+import shutil
+import subprocess
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+# CUSTOM
+import proxies
+import segmented
+import storage
+from bandwidth import shaper
+from scheduler import DownloadInterrupted
+from settings import config
+
+
+class DashError(Exception):
+    pass
+
+
+class Representation:
+    """
+    A single rendition (video or audio) listed in a DASH manifest.
+    """
+    __slots__ = ('content_type', 'bandwidth', 'height', 'base_url', 'segments')
+
+    def __init__(self, content_type, bandwidth, height, base_url, segments):
+        self.content_type = content_type  # 'video' or 'audio'
+        self.bandwidth = bandwidth
+        self.height = height
+        self.base_url = base_url  # Absolute URL of the rendition's media file
+        self.segments = segments  # Absolute segment URLs, empty for single-file renditions
+
+    def __repr__(self):
+        return (f'<Representation {self.content_type}'
+                f' {self.height}p @ {self.bandwidth}bps>')
+
+
+class DashManifest:
+    """
+    Parse the DASHPlaylist.mpd of a v.redd.it video and
+    pick the best video and audio renditions from it.
+    """
+    __slots__ = ('url', 'representations')
+
+    def __init__(self, url, xml_text):
+        self.url = url
+        self.representations = self.parse(url, xml_text)
+
+    @classmethod
+    def from_video_url(cls, url):
+        """
+        Fetch the manifest belonging to a v.redd.it (fallback) URL.
+        """
+        manifest_url = f'https://v.redd.it/{get_video_id(url)}/DASHPlaylist.mpd'
+        res = proxies.get(manifest_url, headers=config.headers, timeout=config.dash_timeout)
+        if res.status_code != 200:
+            raise DashError(f'Unexpected response code ({res.status_code})'
+                            ' for DASH manifest')
+        return cls(manifest_url, res.text)
+
+    @staticmethod
+    def strip_namespace(tag):
+        """
+        Remove the '{urn:mpeg:dash:schema:mpd:2011}' prefix ElementTree adds to tags.
+        """
+        return tag.split('}')[-1]
+
+    @classmethod
+    def parse(cls, url, xml_text):
+        """
+        Collect all representations of the manifest's first period.
+        """
+        try:
+            root = ElementTree.fromstring(xml_text)
+        except ElementTree.ParseError as e:
+            raise DashError(f'Could not parse DASH manifest: {e}')
+
+        # Drop namespaces once so the lookups below stay readable
+        for element in root.iter():
+            element.tag = cls.strip_namespace(element.tag)
+
+        duration = parse_duration(root.get('mediaPresentationDuration', ''))
+        representations = []
+
+        for adaptation_set in root.iter('AdaptationSet'):
+            for rep in adaptation_set.iter('Representation'):
+                # Older manifests only carry the mime type, and only on one of the two tags
+                content_type = (adaptation_set.get('contentType')
+                                or rep.get('mimeType', adaptation_set.get('mimeType', '')))
+                content_type = content_type.split('/')[0]
+                if content_type not in ('video', 'audio'):
+                    continue
+
+                base_url = url
+                base_tag = rep.find('BaseURL')
+                if base_tag is not None and base_tag.text:
+                    base_url = urljoin(url, base_tag.text.strip())
+
+                representations.append(Representation(
+                    content_type=content_type,
+                    bandwidth=int(rep.get('bandwidth', 0)),
+                    height=int(rep.get('height', 0)),
+                    base_url=base_url,
+                    segments=cls.get_segments(rep, adaptation_set, base_url, duration),
+                ))
+
+        if not representations:
+            raise DashError('DASH manifest does not list any renditions')
+        return representations
+
+    @staticmethod
+    def get_segments(rep, adaptation_set, base_url, duration):
+        """
+        Resolve the segment URLs of a representation.
+        Return an empty list for renditions stored as a single file (SegmentBase).
+        """
+        segment_list = rep.find('SegmentList')
+        if segment_list is not None:
+            segments = []
+            init = segment_list.find('Initialization')
+            if init is not None and init.get('sourceURL'):
+                segments.append(urljoin(base_url, init.get('sourceURL')))
+            segments.extend(urljoin(base_url, seg.get('media'))
+                            for seg in segment_list.iter('SegmentURL'))
+            return segments
+
+        template = rep.find('SegmentTemplate')
+        if template is None:
+            template = adaptation_set.find('SegmentTemplate')
+        if template is None:
+            return []
+
+        def fill(pattern, number):
+            pattern = pattern.replace('$RepresentationID$', rep.get('id', ''))
+            pattern = pattern.replace('$Bandwidth$', rep.get('bandwidth', ''))
+            return re.sub(r'\$Number(?:%0(\d+)d)?\$',
+                          lambda m: str(number).zfill(int(m.group(1) or 0)),
+                          pattern)
+
+        segments = []
+        if template.get('initialization'):
+            segments.append(urljoin(base_url, fill(template.get('initialization'), 0)))
+
+        start = int(template.get('startNumber', 1))
+        timeline = template.find('SegmentTimeline')
+        if timeline is not None:
+            count = sum(int(s.get('r', 0)) + 1 for s in timeline.iter('S'))
+        else:
+            timescale = int(template.get('timescale', 1))
+            seg_duration = int(template.get('duration', 0)) / timescale
+            if not seg_duration or not duration:
+                raise DashError('Cannot determine the number of DASH segments')
+            count = -(-duration // seg_duration)  # Round up
+
+        segments.extend(urljoin(base_url, fill(template.get('media'), number))
+                        for number in range(start, start + int(count)))
+        return segments
+
+    def best(self, content_type):
+        """
+        Get the rendition with the highest resolution/bitrate of a type, if any.
+        """
+        candidates = [rep for rep in self.representations if rep.content_type == content_type]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda rep: (rep.height, rep.bandwidth))
+
+
+def get_video_id(url):
+    """
+    Get the ID of a v.redd.it video, e.g. 'abc123' of
+    https://v.redd.it/abc123/DASH_720.mp4?source=fallback
+    """
+    return url.split('v.redd.it/')[1].split('/')[0].split('?')[0]
+
+
+def parse_duration(text):
+    """
+    Convert an ISO 8601 duration like 'PT1M12.5S' to seconds.
+    """
+    match = re.match(r'P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:([\d.]+)S)?', text)
+    if not match or not text:
+        return 0
+    days, hours, minutes, seconds = (float(group or 0) for group in match.groups())
+    return days * 86400 + hours * 3600 + minutes * 60 + seconds
+
+
+def fetch_segment(url):
+    """
+    Fetch a single segment into memory.
+    """
+    res = proxies.get(url, headers=config.headers, timeout=config.dash_timeout)
+    if res.status_code != 200:
+        raise DashError(f'Unexpected response code ({res.status_code}) for {url}')
+    # Fetched in one go, so it can only be accounted for afterwards
+    shaper.throttle(url, len(res.content))
+    return res.content
+
+
+def download_representation(rep, file_dst, check=None):
+    """
+    Download a rendition, fetching its segments concurrently and writing them in order.
+    Single-file renditions get split into byte ranges of config.dash_chunk_size
+    (fetched over up to config.dash_workers connections) if the server supports it,
+    and can be resumed after being interrupted by check.
+    Segmented renditions are written to a partial file as well, which only gets moved
+    to file_dst once complete. They start over after being interrupted.
+    """
+    if not rep.segments:
+        size, accepts_ranges = segmented.probe(rep.base_url)
+        if accepts_ranges and size > config.dash_chunk_size:
+            connections = min(config.dash_workers, -(-size // config.dash_chunk_size))
+            segmented.download(rep.base_url, file_dst, size, check, connections)
+        else:
+            segmented.download_resumable(rep.base_url, file_dst, check)
+        return
+
+    part_file = f'{file_dst}.part'
+    try:
+        with ThreadPoolExecutor(max_workers=config.dash_workers) as executor, \
+                storage.open_part(part_file, 'wb') as dl_file:
+            for content in executor.map(fetch_segment, rep.segments):
+                if check is not None:
+                    check(len(content))
+                dl_file.write(content)
+        storage.fsync_queue.finish(part_file, file_dst)
+    except DownloadInterrupted:
+        # Kept like the partial files of other downloads, it gets overwritten on resuming
+        raise
+    except Exception:
+        segmented.remove_partial(file_dst)
+        raise
+
+
+def merge(video_file, audio_file, file_dst):
+    """
+    Mux the video and audio streams into one file without re-encoding.
+    Written to a partial file first, so an interrupted merge never looks like a finished one.
+    Return a bool on whether or not ffmpeg was available and succeeded.
+    """
+    ffmpeg = shutil.which(config.ffmpeg_path)
+    if ffmpeg is None:
+        return False
+
+    part_file = f'{file_dst}.part'
+    result = subprocess.run(
+        [ffmpeg, '-y', '-loglevel', 'error',
+         '-i', video_file, '-i', audio_file, '-c', 'copy', '-f', 'mp4', part_file],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    if result.returncode != 0:
+        segmented.remove_partial(file_dst)
+        return False
+    storage.fsync_queue.finish(part_file, file_dst)
+    return True
+
+
+def get_stream_files(file_dst):
+    """
+    Get the paths the video and audio streams of a video are downloaded to before merging.
+    """
+    root, ext = os.path.splitext(file_dst)
+    return f'{root}_video{ext}', f'{root}_audio{ext}'
+
+
+def remove_partial(file_dst):
+    """
+    Delete the streams (and their partial files) an unfinished download of file_dst left behind.
+    """
+    segmented.remove_partial(file_dst)
+    for stream_file in get_stream_files(file_dst):
+        if os.path.exists(stream_file):
+            os.remove(stream_file)
+        segmented.remove_partial(stream_file)
+
+
+def download_video(url, file_dst, log_text, check=None):
+    """
+    Download the best video and audio renditions of a v.redd.it video
+    and merge them into file_dst.
+    check gets called while downloading and may raise to interrupt it.
+    """
+    manifest = DashManifest.from_video_url(url)
+    video = manifest.best('video')
+    audio = manifest.best('audio')
+    if video is None:
+        raise DashError('DASH manifest does not list a video rendition')
+
+    # GIF-like uploads come without audio
+    if audio is None:
+        download_representation(video, file_dst, check)
+        return
+
+    video_file, audio_file = get_stream_files(file_dst)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(download_representation, video, video_file, check),
+                   executor.submit(download_representation, audio, audio_file, check)]
+        for future in futures:
+            future.result()
+    # Read right away, they don't need to wait for their group (see storage.FsyncQueue)
+    storage.fsync_queue.release(video_file)
+    storage.fsync_queue.release(audio_file)
+
+    if merge(video_file, audio_file, file_dst):
+        os.remove(video_file)
+        os.remove(audio_file)
+    else:
+        # Keep the audio next to the video so nothing is lost
+        log_text.newline('Could not merge Reddit video and audio (is ffmpeg installed?)'
+                         ' - Keeping them as separate files')
+        os.replace(video_file, file_dst)
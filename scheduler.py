@@ -0,0 +1,362 @@
+# BUILTIN
+import heapq
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+# CUSTOM
+import signed
+from settings import config
+from tracing import tracer
+
+# Priority classes, lower ones get downloaded first
+HIGH = 0
+NORMAL = 1
+LOW = 2
+
+# States of a DownloadJob
+QUEUED = 'queued'
+RUNNING = 'running'
+PAUSED = 'paused'
+CANCELLED = 'cancelled'
+
+
+class DownloadInterrupted(Exception):
+    """
+    Raised inside of a running download once it got paused or cancelled.
+    """
+    pass
+
+
+class DownloadJob:
+    """
+    A single file waiting to be downloaded.
+    """
+    __slots__ = (
+        'index', 'url', 'type_', 'priority', 'size', 'accepts_ranges', 'expires',
+        'lane', 'version', 'state',
+    )
+
+    def __init__(self, index, url, type_, expires=None):
+        self.index = index  # Position in Scraper.download_links
+        # Replaced by a fresh link if a signed one expires, see Scraper.renew_link
+        self.url = url
+        self.type_ = type_
+        self.priority = NORMAL
+        self.size = None  # Estimated size in bytes, None if unknown
+        self.accepts_ranges = None  # Whether the server takes byte ranges, None if unknown
+        self.expires = expires  # Expiry of a signed link (Unix timestamp), see signed.py
+        self.lane = None
+        # Heap entries of older versions are stale, see DownloadScheduler.push()
+        self.version = 0
+        self.state = QUEUED
+
+    @property
+    def probed(self):
+        """
+        What estimating the size found out, as (size, accepts_ranges), so downloading
+        doesn't need to ask again (see segmented.download_if_large). None if not probed.
+        """
+        if self.accepts_ranges is None:
+            return None
+        return self.size or 0, self.accepts_ranges
+
+    @property
+    def sort_key(self):
+        # Links about to expire go first within their priority, the one expiring first leading
+        # (taken whenever the job gets pushed, e.g. once probed or requeued)
+        if signed.is_urgent(self.expires):
+            return self.priority, 0, self.expires
+        # Unknown sizes go after all known ones of the same priority
+        size = self.size if self.size is not None else float('inf')
+        return self.priority, 1, size
+
+
+class DownloadScheduler:
+    """
+    Order downloads by priority class and estimated size, smallest first
+    (signed links which are about to expire right after their priority class),
+    and run small and large files on separate lanes (worker threads),
+    so one big video doesn't hold up hundreds of small images.
+    Sizes get estimated concurrently (e.g. with HEAD requests) before queueing.
+    The whole batch or single files can be paused, resumed and cancelled,
+    running downloads notice that by calling check().
+    """
+    __slots__ = (
+        'download', 'estimate_size', 'discard', 'log_text',
+        'lanes', 'jobs', 'running', 'priorities', 'paused', 'stopped',
+        'condition', 'counter', 'unfinished', 'workers', 'probe_executor',
+    )
+
+    lane_names = ('small', 'large')
+
+    def __init__(self, download, estimate_size, discard, log_text):
+        self.download = download  # Called with each DownloadJob
+        # Called with a URL, returns (bytes, accepts byte ranges), either None if unknown
+        self.estimate_size = estimate_size
+        self.discard = discard  # Called with each cancelled DownloadJob, to clean up
+        self.log_text = log_text
+
+        self.lanes = {name: [] for name in self.lane_names}  # Heaps of (key, seq, version, job)
+        self.jobs = {}  # Index -> DownloadJob, for everything not yet downloaded
+        self.running = {}  # Index -> DownloadJob, for everything being downloaded
+        # URL -> priority class, so files can be bumped before they are queued
+        self.priorities = {}
+        self.paused = False  # Whole batch
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.counter = itertools.count()  # Keeps heap order stable (FIFO) for equal keys
+        self.unfinished = 0
+        self.workers = []
+        self.probe_executor = ThreadPoolExecutor(max_workers=config.scheduler_probe_workers,
+                                                 thread_name_prefix='probe')
+
+    def start_workers(self):
+        """
+        Start the worker threads of every lane, if not done yet.
+        """
+        if self.workers:
+            return
+
+        lane_workers = {
+            'small': config.scheduler_small_workers,
+            'large': config.scheduler_large_workers,
+        }
+        for lane, amount in lane_workers.items():
+            for number in range(amount):
+                # Named for the trace's thread tracks, see tracing.py
+                worker = threading.Thread(target=self.work, args=(lane,), daemon=True,
+                                          name=f'{lane}-lane-{number}')
+                worker.start()
+                self.workers.append(worker)
+
+    def add(self, index, url, type_='image', expires=None):
+        """
+        Queue a file, it gets scheduled once its size is estimated.
+        """
+        job = DownloadJob(index, url, type_, expires)
+        job.priority = self.priorities.get(url, NORMAL)
+        with self.condition:
+            self.jobs[index] = job
+            self.unfinished += 1
+        self.start_workers()
+        self.probe_executor.submit(self.probe, job)
+
+    def probe(self, job):
+        """
+        Estimate the size of a file and put it into the fitting lane.
+        """
+        try:
+            with tracer.span('probe', url=job.url):
+                job.size, job.accepts_ranges = self.estimate_size(job.url)
+        except Exception as e:
+            self.log_text.newline(f'Could not estimate size of {job.url} ({e!r})')
+
+        if job.size is not None:
+            is_large = job.size >= config.scheduler_large_size
+        else:
+            is_large = job.type_ == 'video'
+        job.lane = 'large' if is_large else 'small'
+
+        with self.condition:
+            self.push(job)
+
+    def push(self, job):
+        """
+        (Re-)insert a job into its lane's heap. Must hold the condition.
+        Any earlier heap entry of the job becomes stale and gets skipped when popped.
+        """
+        job.version += 1
+        heapq.heappush(self.lanes[job.lane],
+                       (job.sort_key, next(self.counter), job.version, job))
+        self.condition.notify_all()
+
+    def pop(self, lane):
+        """
+        Get the next job of a lane, blocking until there is one.
+        Return None once the scheduler is stopped.
+        """
+        with self.condition:
+            while not self.stopped:
+                heap = self.lanes[lane]
+                while heap and not self.paused:
+                    _, _, version, job = heapq.heappop(heap)
+                    # Paused files get pushed again once they are resumed
+                    if version != job.version or job.state != QUEUED:
+                        continue
+                    if self.jobs.get(job.index) is job:
+                        del self.jobs[job.index]
+                        job.state = RUNNING
+                        self.running[job.index] = job
+                        return job
+                self.condition.wait()
+        return None
+
+    def work(self, lane):
+        """
+        Download the jobs of a lane one after another, until the scheduler is stopped.
+        """
+        while True:
+            job = self.pop(lane)
+            if job is None:
+                return
+            try:
+                self.download(job)
+            except DownloadInterrupted:
+                if self.requeue(job) is False:
+                    self.discard(job)
+                continue
+            except Exception as e:
+                self.log_text.newline(f'Download of file {job.index+1} failed: {e!r}')
+
+            with self.condition:
+                del self.running[job.index]
+                self.unfinished -= 1
+                self.condition.notify_all()
+
+    def requeue(self, job):
+        """
+        Put an interrupted job back in line, unless it got cancelled.
+        Return a bool on whether or not it was put back.
+        """
+        with self.condition:
+            del self.running[job.index]
+            if job.state == CANCELLED:
+                self.unfinished -= 1
+                self.condition.notify_all()
+                return False
+
+            self.jobs[job.index] = job
+            # Paused on its own, it waits for resume() (the batch being paused is not its state)
+            if job.state == RUNNING:
+                job.state = QUEUED
+                self.push(job)
+            return True
+
+    def check(self, job):
+        """
+        Called by running downloads between chunks,
+        raise DownloadInterrupted if the job should stop (for now).
+        """
+        if self.paused or job.state != RUNNING:
+            raise DownloadInterrupted(job.state)
+
+    def find(self, url=None):
+        """
+        Get the queued and running jobs of a URL, or all of them. Must hold the condition.
+        """
+        jobs = list(self.jobs.values()) + list(self.running.values())
+        if url is None:
+            return jobs
+        return [job for job in jobs if job.url == url]
+
+    def pause(self, url=None):
+        """
+        Pause a file, or the whole batch if no URL is given.
+        Running downloads stop at their next check and keep their partial files.
+        """
+        with self.condition:
+            if url is None:
+                self.paused = True
+                return
+            for job in self.find(url):
+                if job.state in (QUEUED, RUNNING):
+                    job.state = PAUSED
+
+    def resume(self, url=None):
+        """
+        Resume a paused file, or the whole batch if no URL is given.
+        """
+        with self.condition:
+            if url is None:
+                self.paused = False
+                self.condition.notify_all()
+                return
+            for job in self.find(url):
+                if job.state != PAUSED:
+                    continue
+                if job.index in self.running:
+                    # Did not reach its next check yet, just keep going
+                    job.state = RUNNING
+                else:
+                    job.state = QUEUED
+                    # Not probed yet, it gets pushed by probe() later
+                    if job.lane is not None:
+                        self.push(job)
+
+    def cancel(self, url=None):
+        """
+        Cancel a file, or the whole batch if no URL is given.
+        Waiting files are discarded right away, running ones at their next check.
+        """
+        discarded = []
+        with self.condition:
+            for job in self.find(url):
+                job.state = CANCELLED
+                if job.index in self.jobs:
+                    del self.jobs[job.index]
+                    self.unfinished -= 1
+                    discarded.append(job)
+            if url is None:
+                self.paused = False
+            self.condition.notify_all()
+
+        for job in discarded:
+            self.discard(job)
+
+    def set_priority(self, url, priority):
+        """
+        Change the priority class of a file, whether it's queued yet or not.
+        Return False if it's not queued (yet or anymore).
+        """
+        with self.condition:
+            self.priorities[url] = priority
+            jobs = [job for job in self.jobs.values() if job.url == url]
+            for job in jobs:
+                job.priority = priority
+                # Not probed yet, it gets pushed with the new priority later
+                if job.lane is not None:
+                    self.push(job)
+        return bool(jobs)
+
+    def bump(self, url):
+        return self.set_priority(url, HIGH)
+
+    def demote(self, url):
+        return self.set_priority(url, LOW)
+
+    def wait_probed(self):
+        """
+        Block until the size of every queued file is estimated.
+        """
+        with self.condition:
+            while any(job.lane is None for job in self.jobs.values()):
+                self.condition.wait()
+
+    def get_queued_size(self):
+        """
+        Get the estimated total size (in bytes) of all files not downloaded yet,
+        files of unknown size not included.
+        """
+        with self.condition:
+            return sum(job.size or 0 for job in self.find())
+
+    def stop(self, wait=False):
+        """
+        Let the worker threads end once they finished their current file,
+        and block until they did if wait is set.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.probe_executor.shutdown(wait=wait)
+        if wait:
+            for worker in self.workers:
+                worker.join()
+
+    def join(self):
+        """
+        Block until every queued file is downloaded.
+        """
+        with self.condition:
+            while self.unfinished > 0:
+                self.condition.wait()
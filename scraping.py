@@ -4,11 +4,27 @@ import os
 import random
 import re
 import string
-import time
-# PIP
-import requests
-import youtube_dl
-from bs4 import BeautifulSoup
+import threading
+# CUSTOM
+import proxies
+import reddit_dash
+import segmented
+import signed
+import storage
+import variants
+from archive import ArchiveStore
+from bandwidth import shaper
+from catalog import Catalog, parse_timestamp
+from dedup import ImageIndex
+from scheduler import DownloadInterrupted, DownloadScheduler
+from lazy import lazy_import
+from settings import config
+from tracing import tracer
+from tracking import LinkTracker
+# PIP (imported on first use, see lazy.py)
+bs4 = lazy_import('bs4')
+requests = lazy_import('requests')
+youtube_dl = lazy_import('youtube_dl')
 
 
 class YDLLogger:
@@ -36,20 +52,79 @@ class Scraper:
 
     __slots__ = (
         'log_text', 'download_tracking_label',
-        'download_links', 'display_links', 'tracking_links',
-        'last_download', 'youtube_ids',
+        'download_links', 'display_links', 'tracking',
+        'last_download', 'finished_downloads', 'dl_folder', 'lock',
+        'link_types', 'link_sources', 'link_source', 'current_source', 'link_meta',
+        'current_meta',
+        'link_status', 'link_bytes', 'link_expiry', 'captured', 'resolve_again',
+        'renewed_links', 'renew_lock',
+        'streaming', 'scheduler', 'image_index', 'catalog', 'archives',
         )
 
-    def __init__(self, log_text, download_tracking_label):
+    def __init__(self, log_text, download_tracking_label, tracking=None, image_index=None,
+                 catalog=None):
         self.log_text = log_text  # tk.Widget of the Application class
         self.download_tracking_label = download_tracking_label  # tk.Widget of the Application class
 
         self.display_links = []  # Links to be displayed in the GUI (gets reset after dl loop)
         self.download_links = []  # DOES get reset after a download loop
-        self.tracking_links = []  # Does NOT get reset after a download loop
+        # Does NOT get reset after a download loop, so it's a Bloom filter instead of a list
+        # Can be shared between multiple scrapers (see service.py)
+        if tracking is None:
+            tracking = LinkTracker(config.tracking_capacity, config.tracking_error_rate)
+        self.tracking = tracking
 
         self.last_download = ''  # Track the last downloaded URL to update widgets
-        self.youtube_ids = []  # Track YouTube video-IDs to add them to the file names
+        self.finished_downloads = 0  # Gets reset together with download_links
+        self.lock = threading.Lock()  # Files get downloaded by multiple threads at once
+        # Absolute path so multiple scrapers can download at once without changing directories
+        self.dl_folder = os.path.abspath('downloads')
+
+        # Also reset together with download_links
+        self.link_types = {}  # Link -> 'image', 'video', ...
+        self.link_sources = {}  # URL entered by the user -> links extracted from it
+        self.link_source = {}  # Link -> URL entered by the user it was extracted from
+        self.current_source = None  # Set by the Dispatcher while extracting
+        self.link_meta = {}  # Link -> metadata of its post, for the catalog
+        self.current_meta = None  # Metadata of a post whose link gets extracted elsewhere
+        self.link_status = {}  # Link -> 'queued', 'downloading', 'done', 'failed' or 'cancelled'
+        self.link_bytes = {}  # Link -> bytes received so far
+        self.link_expiry = {}  # Link -> when its signature expires (see signed.py), if it does
+
+        # Set by the Dispatcher: called with a source, extracts its links once more and
+        # returns them as (link, type, album index) tuples, to renew links which expired
+        self.resolve_again = None
+        # Collects the links which get appended while that's going on, instead of the batch
+        self.captured = None
+        # Source -> the links it was resolved to again, shared by all of its expired links
+        # Reset together with download_links
+        self.renewed_links = {}
+        self.renew_lock = threading.Lock()  # Held while resolving, only one at a time
+
+        # Downloads are ordered by priority and size and run on separate lanes
+        self.scheduler = DownloadScheduler(self.download_job, self.estimate_size,
+                                           self.discard_job, self.log_text)
+        # Streaming mode: download every link as soon as it gets appended
+        # instead of waiting for download_files to be called
+        self.streaming = config.stream_downloads
+
+        # Near-duplicate detection of downloaded images, can be shared like tracking
+        if image_index is None and config.dedup_images is True:
+            if ImageIndex.is_available():
+                image_index = ImageIndex(self.log_text, self.dl_folder)
+            else:
+                self.log_text.newline('Pillow is not installed - Duplicate detection disabled')
+        self.image_index = image_index
+
+        # Metadata of all downloaded files, can be shared like tracking
+        if catalog is None and config.catalog_path is not None:
+            catalog = Catalog(config.catalog_path)
+        self.catalog = catalog
+
+        # Small files go into archives instead of files of their own
+        self.archives = None
+        if config.archive_format is not None:
+            self.archives = ArchiveStore(self.dl_folder)
 
     @staticmethod
     def get_random_string(amount=10):
@@ -60,12 +135,34 @@ class Scraper:
         return ''.join([random.choice(string.ascii_letters + string.digits)
                         for _ in range(amount)])
 
-    def append_link(self, link, type_='image', index=None, list_=None):
+    def append_link(self, link, type_='image', index=None, list_=None, meta=None):
         """
         Append a link to the link lists and log info.
+        meta holds what's known about the link's post (site, owner, shortcode, posted_at),
+        it gets written to the catalog once the file is downloaded.
         """
+        link_meta = dict(self.current_meta or {})
+        link_meta.update(meta or {})
+        if index is not None and list_ is not None:
+            link_meta.setdefault('album_index', index)
+
+        # Resolving a source again, see renew_link
+        if self.captured is not None:
+            self.captured.append((link, type_, link_meta.get('album_index')))
+            return
+
         self.download_links.append(link)
-        self.tracking_links.append(self.download_links[-1])
+        self.tracking.add(link)
+        self.link_types[link] = type_
+        self.link_sources.setdefault(self.current_source, []).append(link)
+        self.link_source[link] = self.current_source
+        self.link_meta[link] = link_meta
+        self.link_status[link] = 'queued'
+        self.link_expiry[link] = signed.get_expiry(link)
+        tracer.add_link(link, self.current_source)
+
+        if self.streaming is True:
+            self.stream_link(len(self.download_links) - 1, link)
 
         if index is not None and list_ is not None:
             self.log_text.newline(f'Added {type_} of post #{index+1} / {len(list_)}:')
@@ -74,9 +171,68 @@ class Scraper:
         self.log_text.newline(f' -  {self.download_links[-1]}\n')
 
         self.download_tracking_label.configure(
-            text=f'Downloaded 0 / {len(self.download_links)} files'
+            text=f'Downloaded {self.finished_downloads} / {len(self.download_links)} files'
         )
 
+    def stream_link(self, index, link):
+        """
+        Queue a link to be downloaded in the background right away.
+        """
+        self.scheduler.add(index, link, self.link_types.get(link, 'image'),
+                           self.link_expiry.get(link))
+
+    def bump_source(self, source):
+        """
+        Download the files of an entered URL before all others.
+        """
+        for link in self.link_sources.get(source, []):
+            self.scheduler.bump(link)
+
+    def demote_source(self, source):
+        """
+        Download the files of an entered URL after all others.
+        """
+        for link in self.link_sources.get(source, []):
+            self.scheduler.demote(link)
+
+    def get_source_progress(self, source):
+        """
+        Get the status of an entered URL and the bytes received for its files so far.
+        The status is 'resolving' while its files are extracted, 'queued' until
+        the first of them starts downloading and 'done' (or 'failed') once all are finished.
+        It's 'empty' if no new files were extracted from it (none found or all known already).
+        """
+        if source == self.current_source:
+            return 'resolving', 0
+
+        links = self.link_sources.get(source, [])
+        statuses = {self.link_status.get(link) for link in links}
+        size = sum(self.link_bytes.get(link, 0) for link in links)
+
+        if not links:
+            return 'empty', size
+        if statuses == {'failed'}:
+            return 'failed', size
+        if statuses == {'cancelled'}:
+            return 'cancelled', size
+        if statuses == {'queued'}:
+            return 'queued', size
+        if statuses & {'queued', 'downloading'}:
+            return 'downloading', size
+        return ('failed' if 'failed' in statuses else 'done'), size
+
+    def pause_source(self, source):
+        for link in self.link_sources.get(source, []):
+            self.scheduler.pause(link)
+
+    def resume_source(self, source):
+        for link in self.link_sources.get(source, []):
+            self.scheduler.resume(link)
+
+    def cancel_source(self, source):
+        for link in self.link_sources.get(source, []):
+            self.scheduler.cancel(link)
+
     def get_imgur_data(self, soup):
         """
         Extract the JSON data from an Imgur post's HTML source code.
@@ -184,6 +340,16 @@ class Scraper:
 
         return user
 
+    def append_best_variant(self, candidates, type_='image', index=None, list_=None, meta=None):
+        """
+        Append only the best existing one of several renditions of the same file.
+        """
+        url = variants.resolve(candidates)
+        if url is None:
+            self.log_text.newline(f'No rendition of {candidates[-1]} exists - Skipping!')
+            return
+        self.append_link(url, type_=type_, index=index, list_=list_, meta=meta)
+
     def extract_ig_images(self, data):
         """
         Extract all image URLs from the HTML source code of an Instagram post.
@@ -198,33 +364,40 @@ class Scraper:
             return
 
         shortcode_media = data['graphql']['shortcode_media']
+        meta = {
+            'site': 'instagram',
+            'owner': self.get_ig_user(data)['username'],
+            'shortcode': shortcode_media['shortcode'],
+            'posted_at': shortcode_media.get('taken_at_timestamp'),
+        }
 
         # Album
         if 'edge_sidecar_to_children' in shortcode_media.keys():
             edges = shortcode_media['edge_sidecar_to_children']['edges']
 
             for index, edge in enumerate(edges):
-                self.append_link(edge['node']['display_url'],
-                                 type_='image', index=index, list_=edges)
+                self.append_best_variant(variants.instagram_candidates(edge['node']),
+                                         type_='image', index=index, list_=edges, meta=meta)
 
                 if 'video_url' in edge['node'].keys():
                     self.append_link(edge['node']['video_url'],
-                                     type_='video', index=index, list_=edges)
+                                     type_='video', index=index, list_=edges, meta=meta)
 
         # Single image/video
         else:
-            self.append_link(shortcode_media['display_url'], type_='image')
+            self.append_best_variant(variants.instagram_candidates(shortcode_media),
+                                     type_='image', meta=meta)
 
             if 'video_url' in shortcode_media.keys():
-                self.append_link(shortcode_media['video_url'], type_='video')
+                self.append_link(shortcode_media['video_url'], type_='video', meta=meta)
 
-    def extract_ig_avatar(self, soup):
+    def extract_ig_avatar(self, soup, owner=None):
         """
         Extract the image link pointing to an Instagram user's avatar
         (from the source code of instadp.com).
         """
         avatar_url = soup.find('img', {'class': 'picture'})['src']
-        self.append_link(avatar_url)
+        self.append_link(avatar_url, meta={'site': 'instagram', 'owner': owner})
 
     def extract_imgur_images(self, soup):
         """
@@ -238,30 +411,53 @@ class Scraper:
         if data is None:
             return
 
+        self.extract_imgur_data(data)
+
+    def extract_imgur_data(self, data):
+        """
+        Extract all images from the JSON data of an imgur post.
+        """
+        meta = {
+            'site': 'imgur',
+            'owner': data.get('account_url'),
+            'shortcode': data.get('hash'),
+            'posted_at': parse_timestamp(data['datetime']) if data.get('datetime') else None,
+        }
+
         if 'album_images' in data.keys():
             urls = [f'https://i.imgur.com/{image["hash"]}{image["ext"]}'
                     for image in data['album_images']['images']]
             for index, url in enumerate(urls):
-                self.append_link(url, type_='image', index=index, list_=urls)
+                self.append_link(url, type_='image', index=index, list_=urls, meta=meta)
         else:
             url = f'https://i.imgur.com/{data["hash"]}{data["ext"]}'
-            self.append_link(url)
+            self.append_link(url, meta=meta)
 
     def extract_yt_thumbnail(self, url):
         """
-        Construct a link for the maxresdefault thumbnail of a YouTube video.
+        Find the best existing thumbnail of a YouTube video.
         """
         # Second splits to get rid of additional arguments in the URL
         if 'watch?v=' in url:
             video_id = url.split('watch?v=')[1].split('?')[0]
         else:
             video_id = url.split('/')[-1].split('?')[0]
-        self.youtube_ids.append(video_id)
 
-        maxres_url = f'https://img.youtube.com/vi/{video_id}/maxresdefault.jpg'
-        hqdefault_url = f'https://img.youtube.com/vi/{video_id}/hqdefault.jpg'
-        self.append_link(maxres_url)
-        self.append_link(hqdefault_url)
+        self.append_best_variant(variants.youtube_candidates(video_id))
+
+    @staticmethod
+    def get_reddit_meta(data):
+        """
+        Get the catalog metadata of a Reddit post from its JSON data.
+        """
+        post = data[0]['data']['children'][0]['data']
+        return {
+            'site': 'reddit',
+            'owner': post.get('author'),
+            'community': post.get('subreddit'),
+            'shortcode': post.get('id'),
+            'posted_at': int(post['created_utc']) if post.get('created_utc') else None,
+        }
 
     @staticmethod
     def extract_reddit_link(data):
@@ -332,8 +528,8 @@ class Scraper:
         in the source code of the original Tumblr post.
         """
         container_src = container.find_next('iframe')['src']
-        res = requests.get(container_src)
-        soup = BeautifulSoup(res.text, features='html.parser')
+        res = proxies.get(container_src)
+        soup = bs4.BeautifulSoup(res.text, features='html.parser')
 
         video_source = soup.find('video').find_next('source')
         self.append_link(video_source['src'], type_='video')
@@ -344,7 +540,8 @@ class Scraper:
         """
         image_links = soup.find_all('meta', {'property': 'og:image'})
         for index, link in enumerate(image_links):
-            self.append_link(link['content'], index=index, list_=image_links)
+            self.append_best_variant(variants.twitter_candidates(link['content']),
+                                     index=index, list_=image_links)
 
     def get_download_method(self, url):
         """
@@ -354,6 +551,7 @@ class Scraper:
         # Special criteria for non-requests downloads
         criteria = {
             url.startswith('https://gfycat.com'): self.youtube_dl_download,
+            url.startswith('https://v.redd.it/'): self.reddit_dash_download,
         }
         for crit, method in criteria.items():
             if crit is True:
@@ -362,30 +560,138 @@ class Scraper:
         # Standard download method
         return self.requests_download
 
-    def requests_download(self, url):
+    def is_present(self, url):
+        """
+        Check if the file of a link was downloaded before, without sending a request.
+        """
+        dl_method = self.get_download_method(url)
+        # youtube_dl picks the file name itself
+        if dl_method == self.youtube_dl_download:
+            return False
+
+        file_dst = self.get_file_dst(url)
+        if storage.fsync_queue.exists(file_dst):
+            return True
+        return (dl_method == self.requests_download and self.archives is not None
+                and os.path.basename(file_dst) in self.archives)
+
+    def get_file_dst(self, url):
+        """
+        Get the path a file gets downloaded to.
+        """
+        if url.startswith('https://v.redd.it/'):
+            return os.path.join(self.dl_folder, f'{reddit_dash.get_video_id(url)}.mp4')
+        return os.path.join(self.dl_folder, self.prep_filename(url))
+
+    def requests_download(self, url, check=None, probed=None):
         """
         Download a file using the requests module.
+        A partial file left behind by a paused download gets continued.
+        Small files go into an archive instead, if enabled (see archive.py).
+        probed is the (size, accepts_ranges) found out while scheduling, if any.
         Return a bool on whether or not the file was downloaded.
         """
-        file_name = self.prep_filename(url)
-        file_dst = os.path.join(os.getcwd(), file_name)
+        file_dst = self.get_file_dst(url)
 
-        if os.path.exists(file_dst):
+        if storage.fsync_queue.exists(file_dst):
             return False
 
-        with open(file_dst, 'wb') as dl_file:
-            res = requests.get(url)
-            dl_file.write(res.content)
+        if self.archives is not None:
+            name = os.path.basename(file_dst)
+            if name in self.archives:
+                return False
+            # Known to be too large for an archive since scheduling, don't ask again
+            if probed is None or probed[0] <= config.archive_max_size:
+                data, probed = segmented.download_small(url, config.archive_max_size, check)
+                if data is not None:
+                    storage.ensure_free_space(self.dl_folder, len(data))
+                    path = self.archives.add(self.get_source(url), name, data, url)
+                    self.check_duplicate(path, data)
+                    return True
+            # Too large for an archive, it gets a file of its own
+
+        # Large files get split into byte ranges which are fetched in parallel
+        try:
+            if segmented.download_if_large(url, file_dst, check, probed):
+                self.check_duplicate(file_dst)
+                return True
+        except (segmented.SegmentError, requests.RequestException) as e:
+            self.log_text.newline(f'Segmented download failed ({e})'
+                                  ' - Retrying over a single connection')
+
+        segmented.download_resumable(url, file_dst, check)
+        self.check_duplicate(file_dst)
         return True
 
-    @staticmethod
-    def youtube_dl_download(url):
+    def check_duplicate(self, file_dst, data=None):
+        """
+        Queue a new file (or its content, for archived files) to be compared
+        against the already downloaded images.
+        """
+        if self.image_index is None:
+            return
+        if data is not None:
+            self.image_index.submit(file_dst, data)
+        else:
+            # With fsync_policy 'batch' the file may still wait for its name
+            storage.fsync_queue.when_finished(file_dst,
+                                              lambda: self.image_index.submit(file_dst))
+
+    def reddit_dash_download(self, url, check=None, probed=None):
+        """
+        Download a v.redd.it video including its audio using the DASH manifest.
+        Falls back to the (video-only) URL itself if the manifest is unusable.
+        Return a bool on whether or not the file was downloaded.
+        """
+        file_dst = self.get_file_dst(url)
+
+        if storage.fsync_queue.exists(file_dst):
+            return False
+
+        try:
+            reddit_dash.download_video(url, file_dst, self.log_text, check)
+        except (reddit_dash.DashError, segmented.SegmentError,
+                requests.RequestException) as e:
+            self.log_text.newline(f'DASH download failed ({e}) - Using fallback URL')
+            if os.path.exists(file_dst):
+                os.remove(file_dst)
+            reddit_dash.remove_partial(file_dst)
+            return self.requests_download(url, check)
+        return True
+
+    def youtube_dl_download(self, url, check=None, probed=None):
         """
         Download a file using the youtube_dl module.
+        youtube_dl continues its own partial files, check is called from its progress hook
+        with the bytes received since the last call.
         Return a bool on whether or not the file was downloaded.
         """
         try:
-            ydl_opts = {'logger': YDLLogger()}
+            ydl_opts = {
+                'logger': YDLLogger(),
+                'outtmpl': os.path.join(self.dl_folder, youtube_dl.utils.DEFAULT_OUTTMPL),
+                'continuedl': True,
+            }
+            if check is not None:
+                downloaded = 0
+
+                def progress_hook(status):
+                    nonlocal downloaded
+                    current = status.get('downloaded_bytes') or 0
+                    # Starts over at 0 for every file (e.g. separate video and audio)
+                    amount = current - downloaded if current >= downloaded else current
+                    downloaded = current
+                    check(amount)
+
+                ydl_opts['progress_hooks'] = [progress_hook]
+            # youtube_dl does its own requests, it only gets the proxy assigned to the host
+            proxy = proxies.pool.choose(url)
+            if proxy is not None:
+                ydl_opts['proxy'] = proxy.url
+            # youtube_dl does its own downloading, it can only be given the tighter limit
+            limits = [limit for limit in shaper.limits if limit is not None]
+            if limits:
+                ydl_opts['ratelimit'] = min(limits)
             with youtube_dl.YoutubeDL(ydl_opts) as ydl:
                 ydl.download([url])
             return True
@@ -396,30 +702,235 @@ class Scraper:
     def download_files(self):
         """
         Download all the collected files.
+        In streaming mode they are already being downloaded, so just wait for that to finish.
         """
         if not self.download_links:
             return
 
-        dl_folder = 'downloads'
-        if not os.path.exists(dl_folder) or not os.path.isdir(dl_folder):
-            os.mkdir(dl_folder)
-        os.chdir(dl_folder)
+        if self.streaming is False:
+            for index, url in enumerate(self.download_links):
+                self.stream_link(index, url)
+            self.check_free_space()
+        self.scheduler.join()
+        if self.archives is not None:
+            self.archives.close()
+        storage.fsync_queue.flush()
+        if self.catalog is not None:
+            self.catalog.flush()
+        tracer.flush()
+
+        # Report duplicates as part of this batch
+        if self.image_index is not None:
+            self.image_index.wait()
+
+    def check_free_space(self):
+        """
+        Warn up front if the queued files (as far as their sizes are known) won't fit.
+        Each file is checked again before it gets written, so none is left incomplete.
+        """
+        self.scheduler.wait_probed()
+        try:
+            storage.ensure_free_space(self.dl_folder, self.scheduler.get_queued_size())
+        except storage.DiskSpaceError as e:
+            self.log_text.newline(f'{e} - Files which do not fit will be skipped')
+
+    def estimate_size(self, url):
+        """
+        Get the size of a file and whether it can be fetched in byte ranges
+        from a HEAD request, for scheduling (and downloading, see DownloadJob.probed).
+        Return (None, None) for files which are not downloaded as a whole (DASH, youtube_dl).
+        """
+        if self.get_download_method(url) != self.requests_download:
+            return None, None
+
+        size, accepts_ranges = segmented.probe(url)
+        return size or None, accepts_ranges
 
-        for index, url in enumerate(self.download_links):
-            dl_method = self.get_download_method(url)
-            is_file_new = dl_method(url)
+    def download_job(self, job):
+        """
+        Download a file handed out by the scheduler.
+        A failed download still counts as finished to not stall the batch.
+        Signed links which expired get renewed once, see renew_link.
+        """
+        def check(amount=0):
+            self.report_progress(job, amount)
 
-            if is_file_new is True:
-                self.log_text.newline(f'Downloaded file {index+1}'
-                                      f' / {len(self.download_links)}')
+        try:
+            try:
+                self.download_link(job.index, job.url, check, job.probed)
+            except signed.LinkExpired as e:
+                self.log_text.newline(f'{e} - Resolving it again')
+                job.url = self.renew_link(job)
+                self.download_link(job.index, job.url, check, job.probed)
+        except DownloadInterrupted:
+            # The scheduler takes care of paused and cancelled files
+            self.link_status[job.url] = 'queued'
+            raise
+        except Exception as e:
+            self.log_text.newline(f'Download of file {job.index+1} failed: {e!r}')
+            with self.lock:
+                self.link_status[job.url] = 'failed'
+                self.finished_downloads += 1
+
+    def report_progress(self, job, amount):
+        """
+        Count the bytes a download received, then let the scheduler interrupt it if needed.
+        Called from every thread the file gets downloaded with.
+        """
+        with self.lock:
+            self.link_bytes[job.url] = self.link_bytes.get(job.url, 0) + amount
+        self.scheduler.check(job)
+
+    def discard_job(self, job):
+        """
+        Delete the partial files of a cancelled download and count it as finished.
+        """
+        file_dst = self.get_file_dst(job.url)
+        # DASH videos also leave their separately downloaded streams behind
+        if self.get_download_method(job.url) == self.reddit_dash_download:
+            reddit_dash.remove_partial(file_dst)
+        else:
+            segmented.remove_partial(file_dst)
+        self.log_text.newline(f'Cancelled file {job.index+1} / {len(self.download_links)}')
+        with self.lock:
+            self.link_status[job.url] = 'cancelled'
+            self.link_bytes.pop(job.url, None)
+            self.finished_downloads += 1
+
+    def download_link(self, index, url, check=None, probed=None):
+        """
+        Download a single collected file and log the result.
+        check gets called while downloading and raises once the download should stop.
+        probed is the (size, accepts_ranges) found out while scheduling, if any.
+        """
+        os.makedirs(self.dl_folder, exist_ok=True)
+        self.link_status[url] = 'downloading'
+
+        dl_method = self.get_download_method(url)
+        with tracer.span('download', link=url, url=url, method=dl_method.__name__) as args:
+            # Files downloaded before don't need a working link
+            if self.is_present(url):
+                is_file_new = False
+            # Don't waste a request on a link which can't work anymore
+            elif signed.is_expired(self.link_expiry.get(url)):
+                raise signed.LinkExpired(f'Link of file {index+1} expired')
             else:
-                self.log_text.newline(f'File {index+1} / {len(self.download_links)}'
-                                      ' already present, skipping')
+                try:
+                    is_file_new = dl_method(url, check, probed)
+                except requests.HTTPError as e:
+                    status = e.response.status_code if e.response is not None else None
+                    if status not in signed.EXPIRED_STATUSES:
+                        raise
+                    raise signed.LinkExpired(f'Link of file {index+1}'
+                                             f' got refused ({status})') from e
+            args.update(bytes=self.link_bytes.get(url, 0), new=is_file_new)
+
+        if is_file_new is True:
+            self.log_text.newline(f'Downloaded file {index+1}'
+                                  f' / {len(self.download_links)}')
+            self.record_download(url)
+        else:
+            self.log_text.newline(f'File {index+1} / {len(self.download_links)}'
+                                  ' already present, skipping')
 
+        with self.lock:
+            self.link_status[url] = 'done'
             self.last_download = url
-            time.sleep(0.5)
+            self.finished_downloads += 1
+
+    def renew_link(self, job):
+        """
+        Replace a link which expired (or got refused) with the fresh version of it
+        which its source resolves to now, and move everything known about it over.
+        Return the fresh link, raise LinkExpired if there is none.
+        """
+        link = job.url
+        source = self.get_source(link)
+        if self.resolve_again is None or source is None:
+            raise signed.LinkExpired(f'Link of file {job.index+1} cannot be resolved again')
+
+        candidates = self.get_renewed_links(source)
+        album_index = self.link_meta.get(link, {}).get('album_index')
+        fresh_link = signed.find_renewed(link, self.link_types.get(link), album_index, candidates)
+        if fresh_link is None or fresh_link == link:
+            raise signed.LinkExpired(f'No fresh link for file {job.index+1} found')
+
+        with self.lock:
+            self.download_links[job.index] = fresh_link
+            self.link_sources[source] = [fresh_link if other == link else other
+                                         for other in self.link_sources[source]]
+            for mapping in (self.link_types, self.link_source, self.link_meta, self.link_status,
+                            self.link_bytes):
+                if link in mapping:
+                    mapping[fresh_link] = mapping.pop(link)
+            self.link_expiry.pop(link, None)
+            self.link_expiry[fresh_link] = signed.get_expiry(fresh_link)
+        self.tracking.add(fresh_link)
+        return fresh_link
+
+    def get_renewed_links(self, source):
+        """
+        Resolve a source again (see resolve_again), only once per batch: when its links
+        expire, they usually all do, the other ones get renewed from the same result.
+        """
+        with self.renew_lock:
+            if source not in self.renewed_links:
+                self.renewed_links[source] = self.resolve_again(source)
+            return self.renewed_links[source]
+
+    def close(self):
+        """
+        Stop the download threads, for scrapers living shorter than the program
+        (e.g. one per service job). Returns once they are gone.
+        """
+        self.scheduler.stop(wait=True)
+        if self.archives is not None:
+            self.archives.close()
+
+    def get_source(self, url):
+        """
+        Get the URL entered by the user which a link was extracted from.
+        """
+        return self.link_source.get(url)
+
+    def record_download(self, url):
+        """
+        Queue a downloaded file and the metadata of its post for the catalog.
+        """
+        if self.catalog is None:
+            return
 
-        os.chdir('..')
+        path = None
+        if self.archives is not None and url in self.archives.paths:
+            path = self.archives.paths[url]
+        # youtube_dl picks the file name itself
+        elif self.get_download_method(url) != self.youtube_dl_download:
+            path = self.get_file_dst(url)
+
+        self.catalog.add(url=url, path=path, source=self.get_source(url),
+                         type=self.link_types.get(url), **self.link_meta.get(url, {}))
+
+    def reset_batch(self):
+        """
+        Forget the links of the current batch once all of them are downloaded.
+        """
+        self.download_links = []
+        self.display_links = []
+        self.finished_downloads = 0
+        self.link_types = {}
+        self.link_sources = {}
+        self.link_source = {}
+        self.link_meta = {}
+        self.link_status = {}
+        self.link_bytes = {}
+        self.link_expiry = {}
+        self.renewed_links = {}
+        self.scheduler.priorities.clear()
+        if self.archives is not None:
+            self.archives.close()
+        storage.fsync_queue.flush()
+        if self.catalog is not None:
+            self.catalog.flush()
 
     def prep_filename(self, url):
         """
@@ -427,29 +938,22 @@ class Scraper:
         by using the link/URL.
         """
         ig_name_re = re.compile(r'.+\.(?:jpg|png|gif|mp4)')
-        twimg_re = re.compile(r'https://pbs\.twimg\.com/media/(.+\.(?:png|jpg)):large')
+        twimg_re = re.compile(r'(.+\.(?:png|jpg)):(?:orig|large)$')
+        yt_thumbnail_re = re.compile(r'https://img\.youtube\.com/vi/(.+)/(\w+)\.jpg')
         file_name = url.split('/')[-1]
 
         # Strip ?-arguments from IG file names
         if ig_name_re.match(file_name):
             file_name = ig_name_re.match(file_name).group(0)
 
-        # Strip 'large' suffix from Twitter file names
+        # Strip 'orig'/'large' suffix from Twitter file names
         if twimg_re.match(file_name):
             file_name = twimg_re.match(file_name).group(1)
 
         # Need to avoid same file names for YouTube thumbnails
-        if file_name == 'maxresdefault.jpg':
-            video_id = self.youtube_ids[0]
-            file_name = f'maxresdefault_{video_id}.jpg'
-
-        # More YouTube thumbnails
-        if file_name == 'hqdefault.jpg':
-            # maxresdefault equivalents get downloaded immediately before hqdefaults
-            # due to them being added one after another
-            # so we can remove the video ID from the list
-            video_id = self.youtube_ids.pop(0)
-            file_name = f'hqdefault_{video_id}.jpg'
+        if yt_thumbnail_re.match(url):
+            video_id, resolution = yt_thumbnail_re.match(url).groups()
+            file_name = f'{resolution}_{video_id}.jpg'
 
         # Reddit videos contain this argument but no file extension
         if file_name.endswith('?source=fallback'):
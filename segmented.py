@@ -0,0 +1,271 @@
+# BUILTIN
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+# CUSTOM
+import proxies
+import storage
+from bandwidth import shaper
+from lazy import lazy_import
+from scheduler import DownloadInterrupted
+from settings import config
+from tracing import tracer
+# PIP (imported on first use, see lazy.py)
+requests = lazy_import('requests')
+
+
+class SegmentError(Exception):
+    pass
+
+
+def probe(url):
+    """
+    Ask the server for a file's size and whether it accepts byte ranges.
+    Return a tuple of (size, accepts_ranges), size being 0 if unknown.
+    """
+    res = proxies.head(url, headers=config.headers,
+                        timeout=config.segmented_timeout, allow_redirects=True)
+    if res.status_code != 200:
+        return 0, False
+
+    size = int(res.headers.get('Content-Length', 0))
+    accepts_ranges = res.headers.get('Accept-Ranges', '').lower() == 'bytes'
+    return size, accepts_ranges
+
+
+def is_worth_splitting(size, accepts_ranges):
+    """
+    Check whether a file should be downloaded over multiple connections.
+    """
+    return accepts_ranges and size >= config.segmented_threshold
+
+
+def get_ranges(size, connections):
+    """
+    Split a file of the given size into (start, end) byte ranges, end being inclusive.
+    """
+    chunk = -(-size // connections)  # Round up
+    return [(start, min(start + chunk, size) - 1) for start in range(0, size, chunk)]
+
+
+def fetch_range(url, file_path, byte_range, check=None, on_write=None):
+    """
+    Stream a byte range of a file into its place in the preallocated file.
+    check gets called with the size of every chunk before it's written
+    and may raise to interrupt the download, on_write gets called with the size of every written chunk.
+    Return the amount of bytes written.
+    """
+    start, end = byte_range
+    headers = dict(config.headers)
+    headers['Range'] = f'bytes={start}-{end}'
+
+    with tracer.span('fetch_range', url=url, range=headers['Range']) as args, \
+            proxies.get(url, headers=headers, stream=True,
+                        timeout=config.segmented_timeout) as res:
+        # 200 would mean the whole file is coming, which would end up at the wrong offset
+        if res.status_code != 206:
+            raise SegmentError(f'Unexpected response code ({res.status_code})'
+                               f' for range {start}-{end}')
+
+        written = 0
+        with storage.open_part(file_path, 'r+b') as dl_file:
+            dl_file.seek(start)
+            for chunk in res.iter_content(chunk_size=config.download_chunk_size):
+                # Never write past the end of the range, even if the server sends more
+                chunk = chunk[:end - start + 1 - written]
+                if check is not None:
+                    check(len(chunk))
+                shaper.throttle(url, len(chunk))
+                dl_file.write(chunk)
+                written += len(chunk)
+                if on_write is not None:
+                    on_write(len(chunk))
+        args['bytes'] = written
+
+    return written
+
+
+def load_progress(part_file, size, ranges):
+    """
+    Get the bytes already written per range by an interrupted download,
+    or None if there is nothing (matching) to resume.
+    """
+    progress_file = f'{part_file}.ranges'
+    if not os.path.exists(part_file) or not os.path.exists(progress_file):
+        return None
+    if os.path.getsize(part_file) != size:
+        return None
+
+    with open(progress_file, encoding='utf-8') as progress:
+        done = json.load(progress)
+    if len(done) != len(ranges):
+        return None
+    return done
+
+
+def save_progress(part_file, done):
+    with open(f'{part_file}.ranges', 'w', encoding='utf-8') as progress:
+        json.dump(done, progress)
+
+
+def remove_partial(file_dst):
+    """
+    Delete what an interrupted download of file_dst left behind.
+    """
+    for path in (f'{file_dst}.part', f'{file_dst}.part.ranges'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def download(url, file_dst, size, check=None, connections=None):
+    """
+    Download a file of a known size over multiple connections
+    (config.segmented_connections unless given).
+    The file only gets moved to file_dst once every byte has arrived,
+    so an interrupted download never looks like a finished one.
+    If check raises DownloadInterrupted (the download got paused), the bytes written so far
+    are recorded next to the partial file and the next call continues from there.
+    On any other error the partial file gets deleted.
+    """
+    part_file = f'{file_dst}.part'
+    ranges = get_ranges(size, connections or config.segmented_connections)
+    done = load_progress(part_file, size, ranges)
+
+    def fetch(slot):
+        start, end = ranges[slot]
+        if start + done[slot] > end:
+            return
+
+        def on_write(amount):
+            done[slot] += amount
+
+        fetch_range(url, part_file, (start + done[slot], end), check, on_write)
+
+    try:
+        if done is None:
+            storage.ensure_free_space(os.path.dirname(part_file), size)
+            done = [0] * len(ranges)
+            with open(part_file, 'wb') as dl_file:
+                storage.preallocate(dl_file, size)
+
+        with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix='segment') as executor:
+            list(executor.map(fetch, range(len(ranges))))
+
+        for (start, end), amount in zip(ranges, done):
+            if amount != end - start + 1:
+                raise SegmentError(f'Range {start}-{end} is incomplete'
+                                   f' ({amount} / {end - start + 1} bytes)')
+        storage.fsync_queue.finish(part_file, file_dst)
+    except DownloadInterrupted:
+        # Interrupted on purpose, keep the partial file to resume later
+        save_progress(part_file, done)
+        raise
+    except Exception:
+        remove_partial(file_dst)
+        raise
+
+    # The partial file itself may still wait for its name, see storage.FsyncQueue
+    if os.path.exists(f'{part_file}.ranges'):
+        os.remove(f'{part_file}.ranges')
+
+
+def download_resumable(url, file_dst, check=None):
+    """
+    Download a file over a single connection into a partial file,
+    continuing from the end of an earlier partial file if the server supports it.
+    The file only gets moved to file_dst once it is complete.
+    The file gets preallocated, so an interrupted download truncates it back
+    to what was written (a killed process leaves it at full size, which makes
+    the next attempt start over as the range can't be satisfied).
+    """
+    part_file = f'{file_dst}.part'
+    # Left behind by a segmented download, its bytes are not contiguous
+    if os.path.exists(f'{part_file}.ranges'):
+        remove_partial(file_dst)
+
+    offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+    headers = dict(config.headers)
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+
+    with proxies.get(url, headers=headers, stream=True,
+                      timeout=config.segmented_timeout) as res:
+        # The range is not satisfiable anymore (e.g. the file changed), start over
+        if res.status_code == 416:
+            remove_partial(file_dst)
+            return download_resumable(url, file_dst, check)
+        res.raise_for_status()
+
+        # 200 instead of 206 means the server ignored the range and sends the whole file
+        if res.status_code != 206:
+            offset = 0
+        expected = res.headers.get('Content-Length')
+        expected = offset + int(expected) if expected is not None else None
+        if expected is not None:
+            storage.ensure_free_space(os.path.dirname(part_file), expected - offset)
+
+        with storage.open_part(part_file, 'r+b' if offset else 'wb') as dl_file:
+            if expected is not None:
+                storage.preallocate(dl_file, expected)
+            dl_file.seek(offset)
+            try:
+                for chunk in res.iter_content(chunk_size=config.download_chunk_size):
+                    if check is not None:
+                        check(len(chunk))
+                    shaper.throttle(url, len(chunk))
+                    dl_file.write(chunk)
+            finally:
+                written = dl_file.tell()
+                # Drop the preallocated rest, the file size marks where to resume
+                dl_file.truncate(written)
+
+    if expected is not None and written != expected:
+        raise SegmentError(f'Download is incomplete ({written} / {expected} bytes)')
+    storage.fsync_queue.finish(part_file, file_dst)
+
+
+def download_small(url, max_size, check=None):
+    """
+    Download a file into memory, for files which get written somewhere else
+    than a file of their own (see archive.py).
+    Return a tuple of (data, probed), probed being what probe() would have returned,
+    taken from the response's headers (None if they don't tell the size).
+    data is None (and the body isn't read, if the server tells the size) if the file
+    turns out larger than max_size, probed saves download_if_large from asking again then.
+    """
+    with proxies.get(url, headers=config.headers, stream=True,
+                     timeout=config.segmented_timeout) as res:
+        res.raise_for_status()
+        expected = res.headers.get('Content-Length')
+        accepts_ranges = res.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        probed = (int(expected), accepts_ranges) if expected is not None else None
+        if expected is not None and int(expected) > max_size:
+            return None, probed
+
+        data = bytearray()
+        for chunk in res.iter_content(chunk_size=config.download_chunk_size):
+            if len(data) + len(chunk) > max_size:
+                return None, probed
+            if check is not None:
+                check(len(chunk))
+            shaper.throttle(url, len(chunk))
+            data += chunk
+
+    if expected is not None and len(data) != int(expected):
+        raise SegmentError(f'Download is incomplete ({len(data)} / {expected} bytes)')
+    return bytes(data), probed
+
+
+def download_if_large(url, file_dst, check=None, probed=None):
+    """
+    Download a file over multiple connections if it is large enough
+    and the server supports it. probed is what probe() returned for the file already,
+    if it was probed before (e.g. for scheduling).
+    Return a bool on whether or not the segmented download was used.
+    """
+    size, accepts_ranges = probed if probed is not None else probe(url)
+    if not is_worth_splitting(size, accepts_ranges):
+        return False
+
+    download(url, file_dst, size, check)
+    return True
@@ -0,0 +1,344 @@
+# BUILTIN
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+# CUSTOM
+import proxies
+from bandwidth import shaper
+from catalog import Catalog
+from dedup import ImageIndex
+from dispatch import Dispatcher
+from driver import DriverPool
+from scraping import Scraper
+from settings import config
+from tracking import LinkTracker
+
+
+class ConsoleLog:
+    """
+    Stand-in for all widgets the Dispatcher and Scraper report to,
+    printing log lines to stdout and ignoring everything else.
+    """
+    __slots__ = ()
+
+    @staticmethod
+    def newline(string):
+        if string.strip():
+            print(f'[{time.strftime("%H:%M:%S")}] {string.strip()}', flush=True)
+
+    def configure(self, **kwargs):
+        pass
+
+    def add_row(self, url):
+        pass
+
+    def clear_text(self):
+        pass
+
+
+class JobLog:
+    """
+    Stand-in for all widgets the Dispatcher and Scraper report to.
+    Everything gets recorded as an event of the job instead.
+    """
+    __slots__ = ('job',)
+
+    def __init__(self, job):
+        self.job = job
+
+    def newline(self, string):
+        if string.strip():
+            self.job.add_event('log', message=string.strip())
+
+    def configure(self, **kwargs):
+        if 'text' in kwargs:
+            self.job.add_event('status', message=kwargs['text'])
+
+    def add_row(self, url):
+        pass
+
+    def clear_text(self):
+        pass
+
+
+class Job:
+    """
+    A batch of URLs submitted through the API, processed and downloaded as one.
+    """
+    __slots__ = ('id', 'urls', 'status', 'events', 'condition', 'created')
+
+    finished_states = ('done', 'failed')
+
+    def __init__(self, id_, urls):
+        self.id = id_
+        self.urls = urls
+        self.status = 'queued'
+        self.events = []
+        self.condition = threading.Condition()
+        self.created = time.time()
+
+    @property
+    def is_finished(self):
+        return self.status in self.finished_states
+
+    def add_event(self, type_, **data):
+        """
+        Record an event and wake up everyone streaming this job's events.
+        """
+        with self.condition:
+            self.events.append({'type': type_, 'time': time.time(), **data})
+            self.condition.notify_all()
+
+    def set_status(self, status, **data):
+        self.status = status
+        self.add_event('job', status=status, **data)
+
+    def iter_events(self):
+        """
+        Yield all events of the job, blocking for new ones until the job is finished.
+        """
+        index = 0
+        while True:
+            with self.condition:
+                while index >= len(self.events) and not self.is_finished:
+                    self.condition.wait()
+                new_events = self.events[index:]
+                is_finished = self.is_finished
+
+            yield from new_events
+            index += len(new_events)
+            if is_finished and index >= len(self.events):
+                return
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'urls': self.urls,
+            'status': self.status,
+            'created': self.created,
+            'events': len(self.events),
+        }
+
+
+class Service:
+    """
+    Process jobs from several clients in one process,
+    sharing a pool of warm webdrivers and the link tracker between them.
+    """
+    __slots__ = (
+        'log_text', 'pool', 'tracking', 'image_index', 'catalog', 'jobs', 'job_ids', 'executor',
+    )
+
+    def __init__(self, pool_size):
+        self.log_text = ConsoleLog()
+        self.pool = DriverPool(self.log_text, pool_size)
+        self.tracking = LinkTracker(config.tracking_capacity, config.tracking_error_rate)
+        self.image_index = None
+        if config.dedup_images is True and ImageIndex.is_available():
+            self.image_index = ImageIndex(self.log_text, os.path.abspath('downloads'))
+        self.catalog = None
+        if config.catalog_path is not None:
+            self.catalog = Catalog(config.catalog_path)
+
+        self.jobs = {}
+        self.job_ids = itertools.count(1)
+        # Jobs beyond the pool size wait here instead of blocking in acquire()
+        self.executor = ThreadPoolExecutor(max_workers=pool_size)
+
+    def start(self):
+        self.pool.start(config.service_ig_username, config.service_ig_password)
+
+    def stop(self):
+        self.executor.shutdown(wait=False)
+        self.pool.stop()
+        if self.catalog is not None:
+            self.catalog.close()
+
+    def submit(self, urls):
+        """
+        Queue a new job for the given URLs.
+        """
+        job = Job(str(next(self.job_ids)), urls)
+        self.jobs[job.id] = job
+        job.add_event('job', status=job.status)
+        self.executor.submit(self.run_job, job)
+        return job
+
+    def run_job(self, job):
+        """
+        Resolve all URLs of a job using a pooled driver, then download the files.
+        """
+        log = JobLog(job)
+        scraper = Scraper(log, log, tracking=self.tracking, image_index=self.image_index,
+                          catalog=self.catalog)
+
+        try:
+            job.set_status('resolving')
+            with self.pool.acquire() as driver:
+                dispatcher = Dispatcher(scraper, driver, log, log, log)
+                for url in job.urls:
+                    is_accepted = dispatcher.check_url(text=url)
+                    job.add_event('url', url=url, accepted=is_accepted)
+                    # Sleep to not spam APIs
+                    time.sleep(0.5)
+
+            def resolve_again(source):
+                # The job's driver went back to the pool, expired links borrow one again
+                with self.pool.acquire() as driver:
+                    dispatcher.driver = driver
+                    return dispatcher.resolve_again(source)
+
+            scraper.resolve_again = resolve_again
+            job.set_status('downloading', files=len(scraper.download_links))
+            scraper.download_files()
+            job.set_status('done', files=len(scraper.download_links))
+        except Exception as e:
+            self.log_text.newline(f'Job {job.id} failed: {e!r}')
+            job.set_status('failed', error=repr(e))
+        finally:
+            scraper.close()
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Local JSON API:
+        POST /jobs               {"urls": [...]} -> job
+        GET  /jobs               -> list of jobs
+        GET  /jobs/<id>          -> job
+        GET  /jobs/<id>/events   -> newline-delimited JSON events, streamed until the job finishes
+        GET  /bandwidth          -> current download speed limits
+        PUT  /bandwidth          -> {"limit": 1048576, "host_limit": null} (bytes per second),
+                                    {"limit": "schedule"} to follow the config's time windows again
+    """
+    server_version = 'IGDownloader'
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def get_job(self, job_id):
+        job = self.service.jobs.get(job_id)
+        if job is None:
+            self.send_json({'error': f'No job with ID {job_id}'}, status=404)
+        return job
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            self.send_json({'error': 'Not found'}, status=404)
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            urls = json.loads(self.rfile.read(length))['urls']
+            if isinstance(urls, str):
+                urls = urls.split()
+            if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+                raise ValueError('"urls" must be a list of strings')
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json({'error': f'Invalid request body: {e}'}, status=400)
+            return
+
+        job = self.service.submit(urls)
+        self.send_json(job.as_dict(), status=202)
+
+    def do_PUT(self):
+        if self.path.rstrip('/') != '/bandwidth':
+            self.send_json({'error': 'Not found'}, status=404)
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            limits = json.loads(self.rfile.read(length))
+            if limits.get('limit') == 'schedule':
+                shaper.reset_limits()
+            else:
+                limit, host_limit = limits.get('limit'), limits.get('host_limit')
+                for value in (limit, host_limit):
+                    if value is not None and (not isinstance(value, int) or value <= 0):
+                        raise ValueError('Limits must be positive integers or null')
+                shaper.set_limits(limit, host_limit)
+        except (ValueError, AttributeError) as e:
+            self.send_json({'error': f'Invalid request body: {e}'}, status=400)
+            return
+
+        self.send_json(shaper.as_dict())
+
+    def do_GET(self):
+        parts = [part for part in self.path.split('?')[0].split('/') if part]
+
+        if parts == ['bandwidth']:
+            self.send_json(shaper.as_dict())
+
+        elif parts == ['proxies']:
+            self.send_json(proxies.pool.as_dict())
+
+        elif parts == ['jobs']:
+            self.send_json([job.as_dict() for job in self.service.jobs.values()])
+
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            job = self.get_job(parts[1])
+            if job is not None:
+                self.send_json(job.as_dict())
+
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'events':
+            job = self.get_job(parts[1])
+            if job is not None:
+                self.stream_events(job)
+
+        else:
+            self.send_json({'error': 'Not found'}, status=404)
+
+    def stream_events(self, job):
+        """
+        Send the job's events as they happen, one JSON object per line.
+        The response has no length, it ends when the connection gets closed.
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+
+        try:
+            for event in job.iter_events():
+                self.wfile.write(json.dumps(event).encode('utf-8') + b'\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format_, *args):
+        self.server.service.log_text.newline(f'{self.address_string()} - {format_ % args}')
+
+
+def serve(host=None, port=None, pool_size=None):
+    """
+    Start the drivers and serve the API until interrupted.
+    """
+    host = host or config.service_host
+    port = port or config.service_port
+
+    service = Service(pool_size or config.service_pool_size)
+    service.start()
+
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    service.log_text.newline(f'Serving on http://{host}:{port}')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
@@ -0,0 +1,33 @@
+# BUILTIN
+import types
+# CUSTOM
+import config
+import config_example
+
+# Settings which got renamed: old name -> (new name, conversion of the old value)
+RENAMED = {
+    # Was a ChromeOptions object built in config.py (which imported selenium at startup)
+    'chromedriver_options': ('chromedriver_arguments', lambda options: list(options.arguments)),
+}
+
+
+def fill_defaults(module, defaults):
+    """
+    Give a config.py which was copied from an older config_example.py
+    the settings added since, with their default values,
+    and carry the values of renamed settings over to their new names.
+    """
+    for old_name, (new_name, convert) in RENAMED.items():
+        if hasattr(module, old_name) and not hasattr(module, new_name):
+            setattr(module, new_name, convert(getattr(module, old_name)))
+
+    for name, value in vars(defaults).items():
+        if name.startswith('_') or isinstance(value, types.ModuleType):
+            continue
+        if not hasattr(module, name):
+            setattr(module, name, value)
+
+
+# Everything reads the settings through this module (from settings import config),
+# so they are complete before the first one is looked up
+fill_defaults(config, config_example)
@@ -0,0 +1,83 @@
+# BUILTIN
+import calendar
+import time
+from urllib.parse import parse_qs, urlsplit
+# CUSTOM
+from settings import config
+
+# Responses to a link which may just have expired
+EXPIRED_STATUSES = (403, 410)
+
+
+class LinkExpired(Exception):
+    """
+    Raised for a link whose signature expired (or got refused), before or while downloading it.
+    """
+    pass
+
+
+def get_expiry(url):
+    """
+    Get the time (as a Unix timestamp) a signed CDN link expires at, None if it isn't known:
+        oe=5D8E1F2A                        -> Instagram's (and Facebook's) CDN, hexadecimal
+        Expires=1561000000, exp=...        -> CloudFront, Akamai and most others
+        X-Amz-Date=...&X-Amz-Expires=3600  -> S3 presigned links, seconds after signing
+    """
+    query = parse_qs(urlsplit(url).query)
+
+    def get(key):
+        return query.get(key, [None])[0]
+
+    try:
+        if get('oe') is not None:
+            return int(get('oe'), 16)
+        for key in ('Expires', 'expires', 'exp'):
+            if get(key) is not None:
+                return int(get(key))
+        if get('X-Amz-Date') is not None and get('X-Amz-Expires') is not None:
+            signed_at = calendar.timegm(time.strptime(get('X-Amz-Date'), '%Y%m%dT%H%M%SZ'))
+            return signed_at + int(get('X-Amz-Expires'))
+    except ValueError:
+        pass
+    return None
+
+
+def is_expired(expires, now=None):
+    """
+    Check whether a link expiring at the given time can't be downloaded anymore,
+    allowing config.expiry_margin seconds for the download itself and clock skew.
+    """
+    if expires is None:
+        return False
+    return expires - config.expiry_margin <= (now or time.time())
+
+
+def is_urgent(expires, now=None):
+    """
+    Check whether a link expires within config.expiry_urgent_time seconds.
+    """
+    if expires is None:
+        return False
+    return expires - config.expiry_urgent_time <= (now or time.time())
+
+
+def get_file_name(url):
+    return urlsplit(url).path.rsplit('/', 1)[-1]
+
+
+def find_renewed(link, type_, album_index, candidates):
+    """
+    Pick the fresh version of an expired link out of the links its source resolves to now,
+    given as (link, type, album index) tuples. Signatures change, but the file name
+    usually doesn't; otherwise the position in the album has to do.
+    Return None if there is no match.
+    """
+    for candidate, _, _ in candidates:
+        if get_file_name(candidate) == get_file_name(link):
+            return candidate
+
+    matches = [candidate for candidate, candidate_type, candidate_index in candidates
+               if candidate_type == type_ and candidate_index == album_index]
+    if len(matches) == 1:
+        return matches[0]
+    return None
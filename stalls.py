@@ -0,0 +1,107 @@
+# BUILTIN
+import sys
+import threading
+import time
+import traceback
+# CUSTOM
+from settings import config
+from tracing import tracer
+
+# Samples taken per stall at most, a long stall mostly repeats itself
+MAX_SAMPLES = 20
+
+
+class Watchdog:
+    """
+    Detect stalls of tkinter's event loop, i.e. times in which the window doesn't respond.
+    A heartbeat gets scheduled with root.after every config.watchdog_interval seconds.
+    While it's overdue by more than config.watchdog_threshold, a separate thread samples
+    the stacks of all threads (showing what the main thread is stuck in, and what
+    the others are doing meanwhile). Once the heartbeat runs again, the stall gets
+    appended to the report at config.watchdog_report_path with its samples.
+    """
+    __slots__ = ('root', 'log_text', 'path', 'expected', 'samples', 'stalls', 'lock', 'stopped')
+
+    def __init__(self, root, log_text, path=None):
+        self.root = root
+        self.log_text = log_text
+        self.path = path or config.watchdog_report_path
+        self.expected = None  # When the next heartbeat is due (perf_counter)
+        self.samples = []  # Of the stall going on, as (seconds overdue, text)
+        self.stalls = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.expected = time.perf_counter() + config.watchdog_interval
+        self.root.after(int(config.watchdog_interval * 1000), self.beat)
+        threading.Thread(target=self.monitor, name='watchdog', daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def beat(self):
+        """
+        Measure how late the heartbeat is, then schedule the next one.
+        Runs in tkinter's main loop.
+        """
+        if self.stopped.is_set():
+            return
+
+        now = time.perf_counter()
+        lateness = now - self.expected
+        with self.lock:
+            samples, self.samples = self.samples, []
+            self.expected = now + config.watchdog_interval
+
+        if lateness >= config.watchdog_threshold:
+            self.record(now - lateness, lateness, samples)
+        self.root.after(int(config.watchdog_interval * 1000), self.beat)
+
+    def monitor(self):
+        """
+        Sample all stacks while the heartbeat is overdue, runs in its own thread.
+        """
+        while not self.stopped.wait(config.watchdog_sample_interval):
+            with self.lock:
+                overdue = time.perf_counter() - self.expected
+                if overdue < config.watchdog_threshold or len(self.samples) >= MAX_SAMPLES:
+                    continue
+                self.samples.append((overdue, self.get_stacks()))
+
+    @staticmethod
+    def get_stacks():
+        """
+        Format the current stack of every other thread, the main thread first.
+        """
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        main_id = threading.main_thread().ident
+        frames = sorted(sys._current_frames().items(), key=lambda item: item[0] != main_id)
+
+        lines = []
+        for thread_id, frame in frames:
+            # The sampling thread itself
+            if thread_id == threading.get_ident():
+                continue
+            lines.append(f'Thread {names.get(thread_id, thread_id)}:')
+            lines.extend(line.rstrip('\n') for line in traceback.format_stack(frame))
+        return '\n'.join(lines)
+
+    def record(self, start, lateness, samples):
+        """
+        Append a stall to the report and mention it in the log.
+        """
+        self.stalls += 1
+        if tracer.enabled:
+            tracer.add_event({'name': 'event_loop_stall', 'cat': 'watchdog', 'ph': 'X',
+                              'ts': start * 1e6, 'dur': lateness * 1e6})
+
+        lines = [f'=== {time.strftime("%Y-%m-%d %H:%M:%S")} - Event loop stalled'
+                 f' for {lateness:.2f}s ({len(samples)} samples)']
+        for overdue, stacks in samples:
+            lines.append(f'--- After {overdue:.2f}s')
+            lines.append(stacks)
+        with open(self.path, 'a', encoding='utf-8') as report:
+            report.write('\n'.join(lines) + '\n\n')
+
+        self.log_text.newline(f'Window did not respond for {lateness:.1f}s - See {self.path}')
@@ -0,0 +1,85 @@
+# BUILTIN
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# Our own modules plus the third-party ones which are (meant to be) imported lazily
+MODULES = (
+    'gui', 'dispatch', 'driver', 'scraping', 'config', 'settings',
+    'requests', 'bs4', 'youtube_dl', 'selenium.webdriver', 'PIL',
+)
+
+
+def import_times(entry_module='gui'):
+    """
+    Import the entry module in a fresh interpreter using -X importtime
+    and get the cumulative import time (in ms) of the interesting modules.
+    Modules missing from the result did not get imported at all.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {entry_module}'],
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'Could not import {entry_module}:\n{result.stderr}')
+
+    times = {}
+    # Lines look like: "import time:       142 |       3587 |   requests"
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line.split('|'))
+        if name in MODULES and cumulative.isdigit():
+            times[name] = int(cumulative) / 1000
+    return times
+
+
+def time_to_first_window():
+    """
+    Start the GUI (without a webdriver) in a new process and measure the time (in ms)
+    until its window is mapped, including the interpreter's startup.
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, 'main.py', '--startup-report'],
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    elapsed = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f'Could not start the GUI:\n{result.stderr}')
+
+    # The GUI prints the time since its first import, the rest is the interpreter
+    first_window = json.loads(result.stdout.strip().splitlines()[-1])['first_window']
+    return {'first_window': first_window, 'process': elapsed}
+
+
+def report(with_window=True):
+    """
+    Collect all startup timings.
+    """
+    timings = {'imports': import_times()}
+    if with_window:
+        timings['window'] = time_to_first_window()
+    return timings
+
+
+def print_report(timings):
+    print('Import times (cumulative, ms):')
+    for name in MODULES:
+        if name in timings['imports']:
+            print(f'  {name:<18} {timings["imports"][name]:>8.1f}')
+        else:
+            print(f'  {name:<18} {"not imported":>12}')
+
+    if 'window' in timings:
+        print(f'Time to first window: {timings["window"]["first_window"]:.1f} ms'
+              f' ({timings["window"]["process"]:.1f} ms including the interpreter)')
+
+
+if __name__ == '__main__':
+    print_report(report(with_window='--no-window' not in sys.argv))
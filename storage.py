@@ -0,0 +1,192 @@
+# BUILTIN
+import os
+import shutil
+import threading
+# CUSTOM
+from settings import config
+
+
+class DiskSpaceError(Exception):
+    pass
+
+
+def get_free_space(folder):
+    """
+    Get the free space (in bytes) of the disk a folder is on.
+    The folder doesn't need to exist yet.
+    """
+    folder = os.path.abspath(folder)
+    while not os.path.exists(folder):
+        folder = os.path.dirname(folder)
+    return shutil.disk_usage(folder).free
+
+
+def ensure_free_space(folder, needed):
+    """
+    Raise DiskSpaceError if writing needed bytes would leave less than config.min_free_space.
+    """
+    free = get_free_space(folder)
+    if free - needed < config.min_free_space:
+        raise DiskSpaceError(f'Not enough free space ({format_size(free)} free,'
+                             f' {format_size(needed)} needed)')
+
+
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            return f'{size:.0f} {unit}'
+        size /= 1024
+    return f'{size:.1f} TiB'
+
+
+def preallocate(dl_file, size):
+    """
+    Reserve the disk space of a whole file up front, so it's written in one piece
+    instead of growing chunk by chunk. Sets the file's size, only sparsely where the
+    file system can't preallocate.
+    """
+    dl_file.flush()
+    try:
+        os.posix_fallocate(dl_file.fileno(), 0, size)
+    except (AttributeError, OSError):
+        # Not available on Windows/macOS or not supported by the file system (e.g. some NFS)
+        dl_file.truncate(size)
+
+
+def open_part(part_file, mode):
+    """
+    Open a partial file with the configured write buffer.
+    """
+    return open(part_file, mode, buffering=config.write_buffer_size)
+
+
+def fsync_path(path):
+    """
+    Flush a file or a folder to the disk.
+    """
+    flags = os.O_RDONLY
+    if os.path.isdir(path):
+        flags |= getattr(os, 'O_DIRECTORY', 0)
+    try:
+        fd = os.open(path, flags)
+    except OSError:
+        # Folders can't be opened on Windows, renames are durable there anyway
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class FsyncQueue:
+    """
+    Make finished files durable according to config.fsync_policy:
+        'file'  -> fsync every file before it gets its final name, then its folder
+        'batch' -> keep finished files as partial files until config.fsync_batch_size
+                   of them (or the end of the batch) are reached, then fsync the whole
+                   group at once, rename it and fsync each folder once. Far fewer seeks
+                   for many small files on spinning or network storage. On a crash,
+                   the last group is still partial files, which get downloaded again
+        None    -> leave it to the operating system
+    A file only ever gets its final name once its content is on the disk, as a file
+    under its final name counts as downloaded (and gets skipped) from then on.
+    Use exists() to check for files instead, it knows about the files waiting for their group.
+    """
+    __slots__ = ('pending', 'callbacks', 'lock', 'flush_lock')
+
+    def __init__(self):
+        self.pending = {}  # Final path -> partial file, of the files waiting for the group
+        self.callbacks = {}  # Final path -> functions to call once it has its name
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()  # Only one group gets synced at a time
+
+    def finish(self, part_file, file_dst):
+        """
+        Give a completely written partial file its final name,
+        with 'batch' once its group is synced (see flush).
+        """
+        if config.fsync_policy == 'batch':
+            with self.lock:
+                self.pending[file_dst] = part_file
+                is_full = len(self.pending) >= config.fsync_batch_size
+            if is_full:
+                self.flush()
+            return
+
+        if config.fsync_policy == 'file':
+            fsync_path(part_file)
+        os.replace(part_file, file_dst)
+        if config.fsync_policy == 'file':
+            fsync_path(os.path.dirname(os.path.abspath(file_dst)))
+
+    def exists(self, file_dst):
+        """
+        Check if a file is downloaded, including files waiting for their group.
+        """
+        with self.lock:
+            if file_dst in self.pending:
+                return True
+        # Pending files only leave the queue once they have their name
+        return os.path.exists(file_dst)
+
+    def when_finished(self, file_dst, callback):
+        """
+        Call callback once a file has its final name, right away if it has it already.
+        """
+        with self.lock:
+            if file_dst in self.pending:
+                self.callbacks.setdefault(file_dst, []).append(callback)
+                return
+        callback()
+
+    def release(self, file_dst):
+        """
+        Give a waiting file its final name right away, without syncing it.
+        For intermediate files which get read (and deleted) right away,
+        e.g. the streams of a DASH video before they are merged.
+        """
+        with self.flush_lock:
+            with self.lock:
+                part_file = self.pending.pop(file_dst, None)
+                callbacks = self.callbacks.pop(file_dst, [])
+            if part_file is not None:
+                os.replace(part_file, file_dst)
+        for callback in callbacks:
+            callback()
+
+    def flush(self):
+        """
+        fsync all waiting files, then give them their final names
+        and fsync each of their folders once.
+        """
+        with self.flush_lock:
+            with self.lock:
+                group = list(self.pending.items())
+
+            # Cancelled and deleted meanwhile otherwise
+            group = [(file_dst, part_file) for file_dst, part_file in group
+                     if os.path.exists(part_file)]
+            for _, part_file in group:
+                fsync_path(part_file)
+            for file_dst, part_file in group:
+                os.replace(part_file, file_dst)
+            for folder in {os.path.dirname(os.path.abspath(file_dst)) for file_dst, _ in group}:
+                fsync_path(folder)
+
+            with self.lock:
+                callbacks = []
+                for file_dst, _ in group:
+                    self.pending.pop(file_dst, None)
+                    callbacks += self.callbacks.pop(file_dst, [])
+                # Files whose partial file is gone
+                for file_dst in [file_dst for file_dst, part_file in self.pending.items()
+                                 if not os.path.exists(part_file)]:
+                    del self.pending[file_dst]
+                    self.callbacks.pop(file_dst, None)
+
+        for callback in callbacks:
+            callback()
+
+
+# Shared by all downloads of the process, so the batches span all threads
+fsync_queue = FsyncQueue()
@@ -0,0 +1,289 @@
+# BUILTIN
+import json
+import os
+import time
+# CUSTOM
+import proxies
+from dispatch import Dispatcher
+from driver import Driver
+from lazy import lazy_import
+from scraping import Scraper
+from service import ConsoleLog
+from settings import config
+# PIP (imported on first use, see lazy.py)
+bs4 = lazy_import('bs4')
+
+KINDS = ('instagram', 'reddit')
+
+
+class WatchList:
+    """
+    Instagram profiles and subreddits to archive regularly,
+    each with the high-water mark (newest post seen) of its last sync.
+    """
+    __slots__ = ('path', 'entries')
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as watch_file:
+                self.entries = json.load(watch_file)
+
+    def save(self):
+        """
+        Write the watch list, replacing the old file only once the new one is complete.
+        """
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as watch_file:
+            json.dump(self.entries, watch_file, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def add(self, kind, name):
+        """
+        Add a source to the watch list, return False if it's already on it.
+        """
+        if kind not in KINDS:
+            raise ValueError(f'Unknown kind {kind!r}, expected one of {KINDS}')
+        if self.get(kind, name) is not None:
+            return False
+
+        self.entries.append({'kind': kind, 'name': name, 'mark': None})
+        self.save()
+        return True
+
+    def get(self, kind, name):
+        for entry in self.entries:
+            if entry['kind'] == kind and entry['name'].lower() == name.lower():
+                return entry
+        return None
+
+
+class Syncer:
+    """
+    Feed only the posts which are newer than the stored high-water mark
+    of each watched source into the dispatcher, then move the mark
+    once their files are downloaded (see move_marks).
+    Paging stops as soon as known content is reached.
+    """
+    __slots__ = ('dispatcher', 'watch_list', 'log_text', 'pending', 'retried')
+
+    def __init__(self, dispatcher, watch_list, log_text):
+        self.dispatcher = dispatcher
+        self.watch_list = watch_list
+        self.log_text = log_text
+        # (entry, posts, IDs of the posts which could not be processed) of every source
+        # synced since the last move_marks
+        self.pending = []
+        # IDs of posts which failed, processed again by the next sync even though
+        # their URLs count as added already for the rest of the session
+        self.retried = set()
+
+    def sync_all(self):
+        """
+        Sync every watched source, return the amount of new posts.
+        """
+        total = 0
+        for entry in self.watch_list.entries:
+            method = {
+                'instagram': self.sync_instagram,
+                'reddit': self.sync_reddit,
+            }[entry['kind']]
+
+            try:
+                total += method(entry)
+            except Exception as e:
+                # One broken source should not keep the others from syncing
+                self.log_text.newline(f'Could not sync {entry["kind"]} {entry["name"]}: {e!r}')
+        return total
+
+    def feed(self, entry, posts):
+        """
+        Process new posts oldest first. Their mark gets moved by move_marks
+        once the files are downloaded.
+        """
+        failed = set()
+        for post in reversed(posts):
+            try:
+                if post['id'] in self.retried:
+                    self.dispatcher.process_url(self.dispatcher.normalize_url(post['url']))
+                else:
+                    self.dispatcher.check_url(text=post['url'])
+            except Exception as e:
+                self.log_text.newline(f'Could not process {post["url"]}: {e!r}')
+                failed.add(post['id'])
+            # Sleep to not spam APIs
+            time.sleep(0.5)
+
+        if posts:
+            self.pending.append((entry, posts, failed))
+        self.log_text.newline(f'Synced {entry["kind"]} {entry["name"]}:'
+                              f' {len(posts)} new post(s)')
+        return len(posts)
+
+    def is_downloaded(self, post):
+        """
+        Check if all files of a processed post got downloaded.
+        """
+        scraper = self.dispatcher.scraper
+        source = self.dispatcher.normalize_url(post['url'])
+        return all(scraper.link_status.get(link) == 'done'
+                   for link in scraper.link_sources.get(source, []))
+
+    def move_marks(self):
+        """
+        Move the mark of every source synced since the last call, once the batch is
+        downloaded (before the scraper's batch gets reset). The mark stops short of
+        the oldest post which could not be processed or downloaded, so that post
+        and all newer ones get fed again by the next sync and nothing gets skipped.
+        """
+        for entry, posts, failed in self.pending:
+            failed_ids = {post['id'] for post in posts
+                          if post['id'] in failed or not self.is_downloaded(post)}
+            self.retried.difference_update(post['id'] for post in posts)
+            self.retried.update(failed_ids)
+            failed_times = [post['time'] for post in posts if post['id'] in failed_ids]
+            if failed_times:
+                posts = [post for post in posts if post['time'] < min(failed_times)]
+                self.log_text.newline(f'{len(failed_times)} post(s) of {entry["kind"]}'
+                                      f' {entry["name"]} failed - Retrying with the next sync')
+            if posts:
+                # Not necessarily the first one, pinned posts can be older
+                newest = max(posts, key=lambda post: post['time'])
+                entry['mark'] = {'id': newest['id'], 'time': newest['time']}
+
+        if self.pending:
+            self.watch_list.save()
+        self.pending = []
+
+    @staticmethod
+    def is_known(post, mark):
+        """
+        Check if a post is at or below the high-water mark.
+        """
+        return mark is not None and (post['id'] == mark['id'] or post['time'] <= mark['time'])
+
+    def sync_reddit(self, entry):
+        """
+        Page through the newest posts of a subreddit until reaching the mark.
+        """
+        mark = entry['mark']
+        posts = []
+        after = None
+
+        for _ in range(config.sync_max_pages):
+            params = {'limit': 100, 'raw_json': 1}
+            if after is not None:
+                params['after'] = after
+
+            res = proxies.get(f'https://www.reddit.com/r/{entry["name"]}/new.json',
+                               params=params, headers=config.headers, timeout=30)
+            res.raise_for_status()
+            listing = res.json()['data']
+
+            for child in listing['children']:
+                data = child['data']
+                post = {
+                    'id': data['name'],  # Fullname, e.g. t3_abc123
+                    'time': data['created_utc'],
+                    'url': f'https://www.reddit.com{data["permalink"]}',
+                }
+                if self.is_known(post, mark):
+                    return self.feed(entry, posts)
+                posts.append(post)
+
+                # Without a mark, only archive the newest posts instead of the whole history
+                if mark is None and len(posts) >= config.sync_initial_posts:
+                    return self.feed(entry, posts)
+
+            after = listing['after']
+            if after is None:
+                break
+
+        return self.feed(entry, posts)
+
+    def sync_instagram(self, entry):
+        """
+        Page through an Instagram profile's timeline until reaching the mark.
+        Uses the webdriver to be able to see private profiles which are being followed.
+        """
+        mark = entry['mark']
+        posts = []
+
+        driver = self.dispatcher.driver
+        driver.wait_until_started()
+        driver.navigate(f'https://www.instagram.com/{entry["name"]}/', profile='instagram')
+        soup = bs4.BeautifulSoup(driver.webdriver.page_source, features='html.parser')
+        user = self.dispatcher.scraper.get_ig_user(self.dispatcher.scraper.get_ig_data(soup))
+        timeline = user['edge_owner_to_timeline_media']
+
+        for page in range(config.sync_max_pages):
+            for index, edge in enumerate(timeline['edges']):
+                node = edge['node']
+                post = {
+                    'id': node['shortcode'],
+                    'time': node['taken_at_timestamp'],
+                    'url': f'https://www.instagram.com/p/{node["shortcode"]}/',
+                }
+                if self.is_known(post, mark):
+                    # Pinned posts come first regardless of their age
+                    if page == 0 and index < config.sync_ig_pinned_posts:
+                        continue
+                    return self.feed(entry, posts)
+                posts.append(post)
+
+                if mark is None and len(posts) >= config.sync_initial_posts:
+                    return self.feed(entry, posts)
+
+            page_info = timeline['page_info']
+            if not page_info['has_next_page']:
+                break
+            timeline = self.get_ig_timeline_page(user['id'], page_info['end_cursor'])
+
+        return self.feed(entry, posts)
+
+    def get_ig_timeline_page(self, user_id, cursor):
+        """
+        Get the next page of a profile's timeline from the GraphQL API,
+        through the webdriver so the login cookies are used.
+        """
+        variables = json.dumps({'id': user_id, 'first': 50, 'after': cursor})
+        self.dispatcher.driver.navigate(
+            'https://www.instagram.com/graphql/query/'
+            f'?query_hash={config.ig_timeline_query_hash}&variables={variables}',
+            profile='json',
+        )
+
+        data = self.dispatcher.driver.get_json(self.dispatcher.ig_graphql_re)
+        if data is None:
+            soup = bs4.BeautifulSoup(self.dispatcher.driver.webdriver.page_source,
+                                     features='html.parser')
+            data = json.loads(soup.find('pre').text)
+        return data['data']['user']['edge_owner_to_timeline_media']
+
+
+def run(once=False):
+    """
+    Sync the watch list and download the new files,
+    then repeat every config.sync_interval seconds unless once is set.
+    """
+    log_text = ConsoleLog()
+    driver = Driver(log_text)
+    driver.start_driver()
+    scraper = Scraper(log_text, log_text)
+    dispatcher = Dispatcher(scraper, driver, log_text, log_text, log_text)
+    syncer = Syncer(dispatcher, WatchList(config.watchlist_path), log_text)
+
+    try:
+        while True:
+            if syncer.sync_all():
+                scraper.download_files()
+                syncer.move_marks()
+                scraper.reset_batch()
+            if once:
+                break
+            time.sleep(config.sync_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        driver.quit_driver()
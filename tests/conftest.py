@@ -0,0 +1,15 @@
+"""
+Make the modules importable without installing them, and without a config.py:
+the tests run against the defaults of config_example.py where there is none.
+"""
+# BUILTIN
+import importlib
+import importlib.util
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config.py is a copy each user makes, a fresh checkout has none (see settings.py)
+if importlib.util.find_spec('config') is None:
+    sys.modules['config'] = importlib.import_module('config_example')
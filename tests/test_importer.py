@@ -0,0 +1,82 @@
+"""
+Reading exports in chunks: whatever the chunk size, the same tokens and URLs
+have to come out as when reading the file as a whole.
+
+    python -m pytest tests
+"""
+# CUSTOM (importable through conftest.py)
+import importer
+# PIP
+import pytest
+
+SAVED_POSTS = (
+    '{"kind": "Listing", "data": {"children": ['
+    '{"data": {"url": "https://i.redd.it/abcdef.jpg", "score": 12345,'
+    ' "preview": {"images": [{"source": {"url": "https://preview.redd.it/x.jpg"}}]},'
+    ' "title": "a \\"quoted\\" title", "over_18": false, "media": null}},'
+    '{"data": {"permalink": "/r/pics/comments/abc/title/", "is_video": true}}'
+    ']}}'
+)
+SAVED_POSTS_URLS = ['https://i.redd.it/abcdef.jpg',
+                    'https://www.reddit.com/r/pics/comments/abc/title/']
+
+TEXT = ('Look at https://www.instagram.com/p/BxKRx5CHn5i/, and then\n'
+        'https://imgur.com/gallery/5tJJkY3 (and https://v.redd.it/abc123).\n'
+        'https://twitter.com/NASA/status/1134859868346347520')
+TEXT_URLS = [
+    'https://www.instagram.com/p/BxKRx5CHn5i/',
+    'https://imgur.com/gallery/5tJJkY3',
+    'https://v.redd.it/abc123',
+    'https://twitter.com/NASA/status/1134859868346347520',
+]
+
+
+def write(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_text(content, encoding='utf-8')
+    return str(path)
+
+
+@pytest.mark.parametrize('chunk_size', range(1, 40))
+def test_json_tokens_across_chunks(tmp_path, monkeypatch, chunk_size):
+    # Strings, escapes and literals split at every possible position
+    monkeypatch.setattr(importer, 'CHUNK_SIZE', chunk_size)
+    path = write(tmp_path, 'saved.json', SAVED_POSTS)
+    assert list(importer.iter_json_tokens(path)) == importer.JSON_TOKEN_RE.findall(SAVED_POSTS)
+
+
+@pytest.mark.parametrize('content', ['[true, 12345, null]', '12345', '{"a": false}\n{"b": 1.5e3}'])
+@pytest.mark.parametrize('chunk_size', range(1, 8))
+def test_json_literal_at_chunk_end(tmp_path, monkeypatch, content, chunk_size):
+    monkeypatch.setattr(importer, 'CHUNK_SIZE', chunk_size)
+    path = write(tmp_path, 'literals.json', content)
+    assert list(importer.iter_json_tokens(path)) == importer.JSON_TOKEN_RE.findall(content)
+
+
+def test_json_unterminated_string(tmp_path, monkeypatch):
+    monkeypatch.setattr(importer, 'CHUNK_SIZE', 4)
+    monkeypatch.setattr(importer, 'MAX_JSON_STRING', 16)
+    path = write(tmp_path, 'broken.json', '{"url": "https://example.com/' + 'a' * 64)
+    with pytest.raises(ValueError, match='Unterminated string'):
+        list(importer.iter_json_tokens(path))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 16, 31, 64, 1024])
+def test_json_urls_across_chunks(tmp_path, monkeypatch, chunk_size):
+    monkeypatch.setattr(importer, 'CHUNK_SIZE', chunk_size)
+    path = write(tmp_path, 'saved.json', SAVED_POSTS)
+    assert list(importer.read_json(path)) == SAVED_POSTS_URLS
+
+
+@pytest.mark.parametrize('chunk_size', range(1, 60))
+def test_text_urls_across_chunks(tmp_path, monkeypatch, chunk_size):
+    monkeypatch.setattr(importer, 'CHUNK_SIZE', chunk_size)
+    path = write(tmp_path, 'urls.txt', TEXT)
+    assert list(importer.read_text(path)) == TEXT_URLS
+
+
+def test_text_overlong_word_dropped(tmp_path, monkeypatch):
+    monkeypatch.setattr(importer, 'CHUNK_SIZE', 8)
+    monkeypatch.setattr(importer, 'MAX_URL_LENGTH', 32)
+    path = write(tmp_path, 'urls.txt', 'x' * 100 + ' https://imgur.com/abc')
+    assert list(importer.read_text(path)) == ['https://imgur.com/abc']
@@ -0,0 +1,149 @@
+# BUILTIN
+import atexit
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+# CUSTOM
+from settings import config
+
+# Events kept in memory before they get appended to the trace file
+FLUSH_EVENTS = 1000
+
+
+def get_timestamp():
+    # Microseconds, the unit of the trace event format
+    return time.perf_counter_ns() / 1000
+
+
+class Tracer:
+    """
+    Record spans of work (resolving a URL, loading a page, parsing it, downloading a file)
+    on all threads and write them to config.trace_path in Chrome's trace event format,
+    which trace viewers (chrome://tracing, ui.perfetto.dev) show as one timeline per thread.
+    Every span carries the URL entered by the user it belongs to (args.source) and
+    flow arrows lead from where a link was found to where it got downloaded,
+    so the whole life of a URL can be followed across threads.
+    The file is a JSON array which is only closed by close(), trace viewers open
+    unclosed ones as well (e.g. of a session which is still running).
+    Disabled unless config.trace_path is set, spans cost next to nothing then.
+    """
+    __slots__ = ('path', 'events', 'links', 'flow_ids', 'threads', 'is_started', 'lock')
+
+    def __init__(self, path=None):
+        if path is None and config.trace_path is not None:
+            path = config.trace_path.format(pid=os.getpid(), time=time.strftime('%Y%m%d-%H%M%S'))
+        self.path = path
+        self.events = []
+        self.links = {}  # Link -> (flow ID, source) until the link gets downloaded
+        self.flow_ids = itertools.count(1)
+        self.threads = set()  # Threads whose name was recorded
+        self.is_started = False  # The file got created
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def add_event(self, event):
+        """
+        Record a trace event of the current thread.
+        """
+        thread_id = threading.get_native_id()
+        event.update(pid=os.getpid(), tid=thread_id)
+
+        with self.lock:
+            if thread_id not in self.threads:
+                self.threads.add(thread_id)
+                self.events.append({
+                    'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': thread_id,
+                    'args': {'name': threading.current_thread().name},
+                })
+            self.events.append(event)
+            is_full = len(self.events) >= FLUSH_EVENTS
+        if is_full:
+            self.flush()
+
+    @contextmanager
+    def span(self, name, link=None, **args):
+        """
+        Record the duration of a with-block. Yields the span's args, which can still be
+        added to (e.g. the bytes received) until the block ends.
+        If link is given, the flow started by add_link ends here and the span
+        gets attributed to the link's source.
+        """
+        if not self.enabled:
+            yield args
+            return
+
+        start = get_timestamp()
+        if link is not None:
+            with self.lock:
+                flow_id, source = self.links.pop(link, (None, None))
+            if source is not None:
+                args.setdefault('source', source)
+            if flow_id is not None:
+                # Binds to the span around it, which starts at the same time
+                self.add_event({'name': 'link', 'cat': 'flow', 'ph': 'f', 'bp': 'e',
+                                'id': flow_id, 'ts': start})
+        try:
+            yield args
+        except BaseException as e:
+            args.setdefault('error', repr(e))
+            raise
+        finally:
+            self.add_event({'name': name, 'cat': 'span', 'ph': 'X', 'ts': start,
+                            'dur': get_timestamp() - start, 'args': args})
+
+    def add_link(self, link, source):
+        """
+        Mark where a link was found, to draw an arrow to the span of its download.
+        Called from within the span of the extraction.
+        """
+        if not self.enabled:
+            return
+
+        flow_id = next(self.flow_ids)
+        with self.lock:
+            self.links[link] = (flow_id, source)
+        self.add_event({'name': 'link', 'cat': 'flow', 'ph': 's', 'id': flow_id,
+                        'ts': get_timestamp(), 'args': {'url': link, 'source': source}})
+
+    def flush(self):
+        """
+        Append the recorded events to the trace file.
+        """
+        if not self.enabled:
+            return
+
+        with self.lock:
+            events, self.events = self.events, []
+            if not events:
+                return
+            with open(self.path, 'a' if self.is_started else 'w', encoding='utf-8') as trace_file:
+                trace_file.write(',\n' if self.is_started else '[\n')
+                trace_file.write(',\n'.join(json.dumps(event) for event in events))
+            self.is_started = True
+
+    def close(self):
+        """
+        Write the remaining events and end the JSON array.
+        """
+        if not self.enabled:
+            return
+
+        self.flush()
+        with self.lock:
+            with open(self.path, 'a' if self.is_started else 'w', encoding='utf-8') as trace_file:
+                if not self.is_started:
+                    trace_file.write('[')
+                trace_file.write('\n]\n')
+            self.path = None
+
+
+# Shared by all threads of the process, so the whole session ends up in one timeline
+tracer = Tracer()
+if tracer.enabled:
+    atexit.register(tracer.close)
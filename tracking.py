@@ -0,0 +1,86 @@
+# BUILTIN
+import hashlib
+import math
+import threading
+
+
+class BloomFilter:
+    """
+    Fixed-size set membership test which never forgets an added item
+    but may claim to contain items which were never added,
+    with a probability of about error_rate once filled to capacity.
+    Not thread-safe on its own, see LinkTracker.
+    """
+    __slots__ = ('capacity', 'error_rate', 'size', 'hash_count', 'bits', 'count')
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+
+        # Optimal amount of bits and hash functions for the wanted error rate
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(math.ceil(self.size / 8))
+        self.count = 0
+
+    def get_positions(self, item):
+        """
+        Get the bit positions of an item (double hashing, Kirsch-Mitzenmacher).
+        """
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for pos in self.get_positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self.get_positions(item))
+
+    @property
+    def is_full(self):
+        return self.count >= self.capacity
+
+
+class LinkTracker:
+    """
+    Compact record of every link added during a session.
+    Grows by adding bigger filters with tighter error rates once one is full
+    (scalable Bloom filter), so the overall false positive rate
+    stays below error_rate no matter how many links get added.
+    Links get added by several threads at once (service jobs, streaming downloads),
+    checking for links needs no lock as bits are only ever set.
+    """
+    __slots__ = ('error_rate', 'filters', 'lock')
+
+    def __init__(self, capacity, error_rate):
+        self.error_rate = error_rate
+        # Halving the error rate per filter keeps the sum below error_rate
+        self.filters = [BloomFilter(capacity, error_rate / 2)]
+        self.lock = threading.Lock()
+
+    def add(self, link):
+        with self.lock:
+            if link in self:
+                return
+            if self.filters[-1].is_full:
+                last = self.filters[-1]
+                self.filters.append(BloomFilter(last.capacity * 2, last.error_rate / 2))
+            self.filters[-1].add(link)
+
+    def __contains__(self, link):
+        return any(link in bloom for bloom in self.filters)
+
+    def __len__(self):
+        return sum(bloom.count for bloom in self.filters)
+
+    @property
+    def memory_size(self):
+        """
+        Amount of bytes used by the bit arrays.
+        """
+        return sum(len(bloom.bits) for bloom in self.filters)
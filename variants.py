@@ -0,0 +1,97 @@
+# BUILTIN
+import re
+from concurrent.futures import ThreadPoolExecutor
+# CUSTOM
+import proxies
+from lazy import lazy_import
+from settings import config
+# PIP (imported on first use, see lazy.py)
+requests = lazy_import('requests')
+
+# Best resolution first
+YOUTUBE_THUMBNAILS = ('maxresdefault', 'sddefault', 'hqdefault', 'mqdefault', 'default')
+
+# Responses which mean a candidate doesn't exist, other ones (e.g. 403 or 405 of hosts
+# rejecting HEAD requests) don't tell
+MISSING_STATUSES = (404, 410)
+
+twimg_re = re.compile(r'^(https://pbs\.twimg\.com/media/[^:?]+)')
+
+
+def youtube_candidates(video_id):
+    """
+    Get the thumbnail URLs of a YouTube video, best resolution first.
+    """
+    return [f'https://img.youtube.com/vi/{video_id}/{name}.jpg'
+            for name in YOUTUBE_THUMBNAILS]
+
+
+def twitter_candidates(url):
+    """
+    Get the URLs of an image hosted on pbs.twimg.com, original size first.
+    """
+    match = twimg_re.match(url)
+    if not match:
+        return [url]
+
+    base_url = match.group(1)
+    candidates = [f'{base_url}:orig', f'{base_url}:large']
+    if url not in candidates:
+        candidates.append(url)
+    return candidates
+
+
+def instagram_candidates(node):
+    """
+    Get the URLs of an Instagram image (from a shortcode_media or edge node),
+    widest rendition first.
+    """
+    resources = sorted(node.get('display_resources', []),
+                       key=lambda resource: resource['config_width'], reverse=True)
+    candidates = [resource['src'] for resource in resources]
+    if node['display_url'] not in candidates:
+        candidates.append(node['display_url'])
+    return candidates
+
+
+def exists(url):
+    """
+    Check whether a URL points to an existing file using a HEAD request.
+    Return None if that can't be told (the request failed or got refused).
+    """
+    try:
+        res = proxies.head(url, headers=config.headers,
+                            timeout=config.variant_timeout, allow_redirects=True)
+    except requests.RequestException:
+        return None
+    if res.status_code == 200:
+        return True
+    if res.status_code in MISSING_STATUSES:
+        return False
+    return None
+
+
+def resolve(candidates):
+    """
+    Probe all candidate URLs concurrently and return the first one
+    (in order of preference) that exists. If none is known to exist, the first one
+    which couldn't be probed gets returned, None only if all of them are missing.
+    A single candidate is returned without probing it.
+    """
+    if len(candidates) == 1:
+        return candidates[0]
+
+    executor = ThreadPoolExecutor(max_workers=len(candidates))
+    futures = [executor.submit(exists, url) for url in candidates]
+    try:
+        unknown = None
+        for url, future in zip(candidates, futures):
+            is_existing = future.result()
+            if is_existing is True:
+                return url
+            if is_existing is None and unknown is None:
+                unknown = url
+        return unknown
+    finally:
+        # Less preferred candidates don't matter anymore once a better one exists
+        executor.shutdown(wait=False)
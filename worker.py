@@ -0,0 +1,268 @@
+# BUILTIN
+import os
+import socket
+import sqlite3
+import threading
+import time
+# CUSTOM
+from dispatch import Dispatcher
+from driver import Driver
+from scraping import Scraper
+from service import ConsoleLog
+from settings import config
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    status TEXT NOT NULL DEFAULT 'queued',
+    lease_owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    files INTEGER,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires);
+CREATE TABLE IF NOT EXISTS claims (
+    link TEXT PRIMARY KEY,
+    job_id INTEGER NOT NULL
+);
+"""
+
+
+class DownloadFailed(Exception):
+    """
+    Raised for a job some of whose files could not be downloaded,
+    or which no files were extracted from.
+    """
+    pass
+
+
+class UnsupportedURL(Exception):
+    """
+    Raised for a job whose URL none of the extractors accepts, trying again won't help.
+    """
+    pass
+
+
+class JobQueue:
+    """
+    Queue of URLs in an SQLite database which several worker processes
+    (on one or more hosts, with the database on a shared volume) lease jobs from.
+    A leased job is invisible to other workers until its lease runs out
+    (the visibility timeout), which the worker keeps extending while it's alive,
+    so jobs of crashed workers get picked up again.
+    Every extracted file gets claimed by one job, so files which several
+    URLs lead to are only downloaded once.
+    NOTE: SQLite's locking relies on the file system, use a volume with working
+    POSIX locks (e.g. NFSv4, not SMB or NFSv3 without lockd).
+    """
+    __slots__ = ('path', 'connection', 'lock')
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False,
+                                          isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params)
+
+    def put(self, url):
+        """
+        Queue a URL, return False if it was queued before.
+        """
+        now = time.time()
+        cursor = self.execute('INSERT OR IGNORE INTO jobs (url, created, updated) VALUES (?, ?, ?)',
+                              (url, now, now))
+        return cursor.rowcount == 1
+
+    def lease(self, worker_id):
+        """
+        Take the oldest job which is queued or whose lease ran out.
+        Return the job's row, or None if there is nothing to do.
+        """
+        now = time.time()
+        with self.lock:
+            # Take the write lock right away, so no other worker can lease the same job
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.connection.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued'"
+                    " OR (status = 'leased' AND lease_expires < ?)"
+                    ' ORDER BY id LIMIT 1',
+                    (now,),
+                ).fetchone()
+                if row is not None:
+                    self.connection.execute(
+                        "UPDATE jobs SET status = 'leased', lease_owner = ?, lease_expires = ?,"
+                        ' attempts = attempts + 1, updated = ? WHERE id = ?',
+                        (worker_id, now + config.queue_visibility_timeout, now, row['id']),
+                    )
+                self.connection.execute('COMMIT')
+            except sqlite3.Error:
+                self.connection.execute('ROLLBACK')
+                raise
+        return row
+
+    def extend(self, job_id, worker_id):
+        """
+        Renew the lease of a job, return False if the lease was lost to another worker.
+        """
+        now = time.time()
+        cursor = self.execute(
+            'UPDATE jobs SET lease_expires = ?, updated = ?'
+            " WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+            (now + config.queue_visibility_timeout, now, job_id, worker_id),
+        )
+        return cursor.rowcount == 1
+
+    def finish(self, job_id, worker_id, status, files=None, error=None, retry=True):
+        """
+        Mark a leased job as done or failed. Failed jobs are queued again
+        until they were attempted config.queue_max_attempts times, unless retry is False.
+        """
+        if status == 'failed' and retry:
+            status = ("CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END",
+                      config.queue_max_attempts)
+        else:
+            status = ('?', status)
+
+        self.execute(
+            f'UPDATE jobs SET status = {status[0]}, lease_owner = NULL, lease_expires = NULL,'
+            ' files = ?, error = ?, updated = ? WHERE id = ? AND lease_owner = ?',
+            (status[1], files, error, time.time(), job_id, worker_id),
+        )
+
+    def claim(self, link, job_id):
+        """
+        Claim a file for a job, return False if another job claimed it already.
+        A job retried after a crash keeps its claims.
+        """
+        self.execute('INSERT OR IGNORE INTO claims (link, job_id) VALUES (?, ?)', (link, job_id))
+        row = self.execute('SELECT job_id FROM claims WHERE link = ?', (link,)).fetchone()
+        return row['job_id'] == job_id
+
+    def release(self, links, job_id):
+        """
+        Give up the claims of a job on files it didn't download,
+        so other jobs leading to them (or this one, when retried) can claim them.
+        """
+        with self.lock:
+            self.connection.executemany('DELETE FROM claims WHERE link = ? AND job_id = ?',
+                                        [(link, job_id) for link in links])
+
+    def get_counts(self):
+        """
+        Get the amount of jobs per status.
+        """
+        rows = self.execute('SELECT status, COUNT(*) AS amount FROM jobs GROUP BY status')
+        return {row['status']: row['amount'] for row in rows}
+
+
+class Worker:
+    """
+    Lease URLs from the shared queue and run them through the usual
+    dispatch, extraction and download path, one at a time.
+    Run as many workers (processes or hosts) as the sites and the bandwidth allow.
+    """
+    __slots__ = ('queue', 'worker_id', 'log_text', 'driver', 'scraper', 'dispatcher')
+
+    def __init__(self, queue, worker_id=None):
+        self.queue = queue
+        self.worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.log_text = ConsoleLog()
+        self.driver = Driver(self.log_text)
+        self.scraper = Scraper(self.log_text, self.log_text)
+        # All files of a job get claimed before downloading
+        self.scraper.streaming = False
+        self.dispatcher = Dispatcher(self.scraper, self.driver,
+                                     self.log_text, self.log_text, self.log_text)
+
+    def run(self, once=False):
+        """
+        Work on jobs until interrupted, or until the queue is empty if once is set.
+        """
+        self.driver.start_driver()
+        self.log_text.newline(f'Worker {self.worker_id} started')
+        try:
+            while True:
+                job = self.queue.lease(self.worker_id)
+                if job is None:
+                    if once:
+                        break
+                    time.sleep(config.queue_poll_interval)
+                    continue
+                self.process(job)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.driver.quit_driver()
+            if self.scraper.catalog is not None:
+                self.scraper.catalog.close()
+
+    def keep_leased(self, job, stopped):
+        """
+        Extend the lease of a job until stopped is set.
+        """
+        while not stopped.wait(config.queue_visibility_timeout / 3):
+            if not self.queue.extend(job['id'], self.worker_id):
+                self.log_text.newline(f'Lost the lease of job {job["id"]}')
+                return
+
+    def process(self, job):
+        """
+        Resolve and download the URL of a leased job.
+        """
+        self.log_text.newline(f'Leased job {job["id"]} - {job["url"]}'
+                              f' (attempt {job["attempts"] + 1})')
+        stopped = threading.Event()
+        heartbeat = threading.Thread(target=self.keep_leased, args=(job, stopped), daemon=True)
+        heartbeat.start()
+
+        scraper = self.scraper
+        claimed = []
+        try:
+            url = self.dispatcher.normalize_url(job['url'])
+            if not self.dispatcher.is_url_supported(url):
+                raise UnsupportedURL(f'URL not accepted: {url}')
+            # Not through check_url: the links (and post URLs) of an earlier attempt
+            # count as added for the rest of the session, the job would come out empty
+            self.dispatcher.process_url(url)
+
+            links = scraper.download_links
+            if not links:
+                raise DownloadFailed('No files found')
+            for link in links:
+                if self.queue.claim(link, job['id']):
+                    claimed.append(link)
+            scraper.download_links = list(claimed)
+            if len(claimed) < len(links):
+                self.log_text.newline(f'Skipping {len(links) - len(claimed)}'
+                                      ' file(s) claimed by other jobs')
+
+            scraper.download_files()
+            failed = [link for link in scraper.download_links
+                      if scraper.link_status.get(link) == 'failed']
+            if failed:
+                raise DownloadFailed(f'{len(failed)} of {len(claimed)} file(s) failed')
+            self.queue.finish(job['id'], self.worker_id, 'done', files=len(claimed))
+        except Exception as e:
+            self.log_text.newline(f'Job {job["id"]} failed: {e!r}')
+            self.queue.finish(job['id'], self.worker_id, 'failed', error=repr(e),
+                              retry=not isinstance(e, UnsupportedURL))
+        finally:
+            # Expired links get replaced in place (see Scraper.renew_link),
+            # the claims are on the links as they were extracted
+            not_downloaded = [link for link, current in zip(claimed, scraper.download_links)
+                              if scraper.link_status.get(current) != 'done']
+            if not_downloaded:
+                self.queue.release(not_downloaded, job['id'])
+            scraper.reset_batch()
+            stopped.set()
+            heartbeat.join()